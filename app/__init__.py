@@ -25,23 +25,48 @@ def create_app(config_name='development'):
     from app.api.auth_endpoints import auth_bp
     from app.api.user_endpoints import edit_user_bp
     from app.api.products_endpoints import products_bp
+    from app.api.categories_endpoints import categories_bp
+    from app.api.cart_endpoints import cart_bp
+    from app.api.orders_endpoints import orders_bp
 
     app.register_blueprint(auth_bp, url_prefix='/api/auth')    
     app.register_blueprint(edit_user_bp, url_prefix='/api/user')
     app.register_blueprint(products_bp, url_prefix='/api/products')
+    app.register_blueprint(categories_bp, url_prefix='/api/categories')
+    app.register_blueprint(cart_bp, url_prefix='/api/cart')
+    app.register_blueprint(orders_bp, url_prefix='/api/orders')
+
+    from app.utils.utils_cache import catalog_cache
+    catalog_cache.init_app(app)
+
+    from app.utils.utils_passwords import PasswordHasherBusy, password_hasher
+    password_hasher.init_app(app)
+
+    from app.utils.utils_ratelimit import rate_limiter
+    rate_limiter.init_app(app)
+
+    from app.utils.utils_guest_carts import guest_carts
+    guest_carts.init_app(app)
+
+    from app.commands import register_commands
+    register_commands(app)
 
     with app.app_context():
         from app.models import (Address, BaseModel, Cart, CartItem, 
                                 Category, Coupon, Order, OrderItem, 
                                 Payment, Product, ProductImage, 
                                 ProductReview, ProductVariant, product_categories, 
-                                User, Wishlist, RevokedToken
+                                User, Wishlist, RevokedToken, StockReservation
                 )
 
     @app.errorhandler(404)
     def not_found(error):
         return {'error': 'Resource not found'}, 404
     
+    @app.errorhandler(PasswordHasherBusy)
+    def hasher_busy(error):
+        return {'error': 'Authentication service busy, please retry'}, 503, {'Retry-After': '1'}
+    
     @app.errorhandler(500)
     def internal_error(error):
         db.session.rollback()
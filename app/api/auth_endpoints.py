@@ -1,17 +1,21 @@
 from flask import Blueprint, current_app, request, jsonify
 from ..models.user import User
-from ..models import RevokedToken
 from app import db, jwt
 from ..utils.utils_auth import validate_email, validate_password
+from ..utils.utils_blocklist import token_blocklist, token_expiration
+from ..utils.utils_passwords import PasswordHasherBusy
+from ..utils.utils_users import request_user_erasure, user_cache
+from ..utils.utils_ratelimit import rate_limiter
 from flask_jwt_extended import (
     create_access_token, create_refresh_token, 
     jwt_required, jwt_required, get_jwt, jwt_required, get_jwt,
-    get_jwt_identity
+    current_user
 )
 
 auth_bp = Blueprint('auth', __name__)
 
 @auth_bp.route('/register', methods=['POST'])
+@rate_limiter.limit('register')
 def register():
 
     """Register a new user."""
@@ -63,11 +67,14 @@ def register():
             'token_type': 'Bearer'
         }), 201
     
+    except PasswordHasherBusy:
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({"msg": str(e)}), 500
     
 @auth_bp.route('/login', methods=['POST'])
+@rate_limiter.limit('login')
 def login():
 
     """Login a user and return JWT tokens"""
@@ -81,9 +88,16 @@ def login():
     
     user = User.filter_by_email(email)
     
-    if not user or not user.check_password(password):
+    if not user or user.deletion_requested_at or not user.check_password(password):
         return jsonify({"msg":"Invalid email or password"}), 401
     
+    """Upgrade the stored hash if the hashing parameters changed."""
+    try:
+        if user.rehash_password_if_needed(password):
+            user.save()
+    except RuntimeError as e:
+        current_app.logger.warning("Password rehash failed for user %s: %s", user.id, e)
+    
     access_token = create_access_token(identity=str(user.id))
     refresh_token = create_refresh_token(identity=str(user.id))
 
@@ -94,11 +108,9 @@ def login():
 def logout():
 
     """Loggout a user by revoking their JWT token."""
-    jti = get_jwt()['jti']
+    jwt_payload = get_jwt()
     try:
-        revoked_token = RevokedToken(jti)
-        db.session.add(revoked_token)
-        db.session.commit()
+        token_blocklist.revoke(jwt_payload['jti'], token_expiration(jwt_payload))
         return jsonify({"msg": "Successfully logged out"}), 200
     except Exception as e:
         db.session.rollback()
@@ -108,11 +120,7 @@ def logout():
 @jwt_required()
 def profile():
 
-    user_id = get_jwt_identity()
-    user = User.find_by_id(user_id)
-
-    if not user:
-        return jsonify({"msg": "User not found"}), 404
+    user = current_user
     
     return jsonify({
         'user': user.to_dict()
@@ -121,21 +129,35 @@ def profile():
 @auth_bp.route('/delete', methods=['DELETE'])
 @jwt_required()
 def delete():
-    user_id = get_jwt_identity()
-    user = User.find_by_id(user_id)
+    user = current_user
     
-    if not user:
-        return jsonify({"msg": "User not found"}), 404
-    
-    user.delete()
+    """Set-based erasure; very large accounts are erased asynchronously."""
+    try:
+        if request_user_erasure(user):
+            return jsonify({"msg": "User deletion scheduled"}), 202
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": str(e)}), 500
 
     return jsonify({"msg": "User deleted successfully"}), 200
 
+## Current user loader ##
+@jwt.user_lookup_loader
+def load_current_user(jwt_header, jwt_payload):
+    """Resolve the token identity once per request (cached per process for a few seconds)"""
+    user = user_cache.get(jwt_payload["sub"])
+    if user is None or user.deletion_requested_at:
+        return None
+    return user
+
+@jwt.user_lookup_error_loader
+def user_not_found_callback(jwt_header, jwt_payload):
+    return jsonify({"msg": "User not found"}), 404
+
 ## Errors token handlers ##
 @jwt.token_in_blocklist_loader
 def check_if_token_revoked(jwt_header, jwt_payload):
-    jti = jwt_payload["jti"]
-    return RevokedToken.query.filter_by(jti=jti).first() is not None
+    return token_blocklist.is_revoked(jwt_payload["jti"])
 
 @jwt.expired_token_loader
 def expired_token_callback(jwt_header, jwt_data):
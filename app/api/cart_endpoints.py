@@ -1,9 +1,14 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, current_app, request, jsonify, session
 from flask_jwt_extended import jwt_required, get_jwt_identity, jwt_required
 from sqlalchemy.exc import SQLAlchemyError
-from ..models import Cart, CartItem, Product, ProductVariant
+from ..models import Cart
+from ..utils.utils_cart import (
+    CartOperationError, add_cart_item, apply_cart_operations, cart_totals, clear_cart_items,
+    load_cart_view, merge_carts, parse_cart_operations, remove_cart_item, set_cart_item_quantity
+)
+from ..utils.utils_guest_carts import guest_carts
+from ..utils.utils_reservations import InsufficientStock
 from app import db
-from decimal import Decimal
 import uuid
 
 cart_bp = Blueprint('cart', __name__)
@@ -28,44 +33,9 @@ def get_or_create_cart(user_id=None, session_id=None):
     
     return cart
 
-def calculate_cart_totals(cart_id):
-    """Calculate subtotal and total items in the cart"""
-    cart_items = CartItem.query.filter_by(cart_id=cart_id).all()
-    
-    subtotal = Decimal('0.00')
-    total_items = 0
-    
-    # Loop through items to calculate totals
-    for item in cart_items:
-        item_total = Decimal(str(item.unit_price)) * item.quantity
-        subtotal += item_total
-        total_items += item.quantity
-    
-    return {
-        'subtotal': float(subtotal),
-        'total_items': total_items,
-        'items_count': len(cart_items)
-    }
-
-def validate_product_and_variant(product_id, variant_id=None):
-    """Validate product and optional variant"""
-    # Find the product
-    product = Product.query.filter_by(id=product_id, is_active=True).first()
-    if not product:
-        return None, None, "Product not found"
-    
-    # Si hay variante, verificarla
-    variant = None
-    if variant_id:
-        variant = ProductVariant.query.filter_by(
-            id=variant_id, 
-            product_id=product_id, 
-            is_active=True
-        ).first()
-        if not variant:
-            return None, None, "Variant not found or does not belong to the product"
-    
-    return product, variant, None
+def uses_guest_store(user_id):
+    """Anonymous carts live in the guest cart store instead of PostgreSQL"""
+    return not user_id and guest_carts.enabled
 
 @cart_bp.route('/get_cart', methods=['GET'])
 @jwt_required(optional=True)
@@ -87,70 +57,29 @@ def get_cart():
             # If user is logged in, no need for session_id
             session_id = None
         
-        cart = get_or_create_cart(user_id, session_id) # Get or create cart
-        
-        # This should never happen, but just in case
-        if not cart:
-            return jsonify({"error": "Critical error"}), 500
-        
-        # Get cart items with product and variant details
-        cart_items = db.session.query(CartItem).join(Product).filter(
-            CartItem.cart_id == cart.id,
-            Product.is_active == True
-        ).all()
-        
-        items_data = [] # List to hold time details
-        for item in cart_items: # Loop through each cart item
-            item_data = item.to_dict() # Start with basic item info
-            
-            # Add product details
-            product = item.product # Access related product
-            item_data['product'] = { 
-                'id': str(product.id),
-                'name': product.name,
-                'slug': product.slug,
-                'price': float(product.price),
-                'stock_quantity': product.stock_quantity,
-                'is_active': product.is_active
-            }
-            
-            # If there's a variant, add its details
-            if item.variant_id:
-                variant = item.variant
-                if variant:
-                    item_data['variant'] = {
-                        'id': str(variant.id),
-                        'name': variant.name,
-                        'price': float(variant.price) if variant.price else float(product.price),
-                        'stock_quantity': variant.stock_quantity,
-                        'attributes': variant.attributes
-                    }
-                    # Use variant price if available, otherwise product price
-                    item_data['current_price'] = float(variant.price) if variant.price else float(product.price)
-                else:
-                    # Variant ID is set but variant not found (maybe deleted)
-                    item_data['variant'] = None
-                    item_data['is_available'] = False
-            else:
-                item_data['current_price'] = float(product.price)
+        # Cart, items, products and variants in one query
+        if uses_guest_store(user_id):
+            view = guest_carts.view(session_id) # No se escribe nada para un carrito vacío
+        else:
+            view = load_cart_view(user_id, session_id)
+        if view is None:
+            cart = get_or_create_cart(user_id, session_id) # First visit: empty cart
             
-            # Check stock availability
-            available_stock = variant.stock_quantity if item.variant_id and variant else product.stock_quantity
-            item_data['is_available'] = available_stock >= item.quantity
-            item_data['available_stock'] = available_stock
+            # This should never happen, but just in case
+            if not cart:
+                return jsonify({"error": "Critical error"}), 500
             
-            items_data.append(item_data)
+            view = {'id': cart.id, 'updated_at': cart.updated_at, 'totals': cart.totals()}, []
         
-        # Calculate cart totals
-        totals = calculate_cart_totals(cart.id)
+        cart, items_data = view
         
         return jsonify({
-            "cart_id": str(cart.id),
+            "cart_id": str(cart['id']),
             "user_id": str(user_id) if user_id else None,
             "session_id": session_id,
             "items": items_data,
-            "totals": totals,
-            "updated_at": cart.updated_at.isoformat()
+            "totals": cart['totals'],
+            "updated_at": cart['updated_at'].isoformat()
         }), 200
         
     except Exception as e:
@@ -178,18 +107,12 @@ def add_to_cart():
         if quantity > 10:  # Limit to 10 items per addition
             return jsonify({"error": "Maximum quantity allowed: 10"}), 400
         
-        # Validate product and variant
-        product, variant, error = validate_product_and_variant(product_id, variant_id)
-        if error:
-            return jsonify({"error": error}), 404
-        
-        # Check stock availability
-        available_stock = variant.stock_quantity if variant else product.stock_quantity
-        if available_stock < quantity: # Not enough stock
-            return jsonify({
-                "error": "Not enough stock available",
-                "available_stock": available_stock
-            }), 400
+        # Validate UUIDs (product, variant and stock are checked by the upsert)
+        try:
+            product_id = uuid.UUID(str(product_id))
+            variant_id = uuid.UUID(str(variant_id)) if variant_id else None
+        except ValueError:
+            return jsonify({"error": "Invalid UUID"}), 400
         
         user_id = get_jwt_identity() # Get user ID if logged in
 
@@ -202,62 +125,48 @@ def add_to_cart():
         else: # If user is logged in, no need for session_id
             session_id = None
         
-        cart = get_or_create_cart(user_id, session_id) # Get or create cart
+        if uses_guest_store(user_id):
+            cart_id = guest_carts.cart_id(session_id)
+            result = guest_carts.add_item(session_id, product_id, variant_id, quantity)
+        else:
+            cart_id = get_or_create_cart(user_id, session_id).id # Get or create cart
+            # Single upsert: quantity += n with the stock ceiling and the totals delta in SQL
+            result = add_cart_item(cart_id, product_id, variant_id, quantity)
         
-        # Check if item already exists in cart
-        existing_item = CartItem.query.filter_by(
-            cart_id=cart.id,
-            product_id=product_id,
-            variant_id=variant_id
-        ).first()
+        if result is None:
+            message = "Variant not found or does not belong to the product" if variant_id else "Product not found"
+            return jsonify({"error": message}), 404
         
-        # If item exists, update quantity
-        if existing_item:
-            # Update quantity
-            new_quantity = existing_item.quantity + quantity
-            
-            # Check stock against available stock
-            if available_stock < new_quantity:
+        if result.item_id is None:
+            db.session.rollback()
+            if not result.in_cart: # Not enough stock
                 return jsonify({
-                    "error": "Insufficient stock for the requested quantity",
-                    "current_in_cart": existing_item.quantity,
-                    "available_stock": available_stock,
-                    "max_additional": available_stock - existing_item.quantity
+                    "error": "Not enough stock available",
+                    "available_stock": result.stock
                 }), 400
-            
-            existing_item.quantity = new_quantity
-            existing_item.updated_at = db.func.current_timestamp()
-            
-        else:
-            # Create new cart item
-            unit_price = variant.price if variant and variant.price else product.price
-            
-            cart_item = CartItem(
-                cart_id=cart.id,
-                product_id=product_id,
-                variant_id=variant_id,
-                quantity=quantity,
-                unit_price=unit_price
-            )
-            
-            db.session.add(cart_item)
-        
-        # Update cart timestamp
-        cart.updated_at = db.func.current_timestamp()
+            return jsonify({
+                "error": "Insufficient stock for the requested quantity",
+                "current_in_cart": result.in_cart,
+                "available_stock": result.stock,
+                "max_additional": max(result.stock - result.in_cart, 0)
+            }), 400
         
         db.session.commit()
         
-        # Calculate new totals
-        totals = calculate_cart_totals(cart.id)
-        
         return jsonify({
             "message": "Product successfully added to cart",
-            "cart_id": str(cart.id),
-            "product_name": product.name,
+            "cart_id": str(cart_id),
+            "product_name": result.product_name,
             "quantity_added": quantity,
-            "totals": totals
+            "totals": cart_totals(result)
         }), 200
         
+    except InsufficientStock as e:
+        db.session.rollback() # Las unidades están reservadas por otros carritos
+        return jsonify({
+            "error": "Not enough stock available",
+            "available_stock": e.available
+        }), 400
     except SQLAlchemyError as e:
         db.session.rollback()
         return jsonify({"error": "Database error", "details": str(e)}), 500
@@ -286,61 +195,64 @@ def update_cart_item():
         if quantity > 10:
             return jsonify({"error": "Maximum quantity allowed: 10"}), 400
         
-        # Get the cart item
-        cart_item = CartItem.query.filter_by(id=item_id).first()
-        if not cart_item:
-            return jsonify({"error": "Item not found"}), 404
+        try:
+            item_id = uuid.UUID(str(item_id))
+        except ValueError:
+            return jsonify({"error": "Invalid UUID"}), 400
         
-        # Check permissions
         user_id = get_jwt_identity()
         session_id = session.get('cart_session_id') if not user_id else None
-        
-        # Get de cart associated with the item
-        cart = Cart.query.filter_by(id=cart_item.cart_id).first()
-        if not cart or (cart.user_id != user_id and cart.session_id != session_id):
-            return jsonify({"error": "Do not have permission to modify this cart"}), 403
+        if not user_id and not session_id:
+            return jsonify({"error": "Item not found"}), 404
         
         # If quantity is 0, remove the item
         if quantity == 0:
-            product_name = cart_item.product.name # Get product name for message
-            db.session.delete(cart_item) # Delete the item
+            if uses_guest_store(user_id):
+                result = guest_carts.remove_item(session_id, item_id)
+            else:
+                result = remove_cart_item(item_id, user_id, session_id)
+            if result is None: # Not in the caller's cart
+                return jsonify({"error": "Item not found"}), 404
             db.session.commit()
             
-            totals = calculate_cart_totals(cart.id) # Recalculate totals
             return jsonify({
-                "message": f"Remove '{product_name}' from cart",
-                "totals": totals
+                "message": f"Remove '{result.product_name}' from cart",
+                "totals": cart_totals(result)
             }), 200
         
-        # Verificar stock disponible
-        product = cart_item.product
-        variant = cart_item.variant if cart_item.variant_id else None
-        available_stock = variant.stock_quantity if variant else product.stock_quantity
+        if uses_guest_store(user_id):
+            result = guest_carts.set_item_quantity(session_id, item_id, quantity)
+        else:
+            # Una sentencia: bloquea la línea, comprueba el stock y aplica el delta a los totales
+            result = set_cart_item_quantity(item_id, quantity, user_id, session_id)
+        if result is None: # Not in the caller's cart
+            return jsonify({"error": "Item not found"}), 404
         
-        if available_stock < quantity:
+        if result.item_id is None:
+            db.session.rollback()
             return jsonify({
                 "error": "Not enough stock available",
                 "requested_quantity": quantity,
-                "available_stock": available_stock
+                "available_stock": result.stock
             }), 400
         
-        # Actualizar cantidad
-        cart_item.quantity = quantity
-        cart_item.updated_at = db.func.current_timestamp()
-        cart.updated_at = db.func.current_timestamp()
-        
         db.session.commit()
         
-        totals = calculate_cart_totals(cart.id)
-        
         return jsonify({
             "message": "Quantity updated successfully",
-            "item_id": str(cart_item.id),
+            "item_id": str(item_id),
             "new_quantity": quantity,
-            "product_name": product.name,
-            "totals": totals
+            "product_name": result.product_name,
+            "totals": cart_totals(result)
         }), 200
         
+    except InsufficientStock as e:
+        db.session.rollback()
+        return jsonify({
+            "error": "Not enough stock available",
+            "requested_quantity": quantity,
+            "available_stock": e.available
+        }), 400
     except SQLAlchemyError as e:
         db.session.rollback()
         return jsonify({"error": "Database error", "details": str(e)}), 500
@@ -358,33 +270,25 @@ def remove_from_cart(item_id):
         except ValueError:
             return jsonify({"error": "Invalid UUID"}), 400
         
-        # Get the item
-        cart_item = CartItem.query.filter_by(id=item_id).first()
-        if not cart_item:
-            return jsonify({"error": "Item not found on cart"}), 404
-        
-        # Check permissions
         user_id = get_jwt_identity()
         session_id = session.get('cart_session_id') if not user_id else None
+        if not user_id and not session_id:
+            return jsonify({"error": "Item not found on cart"}), 404
         
-        cart = Cart.query.filter_by(id=cart_item.cart_id).first()
-        if not cart or (cart.user_id != user_id and cart.session_id != session_id):
-            return jsonify({"error": "Do not have permission"}), 403
-        
-        product_name = cart_item.product.name
+        if uses_guest_store(user_id):
+            result = guest_carts.remove_item(session_id, item_id)
+        else:
+            # Eliminar item y restar su parte de los totales en una sola sentencia
+            result = remove_cart_item(item_id, user_id, session_id)
+        if result is None: # No existe o no pertenece al carrito del usuario
+            return jsonify({"error": "Item not found on cart"}), 404
         
-        # Eliminar item
-        db.session.delete(cart_item)
-        cart.updated_at = db.func.current_timestamp()
         db.session.commit()
         
-        # Recalcular totales
-        totals = calculate_cart_totals(cart.id)
-        
         return jsonify({
-            "message": f"Product '{product_name}' deleted from cart",
+            "message": f"Product '{result.product_name}' deleted from cart",
             "removed_item_id": item_id,
-            "totals": totals
+            "totals": cart_totals(result)
         }), 200
         
     except SQLAlchemyError as e:
@@ -402,28 +306,30 @@ def clear_cart():
         session_id = session.get('cart_session_id') if not user_id else None
         
         # Buscar carrito
-        if user_id:
-            cart = Cart.query.filter_by(user_id=user_id).first()
-        elif session_id:
-            cart = Cart.query.filter_by(session_id=session_id).first()
+        if uses_guest_store(user_id) and session_id:
+            cart_id = guest_carts.cart_id(session_id)
+            result = guest_carts.clear(session_id)
         else:
-            return jsonify({"error": "Cart not found"}), 404
-        
-        if not cart:
-            return jsonify({"error": "Cart not found"}), 404
-        
-        # Contar items antes de eliminar
-        items_count = CartItem.query.filter_by(cart_id=cart.id).count()
-        
-        # Eliminar todos los items
-        CartItem.query.filter_by(cart_id=cart.id).delete()
-        cart.updated_at = db.func.current_timestamp()
+            if user_id:
+                cart = Cart.query.filter_by(user_id=user_id).first()
+            elif session_id:
+                cart = Cart.query.filter_by(session_id=session_id).first()
+            else:
+                return jsonify({"error": "Cart not found"}), 404
+            
+            if not cart:
+                return jsonify({"error": "Cart not found"}), 404
+            
+            # DELETE ... RETURNING y resta de totales en una sola sentencia
+            cart_id = cart.id
+            result = clear_cart_items(cart_id)
         
         db.session.commit()
         
         return jsonify({
-            "message": f"Carrito vaciado exitosamente. {items_count} items eliminados",
-            "cart_id": str(cart.id)
+            "message": f"Carrito vaciado exitosamente. {result.lines} items eliminados",
+            "cart_id": str(cart_id),
+            "totals": cart_totals(result)
         }), 200
         
     except SQLAlchemyError as e:
@@ -445,57 +351,33 @@ def merge_guest_cart():
         
         user_id = get_jwt_identity()
         
-        # Obtener carrito de invitado
-        guest_cart = Cart.query.filter_by(session_id=guest_session_id).first()
+        # Carrito de invitado en memoria: se persiste ahora para fusionarlo en SQL
+        if guest_carts.enabled:
+            guest_carts.persist(guest_session_id)
+        
+        # Obtener carrito de invitado (nunca el de otro usuario)
+        guest_cart = Cart.query.filter_by(session_id=guest_session_id, user_id=None).first()
         if not guest_cart:
             return jsonify({"error": "Carrito de invitado no encontrado"}), 404
+        guest_cart_id, guest_items = guest_cart.id, guest_cart.items_count
         
         # Obtener o crear carrito de usuario
         user_cart = get_or_create_cart(user_id=user_id)
+        user_cart_id = user_cart.id
         
-        # Obtener items del carrito de invitado
-        guest_items = CartItem.query.filter_by(cart_id=guest_cart.id).all()
-        merged_items = 0
-        
-        for guest_item in guest_items:
-            # Verificar si el item ya existe en el carrito del usuario
-            existing_item = CartItem.query.filter_by(
-                cart_id=user_cart.id,
-                product_id=guest_item.product_id,
-                variant_id=guest_item.variant_id
-            ).first()
-            
-            if existing_item:
-                # Sumar cantidades
-                existing_item.quantity += guest_item.quantity
-                existing_item.updated_at = db.func.current_timestamp()
-            else:
-                # Crear nuevo item en carrito de usuario
-                new_item = CartItem(
-                    cart_id=user_cart.id,
-                    product_id=guest_item.product_id,
-                    variant_id=guest_item.variant_id,
-                    quantity=guest_item.quantity,
-                    unit_price=guest_item.unit_price
-                )
-                db.session.add(new_item)
-            
-            merged_items += 1
-        
-        # Eliminar carrito de invitado
-        CartItem.query.filter_by(cart_id=guest_cart.id).delete()
-        db.session.delete(guest_cart)
-        
-        # Actualizar timestamp del carrito de usuario
-        user_cart.updated_at = db.func.current_timestamp()
+        # INSERT ... SELECT ... ON CONFLICT con tope de stock + borrado del carrito de invitado
+        merged_items, totals = merge_carts(guest_cart_id, user_cart_id)
         
         db.session.commit()
         
-        totals = calculate_cart_totals(user_cart.id)
+        if guest_carts.enabled:
+            guest_carts.discard(guest_session_id)
         
         return jsonify({
             "message": f"Carrito fusionado exitosamente. {merged_items} items procesados",
-            "cart_id": str(user_cart.id),
+            "cart_id": str(user_cart_id),
+            "merged_items": merged_items,
+            "skipped_items": guest_items - merged_items, # Sin stock o productos inactivos
             "totals": totals
         }), 200
         
@@ -505,6 +387,63 @@ def merge_guest_cart():
     except Exception as e:
         return jsonify({"error": "Error interno del servidor", "details": str(e)}), 500
 
+@cart_bp.route('/cart/batch', methods=['POST'])
+@jwt_required(optional=True)
+def batch_cart_operations():
+    """Apply many add/set/remove operations in one transaction and return the final cart"""
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        # Validar el lote completo antes de tocar la base de datos
+        try:
+            operations = parse_cart_operations(
+                data.get('operations'), current_app.config.get('CART_BATCH_MAX_OPERATIONS', 100)
+            )
+        except CartOperationError as e:
+            return jsonify(e.to_dict()), e.status
+        
+        user_id = get_jwt_identity()
+        if not user_id:
+            session_id = session.get('cart_session_id')
+            if not session_id:
+                session_id = str(uuid.uuid4())
+                session['cart_session_id'] = session_id
+        else:
+            session_id = None
+        
+        try:
+            if uses_guest_store(user_id):
+                applied = guest_carts.apply_operations(session_id, operations)
+            else:
+                applied = apply_cart_operations(get_or_create_cart(user_id, session_id).id, operations)
+        except CartOperationError as e:
+            db.session.rollback() # Nada se aplica si una operación falla
+            return jsonify(e.to_dict()), e.status
+        
+        db.session.commit()
+        
+        if uses_guest_store(user_id):
+            cart, items_data = guest_carts.view(session_id)
+        else:
+            cart, items_data = load_cart_view(user_id, session_id)
+        
+        return jsonify({
+            "message": "Cart updated successfully",
+            "applied": applied,
+            "cart_id": str(cart['id']),
+            "user_id": str(user_id) if user_id else None,
+            "session_id": session_id,
+            "items": items_data,
+            "totals": cart['totals'],
+            "updated_at": cart['updated_at'].isoformat()
+        }), 200
+        
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify({"error": "Database error", "details": str(e)}), 500
+    except Exception as e:
+        return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
 @cart_bp.route('/cart/count', methods=['GET'])
 @jwt_required(optional=True)
 def get_cart_count():
@@ -513,6 +452,14 @@ def get_cart_count():
         user_id = get_jwt_identity()
         session_id = session.get('cart_session_id') if not user_id else None
         
+        if uses_guest_store(user_id) and session_id:
+            totals = guest_carts.count(session_id)
+            return jsonify({
+                "items_count": totals['items_count'],
+                "total_quantity": totals['total_items'],
+                "cart_id": str(guest_carts.cart_id(session_id))
+            }), 200
+        
         # Buscar carrito
         if user_id:
             cart = Cart.query.filter_by(user_id=user_id).first()
@@ -524,18 +471,10 @@ def get_cart_count():
         if not cart:
             return jsonify({"items_count": 0, "total_quantity": 0}), 200
         
-        # Contar items y cantidad total
-        result = db.session.query(
-            db.func.count(CartItem.id),
-            db.func.sum(CartItem.quantity)
-        ).filter(CartItem.cart_id == cart.id).first()
-        
-        items_count = result[0] or 0
-        total_quantity = result[1] or 0
-        
+        # Conteos guardados en el carrito
         return jsonify({
-            "items_count": items_count,
-            "total_quantity": int(total_quantity),
+            "items_count": cart.items_count,
+            "total_quantity": cart.total_items,
             "cart_id": str(cart.id)
         }), 200
         
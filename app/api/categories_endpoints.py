@@ -0,0 +1,18 @@
+from flask import Blueprint, request, jsonify
+from ..utils.utils_categories import category_tree
+
+categories_bp = Blueprint('categories', __name__)
+
+@categories_bp.route('/tree', methods=['GET'])
+def get_category_tree():
+    """Get the category hierarchy with product counts per node"""
+    try:
+        include_inactive = request.args.get('include_inactive', False, type=bool)
+        tree = category_tree.get()
+
+        return jsonify({
+            'categories': tree.to_list(active_only=not include_inactive)
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, current_user
 from app.models import User, Address
 from app import db
 from ..utils.utils_auth import validate_password
@@ -10,11 +10,7 @@ edit_user_bp = Blueprint('edit_user', __name__)
 @jwt_required()
 def edit_address():
     """Create an address from an authenticated user."""
-    user_id = get_jwt_identity()
-    user = User.find_by_id(user_id)
-
-    if not user:
-        return jsonify({"msg": "User not found"}), 404
+    user = current_user
     
     request_data = request.get_json()
 
@@ -50,11 +46,7 @@ def edit_address():
 @jwt_required()
 def change_password():
     """Change password for an authenticated user."""
-    user_id = get_jwt_identity()
-    user = User.find_by_id(user_id)
-
-    if not user:
-        return jsonify({"msg": "User not found"}), 404
+    user = current_user
     
     request_data = request.get_json()
 
@@ -0,0 +1,77 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.exc import SQLAlchemyError
+from ..utils.utils_orders import (
+    CheckoutError, address_snapshot, checkout_cart, load_user_addresses, order_item_view
+)
+from app import db
+import uuid
+
+orders_bp = Blueprint('orders', __name__)
+
+def resolve_address(data, key, addresses):
+    """Address of the request: `<key>_id` (an address of the user) or an inline `<key>` object.
+    Returns: snapshot dict, None when not given, False when invalid"""
+    if data.get(f'{key}_id'):
+        return addresses.get(data[f'{key}_id'], False)
+    if key in data:
+        return address_snapshot(data[key]) or False
+    return None
+
+@orders_bp.route('/checkout', methods=['POST'])
+@jwt_required()
+def checkout():
+    """Create an order from the user's cart: stock, coupon, order and items in one transaction"""
+    try:
+        data = request.get_json(silent=True) or {}
+        user_id = get_jwt_identity()
+        
+        # Validar ids de direcciones antes de consultarlas
+        address_ids = []
+        for key in ('shipping_address_id', 'billing_address_id'):
+            if data.get(key):
+                try:
+                    data[key] = uuid.UUID(str(data[key]))
+                except ValueError:
+                    return jsonify({"error": "Invalid UUID", "field": key}), 400
+                address_ids.append(data[key])
+        
+        addresses = load_user_addresses(user_id, address_ids)
+        shipping_address = resolve_address(data, 'shipping_address', addresses)
+        if not shipping_address:
+            return jsonify({"error": "A valid shipping_address or shipping_address_id is required"}), 400
+        
+        billing_address = resolve_address(data, 'billing_address', addresses)
+        if billing_address is False:
+            return jsonify({"error": "Invalid billing address"}), 400
+        
+        coupon_code = data.get('coupon_code')
+        if coupon_code is not None and not isinstance(coupon_code, str):
+            return jsonify({"error": "coupon_code must be a string"}), 400
+        
+        try:
+            order, items = checkout_cart(
+                user_id,
+                shipping_address,
+                billing_address or shipping_address, # Por defecto se factura a la dirección de envío
+                coupon_code=coupon_code.strip() if coupon_code else None,
+                shipping_method=data.get('shipping_method'),
+                customer_notes=data.get('customer_notes')
+            )
+        except CheckoutError as e:
+            db.session.rollback() # Nada se descuenta ni se crea
+            return jsonify(e.to_dict()), e.status
+        
+        db.session.commit()
+        
+        return jsonify({
+            "message": "Order created successfully",
+            "order": {**order.to_dict(), "items": [order_item_view(item) for item in items]}
+        }), 201
+        
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify({"error": "Database error", "details": str(e)}), 500
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "Internal server error", "details": str(e)}), 500
@@ -1,8 +1,16 @@
-from flask import Blueprint, request, jsonify
-from sqlalchemy import or_, desc, asc
-from ..models import Product, Category, ProductVariant, ProductImage, product_categories
+from flask import Blueprint, current_app, request, jsonify
+from ..models import Product, ProductVariant, ProductImage
 from app import db
+from ..utils.utils_products import product_version, serialize_products
+from ..utils.utils_documents import get_product_document
+from ..utils.utils_pagination import InvalidCursor, KeysetPage, keyset_paginate
+from ..utils.utils_search import search_filter, search_rank
+from ..utils.utils_cache import catalog_cache
+from ..utils.utils_stats import product_stats
+from ..utils.utils_categories import category_tree, in_categories
+from ..utils.utils_facets import InvalidFacet, compute_facets, parse_facets
 from decimal import Decimal
+import hashlib
 import re
 import uuid
 
@@ -24,30 +32,75 @@ def validate_pagination_params(page, per_page):
         per_page = 10
     return page, per_page
 
+def get_sort_column(sort_by):
+    """Map the sort_by parameter to a Product column"""
+    if sort_by == 'name':
+        return Product.name
+    if sort_by == 'price':
+        return Product.price
+    return Product.created_at
+
+def paginate_products(query, order_by, page, per_page, signature):
+    """Paginate with OFFSET by default or by keyset when ?cursor= is present.
+    order_by: list of (expression, descending) pairs; Product.id is appended
+    as tie-breaker so both modes return a stable order."""
+    order_by = order_by + [(Product.id, order_by[-1][1])]
+
+    if 'cursor' in request.args:
+        return keyset_paginate(
+            query,
+            order_by,
+            per_page,
+            cursor=request.args.get('cursor', '').strip(),
+            signature=signature,
+            with_total=request.args.get('with_total', False, type=bool)
+        )
+
+    return query.order_by(*[
+        expression.desc() if descending else expression.asc() for expression, descending in order_by
+    ]).paginate(
+        page=page,
+        per_page=per_page,
+        error_out=False
+    )
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response if the client already holds this version, else None"""
+    if etag is None:
+        return None
+    if request.if_none_match:
+        is_fresh = etag in request.if_none_match
+    elif request.if_modified_since and last_modified:
+        is_fresh = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        is_fresh = False
+
+    if not is_fresh:
+        return None
+    return with_validators(current_app.response_class(status=304), etag, last_modified)
+
+def with_validators(response, etag, last_modified=None):
+    """Attach ETag, Last-Modified and Cache-Control headers to a response"""
+    if etag is None:
+        return response
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get('CATALOG_HTTP_MAX_AGE', 60)
+    return response
+
+def listing_etag():
+    """Page-level validator: the catalog generation plus the normalized query.
+    Changes whenever the catalog is invalidated, whether the cache is on or not"""
+    return hashlib.sha1(catalog_cache.make_key().encode()).hexdigest()
+
 def build_product_response(products_pagination, include_variants=False, include_images=False):
     """Build the response with products and pagination metadata"""
-    products_list = []
-    
-    for product in products_pagination.items:
-        product_data = product.to_dict()
-        
-        # Incluir variantes si se solicita
-        if include_variants:
-            variants = ProductVariant.query.filter_by(product_id=product.id, is_active=True).all()
-            product_data['variants'] = [variant.to_dict() for variant in variants]
-        
-        # Incluir imágenes si se solicita
-        if include_images:
-            images = ProductImage.query.filter_by(product_id=product.id).order_by(ProductImage.sort_order).all()
-            product_data['images'] = [image.to_dict() for image in images]
-        
-        # Incluir categorías
-        categories = db.session.query(Category).join(product_categories).filter(
-            product_categories.c.product_id == product.id
-        ).all()
-        product_data['categories'] = [cat.to_dict() for cat in categories]
-        
-        products_list.append(product_data)
+    products_list = serialize_products(products_pagination.items, include_variants, include_images)
+
+    if isinstance(products_pagination, KeysetPage):
+        return {'products': products_list, 'pagination': products_pagination.to_dict()}
     
     return {
         'products': products_list,
@@ -64,9 +117,16 @@ def build_product_response(products_pagination, include_variants=False, include_
     }
 
 @products_bp.route('/all', methods=['GET'])
+@catalog_cache.cached
 def get_products():
     """Get all products with filters, search, and pagination"""
     try:
+        # Validador de página: 304 sin ejecutar ninguna consulta
+        etag = listing_etag()
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        
         # Pagination parameters
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
@@ -88,22 +148,27 @@ def get_products():
         # Parámetros adicionales
         include_variants = request.args.get('include_variants', False, type=bool)
         include_images = request.args.get('include_images', False, type=bool)
+        include_subcategories = request.args.get('include_subcategories', False, type=bool)
+        facets = parse_facets(request.args.get('facets'))
         
         # Construir query base
         query = Product.query.filter(Product.is_active == True)
         
-        # Filtrar por categoría
+        # Filtrar por categoría (resuelta desde el árbol en memoria, sin consultas)
         if category_slug:
-            category = Category.query.filter_by(slug=category_slug).first()
+            category = category_tree.get().find_by_slug(category_slug)
             if not category:
                 return jsonify({'error': 'Category not found.'}), 404
-            category_id = category.id
+            category_id = category['category']['id']
 
         if category_id:
             if not is_valid_uuid(category_id):
                 return jsonify({'error': 'Category ID not valid.'}), 400
-            
-        query = query.join(product_categories).filter(product_categories.c.category_id == category_id)
+
+            category_ids = [category_id]
+            if include_subcategories:
+                category_ids = category_tree.get().descendant_ids(uuid.UUID(str(category_id)))
+            query = query.filter(in_categories(category_ids))
 
         # Filtrar por precio
         if min_price is not None:
@@ -119,49 +184,35 @@ def get_products():
         if in_stock:
             query = query.filter(Product.stock_quantity > 0)
         
-        # Búsqueda por texto
+        # Búsqueda por texto (full-text search sobre search_vector)
         if search:
-            search_term = f"%{search}%"
-            query = query.filter(
-                or_(
-                    Product.name.ilike(search_term),
-                    Product.short_description.ilike(search_term),
-                    Product.description.ilike(search_term),
-                    Product.sku.ilike(search_term)
-                )
-            )
-        
-        # Aplicar ordenamiento
-        if sort_by == 'name':
-            order_column = Product.name
-        elif sort_by == 'price':
-            order_column = Product.price
-        elif sort_by == 'created_at':
-            order_column = Product.created_at
-        else:
-            order_column = Product.created_at
-        
-        if sort_order == 'asc':
-            query = query.order_by(asc(order_column))
-        else:
-            query = query.order_by(desc(order_column))
-        
-        # Ejecutar paginación
-        products_pagination = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
+            query = query.filter(search_filter(search))
+        
+        # Ejecutar paginación (offset o cursor)
+        products_pagination = paginate_products(
+            query,
+            [(get_sort_column(sort_by), sort_order != 'asc')],
+            page,
+            per_page,
+            signature=f'all:{sort_by}:{sort_order}'
         )
         
         # Construir respuesta
         response = build_product_response(products_pagination, include_variants, include_images)
         
-        return jsonify(response), 200
+        # Conteos de facetas sobre el mismo conjunto filtrado (una sola consulta)
+        if facets:
+            response['facets'] = compute_facets(query, facets)
+        
+        return with_validators(jsonify(response), etag), 200
         
+    except (InvalidCursor, InvalidFacet) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @products_bp.route('/<product_id>', methods=['GET'])
+@catalog_cache.cached
 def get_product_by_id(product_id):
     """Get a specific product by ID"""
     try:
@@ -169,66 +220,48 @@ def get_product_by_id(product_id):
         if not is_valid_uuid(product_id):
             return jsonify({'error': 'Invalid product ID. Must be a valid UUID.'}), 400
         
-        product = Product.query.filter_by(id=product_id, is_active=True).first()
-        if not product:
+        # Documento precalculado: una sola lectura indexada por id
+        document = get_product_document(product_id=product_id)
+        if not document:
             return jsonify({'error': 'Product not found.'}), 404
-
-        # Construir respuesta completa
-        product_data = product.to_dict()
+        unchanged = not_modified(document.etag, document.updated_at)
+        if unchanged:
+            return unchanged
         
-        # Incluir variantes
-        variants = ProductVariant.query.filter_by(product_id=product.id, is_active=True).order_by(ProductVariant.created_at).all()
-        product_data['variants'] = [variant.to_dict() for variant in variants]
-        
-        # Incluir imágenes
-        images = ProductImage.query.filter_by(product_id=product.id).order_by(ProductImage.sort_order).all()
-        product_data['images'] = [image.to_dict() for image in images]
-        
-        # Incluir categorías
-        categories = db.session.query(Category).join(product_categories).filter(
-            product_categories.c.product_id == product.id
-        ).all()
-        product_data['categories'] = [cat.to_dict() for cat in categories]
-        
-        return jsonify(product_data), 200
+        return with_validators(jsonify(document.document), document.etag, document.updated_at), 200
         
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @products_bp.route('/slug/<slug>', methods=['GET'])
+@catalog_cache.cached
 def get_product_by_slug(slug):
     """Get a specific product by slug"""
     try:
-        product = Product.query.filter_by(slug=slug, is_active=True).first()
-        if not product:
+        # Documento precalculado: una sola lectura indexada por slug
+        document = get_product_document(slug=slug)
+        if not document:
             return jsonify({'error': 'Product not found.'}), 404
-
-        # Construir respuesta completa (similar a get_product_by_id)
-        product_data = product.to_dict()
+        unchanged = not_modified(document.etag, document.updated_at)
+        if unchanged:
+            return unchanged
         
-        # Incluir variantes
-        variants = ProductVariant.query.filter_by(product_id=product.id, is_active=True).order_by(ProductVariant.created_at).all()
-        product_data['variants'] = [variant.to_dict() for variant in variants]
-        
-        # Incluir imágenes
-        images = ProductImage.query.filter_by(product_id=product.id).order_by(ProductImage.sort_order).all()
-        product_data['images'] = [image.to_dict() for image in images]
-        
-        # Incluir categorías
-        categories = db.session.query(Category).join(product_categories).filter(
-            product_categories.c.product_id == product.id
-        ).all()
-        product_data['categories'] = [cat.to_dict() for cat in categories]
-        
-        return jsonify(product_data), 200
+        return with_validators(jsonify(document.document), document.etag, document.updated_at), 200
         
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @products_bp.route('/featured', methods=['GET'])
+@catalog_cache.cached
 def get_featured_products():
     """Get featured products"""
     try:
+        # Validador de página: 304 sin ejecutar ninguna consulta
+        etag = listing_etag()
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
         page, per_page = validate_pagination_params(page, per_page)
@@ -236,25 +269,33 @@ def get_featured_products():
         include_variants = request.args.get('include_variants', False, type=bool)
         include_images = request.args.get('include_images', True, type=bool)
         
-        products_pagination = Product.query.filter(
+        query = Product.query.filter(
             Product.is_active == True,
             Product.is_featured == True
-        ).order_by(desc(Product.created_at)).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
+        )
+        products_pagination = paginate_products(
+            query, [(Product.created_at, True)], page, per_page, signature='featured'
         )
         
         response = build_product_response(products_pagination, include_variants, include_images)
-        return jsonify(response), 200
+        return with_validators(jsonify(response), etag), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @products_bp.route('/search', methods=['GET'])
+@catalog_cache.cached
 def search_products():
     """Advanced product search"""
     try:
+        # Validador de página: 304 sin ejecutar ninguna consulta
+        etag = listing_etag()
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        
         search_term = request.args.get('q', '').strip()
         if not search_term:
             return jsonify({'error': 'Search term is required.'}), 400
@@ -263,42 +304,50 @@ def search_products():
         per_page = request.args.get('per_page', 10, type=int)
         page, per_page = validate_pagination_params(page, per_page)
         
-        # Búsqueda en múltiples campos
-        search_pattern = f"%{search_term}%"
-        products_pagination = Product.query.filter(
+        # Búsqueda full-text en name, short_description, description y sku
+        query = Product.query.filter(
             Product.is_active == True,
-            or_(
-                Product.name.ilike(search_pattern),
-                Product.short_description.ilike(search_pattern),
-                Product.description.ilike(search_pattern),
-                Product.sku.ilike(search_pattern)
-            )
-        ).order_by(
-            # Priorizar coincidencias en el nombre
-            Product.name.ilike(search_pattern).desc(),
-            desc(Product.created_at)
-        ).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
+            search_filter(search_term)
+        )
+        products_pagination = paginate_products(
+            query,
+            [
+                # Ordenar por relevancia (ts_rank, coincidencia exacta de sku primero)
+                (search_rank(search_term), True),
+                (Product.created_at, True)
+            ],
+            page,
+            per_page,
+            signature=f'search:{search_term}'
         )
         
         response = build_product_response(products_pagination, include_images=True)
         response['search_term'] = search_term
         
-        return jsonify(response), 200
+        return with_validators(jsonify(response), etag), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @products_bp.route('/category/<category_slug>', methods=['GET'])
+@catalog_cache.cached
 def get_products_by_category(category_slug):
     """Get products by specific category"""
     try:
-        # Find category
-        category = Category.query.filter_by(slug=category_slug, is_active=True).first()
-        if not category:
+        # Validador de página: 304 sin ejecutar ninguna consulta
+        etag = listing_etag()
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        
+        # Find category in the in-memory tree
+        tree = category_tree.get()
+        category = tree.find_by_slug(category_slug)
+        if not category or not category['is_active']:
             return jsonify({'error': 'Category not found.'}), 404
+        category_id = uuid.UUID(category['category']['id'])
 
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
@@ -307,45 +356,50 @@ def get_products_by_category(category_slug):
         # Parámetros de ordenamiento
         sort_by = request.args.get('sort_by', 'created_at')
         sort_order = request.args.get('sort_order', 'desc')
+        include_subcategories = request.args.get('include_subcategories', False, type=bool)
         
-        # Query de productos por categoría
-        query = Product.query.join(product_categories).filter(
-            product_categories.c.category_id == category.id,
+        # Query de productos por categoría (y sus subcategorías si se solicita)
+        category_ids = tree.descendant_ids(category_id) if include_subcategories else [category_id]
+        query = Product.query.filter(
+            in_categories(category_ids),
             Product.is_active == True
         )
         
-        # Aplicar ordenamiento
-        if sort_by == 'name':
-            order_column = Product.name
-        elif sort_by == 'price':
-            order_column = Product.price
-        else:
-            order_column = Product.created_at
-        
-        if sort_order == 'asc':
-            query = query.order_by(asc(order_column))
-        else:
-            query = query.order_by(desc(order_column))
-        
-        products_pagination = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
+        products_pagination = paginate_products(
+            query,
+            [(get_sort_column(sort_by), sort_order != 'asc')],
+            page,
+            per_page,
+            signature=f'category:{category_id}:{sort_by}:{sort_order}'
         )
         
         response = build_product_response(products_pagination, include_images=True)
-        response['category'] = category.to_dict()
+        response['category'] = category['category']
         
-        return jsonify(response), 200
+        return with_validators(jsonify(response), etag), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @products_bp.route('/<product_id>/variants', methods=['GET'])
+@catalog_cache.cached
 def get_product_variants(product_id):
     """Get product variants"""
     try:
-        # Validate product exists
+        if not is_valid_uuid(product_id):
+            return jsonify({'error': 'Invalid product ID. Must be a valid UUID.'}), 400
+
+        # Validate product exists and answer 304 if the client is up to date
+        version = product_version(product_id=product_id)
+        if not version:
+            return jsonify({'error': 'Product not found.'}), 404
+        _, etag, last_modified = version
+        unchanged = not_modified(etag, last_modified)
+        if unchanged:
+            return unchanged
+
         product = Product.query.filter_by(id=product_id, is_active=True).first()
         if not product:
             return jsonify({'error': 'Product not found.'}), 404
@@ -357,20 +411,32 @@ def get_product_variants(product_id):
         
         variants_list = [variant.to_dict() for variant in variants]
         
-        return jsonify({
+        return with_validators(jsonify({
             'product_id': product_id,
             'product_name': product.name,
             'variants': variants_list
-        }), 200
+        }), etag, last_modified), 200
         
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @products_bp.route('/<product_id>/images', methods=['GET'])
+@catalog_cache.cached
 def get_product_images(product_id):
     """Get product images"""
     try:
-        # Validate product exists
+        if not is_valid_uuid(product_id):
+            return jsonify({'error': 'Invalid product ID. Must be a valid UUID.'}), 400
+
+        # Validate product exists and answer 304 if the client is up to date
+        version = product_version(product_id=product_id)
+        if not version:
+            return jsonify({'error': 'Product not found.'}), 404
+        _, etag, last_modified = version
+        unchanged = not_modified(etag, last_modified)
+        if unchanged:
+            return unchanged
+
         product = Product.query.filter_by(id=product_id, is_active=True).first()
         if not product:
             return jsonify({'error': 'Product not found.'}), 404
@@ -382,48 +448,29 @@ def get_product_images(product_id):
         
         images_list = [image.to_dict() for image in images]
         
-        return jsonify({
+        return with_validators(jsonify({
             'product_id': product_id,
             'product_name': product.name,
             'images': images_list
-        }), 200
+        }), etag, last_modified), 200
         
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @products_bp.route('/stats', methods=['GET'])
 def get_products_stats():
-    """Get basic product statistics"""
+    """Get product statistics from the periodically refreshed snapshot"""
     try:
-        total_products = Product.query.filter_by(is_active=True).count()
-        featured_products = Product.query.filter_by(is_active=True, is_featured=True).count()
-        out_of_stock = Product.query.filter(
-            Product.is_active == True,
-            Product.stock_quantity == 0
-        ).count()
-        low_stock = Product.query.filter(
-            Product.is_active == True,
-            Product.stock_quantity <= Product.low_stock_threshold,
-            Product.stock_quantity > 0
-        ).count()
-        
-        # Precio promedio
-        avg_price_result = db.session.query(db.func.avg(Product.price)).filter(
-            Product.is_active == True
-        ).scalar()
-        avg_price = float(avg_price_result) if avg_price_result else 0
-        
-        return jsonify({
-            'total_products': total_products,
-            'featured_products': featured_products,
-            'out_of_stock': out_of_stock,
-            'low_stock': low_stock,
-            'average_price': round(avg_price, 2)
-        }), 200
+        return jsonify(product_stats.get()), 200
         
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
+@products_bp.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Get catalog response cache counters"""
+    return jsonify(catalog_cache.stats()), 200
+
 # Error handlers específicos para este blueprint
 @products_bp.errorhandler(404)
 def not_found(error):
@@ -0,0 +1,15 @@
+from .carts import carts_cli
+from .products import products_cli
+from .search import search_cli
+from .stock import stock_cli
+from .tokens import tokens_cli
+from .users import users_cli
+
+def register_commands(app):
+    """Register the maintenance CLI groups on the application"""
+    app.cli.add_command(carts_cli)
+    app.cli.add_command(products_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(stock_cli)
+    app.cli.add_command(tokens_cli)
+    app.cli.add_command(users_cli)
@@ -0,0 +1,35 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from ..utils.utils_cart import install_carts_schema, reap_abandoned_carts, verify_cart_totals
+
+carts_cli = AppGroup('carts', help='Shopping cart maintenance commands.')
+
+@carts_cli.command('migrate')
+def migrate():
+    """Add the stored totals and the unique line key to the cart tables."""
+    filled = install_carts_schema()
+    click.echo(f"Cart schema installed ({filled} carts backfilled)")
+
+@carts_cli.command('verify')
+@click.option('--repair', is_flag=True, help='Rewrite the totals that drifted from the items.')
+def verify(repair):
+    """Check the stored cart totals against their items."""
+    drifted = verify_cart_totals(repair=repair)
+    action = 'repaired' if repair else 'found'
+    click.echo(f"{drifted} carts with drifted totals {action}")
+
+@carts_cli.command('reap')
+@click.option('--max-age', type=int, default=None, help='Idle seconds before a guest cart is deleted (default: CART_ABANDONED_MAX_AGE).')
+@click.option('--batch-size', type=int, default=None, help='Carts deleted per transaction (default: CART_REAP_BATCH_SIZE).')
+def reap(max_age, batch_size):
+    """Delete abandoned guest carts in small batches (run it periodically, e.g. from cron)."""
+    config = current_app.config
+    reaped = reap_abandoned_carts(
+        max_age if max_age is not None else config.get('CART_ABANDONED_MAX_AGE', 30 * 24 * 3600),
+        batch_size or config.get('CART_REAP_BATCH_SIZE', 1000)
+    )
+    click.echo(
+        f"Reaped {reaped['carts']} abandoned guest carts ({reaped['items']} items) "
+        f"in {reaped['batches']} batches, {reaped['seconds']}s"
+    )
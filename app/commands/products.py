@@ -0,0 +1,19 @@
+import click
+from flask.cli import AppGroup
+from ..utils.utils_products import recompute_rating_aggregates
+from ..utils.utils_documents import rebuild_all_product_documents
+
+products_cli = AppGroup('products', help='Catalog maintenance commands.')
+
+@products_cli.command('recompute-ratings')
+def recompute_ratings():
+    """Rebuild the denormalized rating aggregates from approved reviews."""
+    repaired = recompute_rating_aggregates()
+    click.echo(f"Rating aggregates repaired for {repaired} products")
+
+@products_cli.command('rebuild-documents')
+@click.option('--batch-size', default=500, show_default=True, help='Products rebuilt per transaction.')
+def rebuild_documents(batch_size):
+    """Rebuild the precomputed product detail documents."""
+    stored = rebuild_all_product_documents(batch_size=batch_size)
+    click.echo(f"Detail documents rebuilt for {stored} products")
@@ -0,0 +1,19 @@
+import click
+from flask.cli import AppGroup
+from ..utils.utils_search import backfill_search_vectors, install_search_schema
+
+search_cli = AppGroup('search', help='Full-text search maintenance commands.')
+
+@search_cli.command('migrate')
+def migrate():
+    """Create the search_vector column, its trigger and GIN index."""
+    install_search_schema()
+    click.echo("Search schema installed")
+
+@search_cli.command('backfill')
+@click.option('--batch-size', default=1000, show_default=True, help='Products updated per transaction.')
+@click.option('--force', is_flag=True, help='Recompute every product, not only missing vectors.')
+def backfill(batch_size, force):
+    """Populate search_vector for existing products."""
+    updated = backfill_search_vectors(batch_size=batch_size, force=force)
+    click.echo(f"Search vectors updated for {updated} products")
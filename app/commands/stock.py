@@ -0,0 +1,88 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from app import db
+from ..models import Product, ProductVariant
+from ..utils.utils_reservations import (
+    hold_stock, install_stock_schema, release_cart_holds, sweep_expired_holds, verify_reserved_quantities
+)
+
+stock_cli = AppGroup('stock', help='Stock reservation maintenance commands.')
+
+@stock_cli.command('migrate')
+def migrate():
+    """Add reserved_quantity to products/variants, create the stock_reservations table and keep
+    reserved_quantity changes from touching updated_at."""
+    install_stock_schema()
+    click.echo("Stock reservation schema installed")
+
+@stock_cli.command('sweep')
+@click.option('--batch-size', type=int, default=None, help='Holds released per transaction (default: STOCK_HOLD_SWEEP_BATCH_SIZE).')
+def sweep(batch_size):
+    """Release expired stock holds (the app also does it in the background)."""
+    swept = sweep_expired_holds(batch_size or current_app.config.get('STOCK_HOLD_SWEEP_BATCH_SIZE', 1000))
+    click.echo(f"Released {swept['holds']} expired holds ({swept['units']} units)")
+
+@stock_cli.command('verify')
+@click.option('--repair', is_flag=True, help='Rewrite the reserved quantities that drifted from the holds.')
+def verify(repair):
+    """Check reserved_quantity of products and variants against their holds."""
+    drifted = verify_reserved_quantities(repair=repair)
+    action = 'repaired' if repair else 'found'
+    click.echo(f"{drifted} products/variants with drifted reserved quantity {action}")
+
+@stock_cli.command('load-test')
+@click.argument('product_id')
+@click.option('--variant-id', default=None, help='Hold a variant of the product instead.')
+@click.option('--shoppers', default=500, show_default=True, help='Carts racing for the stock.')
+@click.option('--quantity', default=1, show_default=True, help='Units each cart tries to hold.')
+@click.option('--workers', default=16, show_default=True, help='Concurrent threads (one connection each).')
+def load_test(product_id, variant_id, shoppers, quantity, workers):
+    """Race concurrent holds on one product and check that none oversells.
+
+    Every shopper holds `quantity` units for a throwaway cart id; the holds are
+    released at the end and stock_quantity is never changed."""
+    app = current_app._get_current_object()
+    product_id = uuid.UUID(product_id)
+    variant_id = uuid.UUID(variant_id) if variant_id else None
+    model = ProductVariant if variant_id else Product
+
+    def free_stock():
+        return db.session.query(model.stock_quantity - model.reserved_quantity).filter(
+            model.id == (variant_id or product_id)
+        ).scalar()
+
+    before = free_stock()
+    if before is None:
+        raise click.ClickException("Product or variant not found")
+    db.session.commit()
+
+    def shop(cart_id):
+        with app.app_context():
+            try:
+                held, _ = hold_stock(cart_id, product_id, variant_id, quantity, 600)
+                db.session.commit()
+                return held
+            finally:
+                db.session.remove()
+
+    carts = [uuid.uuid4() for _ in range(shoppers)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        held = sum(pool.map(shop, carts))
+    elapsed = time.perf_counter() - started
+
+    after = free_stock()
+    holds, units = release_cart_holds(carts)
+    db.session.commit()
+
+    click.echo(
+        f"{shoppers} shoppers x {quantity} units: {held} holds placed in {elapsed:.2f}s "
+        f"({shoppers / elapsed:.0f} attempts/s); free stock {before} -> {after}"
+    )
+    if held * quantity > max(before, 0) or after < 0 or units != held * quantity:
+        raise click.ClickException(f"Oversold: {held * quantity} units held, {before} were free, {units} recorded")
+    click.echo(f"No overselling: {units} units held, {max(before, 0) - units} left free")
@@ -0,0 +1,18 @@
+import click
+from flask.cli import AppGroup
+from ..utils.utils_blocklist import install_blocklist_schema, purge_expired_tokens
+
+tokens_cli = AppGroup('tokens', help='Revoked token maintenance commands.')
+
+@tokens_cli.command('migrate')
+def migrate():
+    """Add expires_at and the jti/expiry indexes to revoked_tokens."""
+    install_blocklist_schema()
+    click.echo("Revoked token schema installed")
+
+@tokens_cli.command('purge')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows deleted per transaction.')
+def purge(batch_size):
+    """Delete revoked tokens that have already expired."""
+    deleted = purge_expired_tokens(batch_size=batch_size)
+    click.echo(f"Purged {deleted} expired revoked tokens")
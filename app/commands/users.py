@@ -0,0 +1,79 @@
+import os
+import time
+import click
+from concurrent.futures import ThreadPoolExecutor
+from flask.cli import AppGroup
+from ..utils.utils_passwords import PasswordHasherBusy, create_hashing_pool, password_hasher
+from ..utils.utils_users import erase_pending_users, import_users, install_users_schema
+
+users_cli = AppGroup('users', help='User account commands.')
+
+@users_cli.command('bench-auth')
+@click.option('--requests', 'total', default=200, show_default=True, help='Verifications to run.')
+@click.option('--concurrency', default=16, show_default=True, help='Simulated concurrent request threads.')
+def bench_auth(total, concurrency):
+    """Measure password verification throughput through the hashing pool."""
+    password = 'Benchmark1!'
+    password_hash = password_hasher.hash(password)
+
+    def attempt(_):
+        started = time.perf_counter()
+        try:
+            password_hasher.verify(password_hash, password)
+            return time.perf_counter() - started
+        except PasswordHasherBusy:
+            return None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(attempt, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(result for result in results if result is not None)
+    rejected = total - len(latencies)
+    click.echo(f"method={password_hasher.method} workers={password_hasher.workers} concurrency={concurrency}")
+    click.echo(f"{len(latencies)} verified, {rejected} rejected (503) in {elapsed:.2f}s "
+               f"-> {len(latencies) / elapsed:.1f} verifications/s")
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        click.echo(f"latency p50={p50 * 1000:.0f}ms p95={p95 * 1000:.0f}ms")
+
+@users_cli.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'file_format', type=click.Choice(['auto', 'csv', 'ndjson']), default='auto',
+              show_default=True, help='Input format; auto uses the file extension.')
+@click.option('--batch-size', default=1000, show_default=True, help='Users inserted per transaction.')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True,
+              help='Processes hashing plain-text passwords (0 hashes inline).')
+def import_users_command(source, file_format, batch_size, workers):
+    """Bulk import customers (and their addresses) from a CSV or NDJSON file."""
+    if file_format == 'auto':
+        file_format = 'ndjson' if source.name.endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+
+    executor = create_hashing_pool(workers) if workers else None
+    try:
+        report = import_users(source, file_format=file_format, batch_size=batch_size, executor=executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    for line_number, reason in report['errors']:
+        click.echo(f"line {line_number}: {reason}", err=True)
+    elapsed = report['elapsed'] or 1e-9
+    click.echo(f"Imported {report['inserted']} users and {report['addresses']} addresses; "
+               f"{report['skipped']} already existed, {report['rejected']} rejected")
+    click.echo(f"{report['read']} rows in {elapsed:.2f}s -> {report['read'] / elapsed:.0f} rows/s")
+
+@users_cli.command('migrate')
+def migrate():
+    """Add deletion_requested_at and the ON DELETE rules used by account erasure."""
+    install_users_schema()
+    click.echo("User schema installed")
+
+@users_cli.command('erase-pending')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows deleted per transaction.')
+def erase_pending(batch_size):
+    """Finish account erasures that were scheduled but not completed."""
+    erased = erase_pending_users(batch_size=batch_size)
+    click.echo(f"Erased {erased} pending accounts")
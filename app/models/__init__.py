@@ -9,12 +9,14 @@ from .order import Order
 from .order_item import OrderItem
 from .payment import Payment
 from .product import Product
+from .product_document import ProductDocument
 from .product_image import ProductImage
 from .product_review import ProductReview
 from .product_variant import ProductVariant
 from .user import User
 from .wishlist import Wishlist
 from .revoked_token import RevokedToken
+from .stock_reservation import StockReservation
 
 __all__ = [
     'Address', 
@@ -27,11 +29,13 @@ __all__ = [
     'OrderItem',
     'Payment',
     'Product',
+    'ProductDocument',
     'ProductImage',
     'ProductReview',
     'ProductVariant',
     'product_categories',
     'User',
     'Wishlist',
-    'RevokedToken'
+    'RevokedToken',
+    'StockReservation'
     ]
\ No newline at end of file
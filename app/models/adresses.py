@@ -6,7 +6,7 @@ from sqlalchemy.exc import OperationalError, InterfaceError, DBAPIError
 class Address(BaseModel):
     __tablename__ = 'addresses'
     
-    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     street_address = db.Column(db.String(255), nullable=False)
     apartment = db.Column(db.String(100))
     city = db.Column(db.String(100), nullable=False)
@@ -1,7 +1,7 @@
 from app import db
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
-from sqlalchemy import func
+from sqlalchemy import func, inspect
 
 class BaseModel(db.Model):
     """Modelo base con campos comunes"""
@@ -9,4 +9,12 @@ class BaseModel(db.Model):
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     created_at = db.Column(db.DateTime(timezone=True), default=func.now())
-    updated_at = db.Column(db.DateTime(timezone=True), default=func.now(), onupdate=func.now())
\ No newline at end of file
+    updated_at = db.Column(db.DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+def committed_value(instance, attribute):
+    """Return the value an attribute had before the current flush
+    (for after_update/after_delete listeners; the column needs active_history)"""
+    history = inspect(instance).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(instance, attribute)
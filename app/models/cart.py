@@ -5,19 +5,37 @@ from sqlalchemy.dialects.postgresql import UUID
 class Cart(BaseModel):
     __tablename__ = 'carts'
     
-    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'))
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id', ondelete='CASCADE'))
     session_id = db.Column(db.String(255))
+
+    # Totales mantenidos por los eventos de CartItem (ver cart_item._apply_totals)
+    subtotal = db.Column(db.Numeric(12, 2), nullable=False, default=0, server_default='0')
+    total_items = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    items_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
-    # Relaciones
-    items = db.relationship('CartItem', backref='cart', cascade='all, delete-orphan')
-    
-    @property
-    def total_items(self):
-        return sum(item.quantity for item in self.items)
+    # Búsqueda del carrito por dueño y borrado por antigüedad de carritos abandonados
+    __table_args__ = (
+        db.Index('idx_carts_user_id', 'user_id'),
+        db.Index('idx_carts_session_id', 'session_id'),
+        db.Index('idx_carts_updated_at', 'updated_at'),
+    )
     
-    @property
-    def subtotal(self):
-        return sum(item.total_price for item in self.items)
+    # Relaciones
+    items = db.relationship('CartItem', backref='cart', cascade='all, delete-orphan', passive_deletes=True)
+
+    def totals(self):
+        """Stored cart totals (no query over the items)"""
+        return {
+            'subtotal': float(self.subtotal or 0),
+            'total_items': self.total_items or 0,
+            'items_count': self.items_count or 0
+        }
+
+    def reset_totals(self):
+        """Zero the totals after deleting every item with a bulk statement"""
+        self.subtotal = 0
+        self.total_items = 0
+        self.items_count = 0
     
     def to_dict(self):
         return {
@@ -26,4 +44,4 @@ class Cart(BaseModel):
             'subtotal': float(self.subtotal),
             'items': [item.to_dict() for item in self.items],
             'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+        }
@@ -1,15 +1,25 @@
 from app import db
-from .basemodel import BaseModel
+from .basemodel import BaseModel, committed_value
+from .cart import Cart
+from sqlalchemy import event, inspect
 from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
 
 class CartItem(BaseModel):
     __tablename__ = 'cart_items'
     
-    cart_id = db.Column(UUID(as_uuid=True), db.ForeignKey('carts.id'), nullable=False)
+    cart_id = db.Column(UUID(as_uuid=True), db.ForeignKey('carts.id', ondelete='CASCADE'), nullable=False)
     product_id = db.Column(UUID(as_uuid=True), db.ForeignKey('products.id'), nullable=False)
     variant_id = db.Column(UUID(as_uuid=True), db.ForeignKey('product_variants.id'))
-    quantity = db.Column(db.Integer, nullable=False)
-    unit_price = db.Column(db.Numeric(10, 2), nullable=False)
+    # active_history: los eventos necesitan los valores previos para ajustar los totales del carrito
+    quantity = db.column_property(db.Column(db.Integer, nullable=False), active_history=True)
+    unit_price = db.column_property(db.Column(db.Numeric(10, 2), nullable=False), active_history=True)
+    
+    # Una línea por (carrito, producto, variante); NULLS NOT DISTINCT cubre las líneas sin variante
+    __table_args__ = (
+        db.Index('uq_cart_items_line', 'cart_id', 'product_id', 'variant_id', unique=True, postgresql_nulls_not_distinct=True),
+    )
     
     # Relaciones
     product = db.relationship('Product')
@@ -28,4 +38,51 @@ class CartItem(BaseModel):
             'quantity': self.quantity,
             'unit_price': float(self.unit_price),
             'total_price': float(self.total_price)
-        }
\ No newline at end of file
+        }
+
+## Mantenimiento incremental de los totales del carrito ##
+def _apply_totals(connection, item, cart_id, quantity, amount, count):
+    """Add the deltas to the cart totals with one atomic UPDATE ... RETURNING"""
+    carts = Cart.__table__
+    totals = connection.execute(
+        carts.update()
+        .where(carts.c.id == cart_id)
+        .values({
+            carts.c.subtotal: carts.c.subtotal + amount,
+            carts.c.total_items: carts.c.total_items + quantity,
+            carts.c.items_count: carts.c.items_count + count,
+            carts.c.updated_at: db.func.now()
+        })
+        .returning(carts.c.subtotal, carts.c.total_items, carts.c.items_count, carts.c.updated_at)
+    ).first()
+
+    # Publicar los totales devueltos en el carrito de la sesión: leerlos no requiere otra consulta
+    session = object_session(item)
+    if session is None or totals is None:
+        return
+    cart = session.identity_map.get(inspect(Cart).identity_key_from_primary_key((cart_id,)))
+    if cart is not None:
+        for key, value in zip(('subtotal', 'total_items', 'items_count', 'updated_at'), totals):
+            setcommitted_value(cart, key, value)
+
+@event.listens_for(CartItem, 'after_insert')
+def cart_item_inserted(mapper, connection, target):
+    _apply_totals(connection, target, target.cart_id, target.quantity, target.unit_price * target.quantity, 1)
+
+@event.listens_for(CartItem, 'after_update')
+def cart_item_updated(mapper, connection, target):
+    old_quantity = committed_value(target, 'quantity')
+    old_price = committed_value(target, 'unit_price')
+    if (old_quantity, old_price) == (target.quantity, target.unit_price):
+        return
+    _apply_totals(
+        connection, target, target.cart_id,
+        target.quantity - old_quantity,
+        target.unit_price * target.quantity - old_price * old_quantity,
+        0
+    )
+
+@event.listens_for(CartItem, 'after_delete')
+def cart_item_deleted(mapper, connection, target):
+    quantity = committed_value(target, 'quantity')
+    _apply_totals(connection, target, target.cart_id, -quantity, -committed_value(target, 'unit_price') * quantity, -1)
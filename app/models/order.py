@@ -6,7 +6,7 @@ class Order(BaseModel):
     __tablename__ = 'orders'
     
     order_number = db.Column(db.String(50), unique=True, nullable=False)
-    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'))
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id', ondelete='SET NULL'))
     status = db.Column(db.String(20), default='pending', index=True)
     payment_status = db.Column(db.String(20), default='pending')
     
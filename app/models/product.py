@@ -1,6 +1,7 @@
 from app import db
+from sqlalchemy import event, func
 from .basemodel import BaseModel
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from .associations import product_categories
 
 class Product(BaseModel):
@@ -19,22 +20,48 @@ class Product(BaseModel):
     is_active = db.Column(db.Boolean, default=True, index=True)
     is_featured = db.Column(db.Boolean, default=False, index=True)
     stock_quantity = db.Column(db.Integer, default=0)
+    # Unidades retenidas por reservas de carritos (ver utils_reservations)
+    reserved_quantity = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     low_stock_threshold = db.Column(db.Integer, default=5)
     manage_stock = db.Column(db.Boolean, default=True)
     allow_backorders = db.Column(db.Boolean, default=False)
     meta_title = db.Column(db.String(255))
     meta_description = db.Column(db.Text)
 
+    # Agregados de reseñas aprobadas, mantenidos por los eventos de ProductReview
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_1_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_2_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_3_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_4_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_5_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # Documento de búsqueda ponderado, mantenido por un trigger (ver utils_search)
+    search_vector = db.deferred(db.Column(TSVECTOR))
+
     categories = db.relationship('Category', secondary=product_categories, backref='products')
     variants = db.relationship('ProductVariant', backref='product', cascade='all, delete-orphan')
     images = db.relationship('ProductImage', backref='product', cascade='all, delete-orphan')
     reviews = db.relationship('ProductReview', backref='product', cascade='all, delete-orphan')
+
+    # Índices compuestos para la paginación por cursor (columna de orden + id)
+    __table_args__ = (
+        db.Index('idx_products_created_at_id', 'created_at', 'id'),
+        db.Index('idx_products_name_id', 'name', 'id'),
+        db.Index('idx_products_price_id', 'price', 'id'),
+        db.Index('idx_products_search_vector', 'search_vector', postgresql_using='gin'),
+    )
    
     @property
     def average_rating(self):
-        if not self.reviews:
+        if not self.rating_count:
             return 0
-        return sum(review.rating for review in self.reviews) / len(self.reviews)
+        return self.rating_sum / self.rating_count
+
+    @property
+    def rating_histogram(self):
+        return {str(star): getattr(self, f'rating_{star}_count') or 0 for star in range(1, 6)}
     
     @property
     def is_in_stock(self):
@@ -59,7 +86,8 @@ class Product(BaseModel):
             'stock_quantity': self.stock_quantity,
             'is_in_stock': self.is_in_stock,
             'average_rating': self.average_rating,
-            'review_count': len(self.reviews)
+            'review_count': self.rating_count or 0,
+            'rating_histogram': self.rating_histogram
         }
 
         if include_variants:
@@ -68,4 +96,10 @@ class Product(BaseModel):
         if include_images:
             data['images'] = [image.to_dict() for image in self.images]
             
-        return data
\ No newline at end of file
+        return data
+
+@event.listens_for(Product.categories, 'append')
+@event.listens_for(Product.categories, 'remove')
+def touch_product_categories(target, value, initiator):
+    """Bump updated_at when category membership changes (used by the ETag)"""
+    target.updated_at = func.now()
@@ -0,0 +1,15 @@
+from app import db
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.sql import func
+
+class ProductDocument(db.Model):
+    """Denormalized detail document of an active product (product, variants,
+    images, categories and rating aggregates), rebuilt on every catalog change."""
+
+    __tablename__ = 'product_documents'
+
+    product_id = db.Column(UUID(as_uuid=True), db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    slug = db.Column(db.String(255), unique=True, nullable=False, index=True)
+    document = db.Column(JSONB, nullable=False)
+    etag = db.Column(db.String(40), nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now())
@@ -1,18 +1,22 @@
 from app import db
 from sqlalchemy.dialects.postgresql import UUID
-from .basemodel import BaseModel
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+from .basemodel import BaseModel, committed_value
+from .product import Product
 
 class ProductReview(BaseModel):
     __tablename__ = 'product_reviews'
     
-    product_id = db.Column(UUID(as_uuid=True), db.ForeignKey('products.id'), nullable=False)
-    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False)
+    # active_history: los eventos necesitan el valor previo para ajustar los agregados del producto
+    product_id = db.column_property(db.Column(UUID(as_uuid=True), db.ForeignKey('products.id'), nullable=False), active_history=True)
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     order_id = db.Column(UUID(as_uuid=True), db.ForeignKey('orders.id'))
-    rating = db.Column(db.Integer, nullable=False)
+    rating = db.column_property(db.Column(db.Integer, nullable=False), active_history=True)
     title = db.Column(db.String(255))
     comment = db.Column(db.Text)
     is_verified = db.Column(db.Boolean, default=False)
-    is_approved = db.Column(db.Boolean, default=False)
+    is_approved = db.column_property(db.Column(db.Boolean, default=False), active_history=True)
     helpful_votes = db.Column(db.Integer, default=0)
     
     # Constraint única para evitar múltiples reviews del mismo producto por el mismo usuario/orden
@@ -31,4 +35,54 @@ class ProductReview(BaseModel):
             'helpful_votes': self.helpful_votes,
             'user_name': self.user.full_name,
             'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+# Valores que cuentan en los agregados; create_database.sql los restringe con un CHECK
+RATING_STARS = range(1, 6)
+
+def _apply_rating(connection, review, product_id, rating, sign):
+    """Add (sign=1) or remove (sign=-1) one approved rating from the product aggregates.
+    Ratings outside 1..5 (or missing) have no star column and are left out"""
+    if rating not in RATING_STARS:
+        return
+    products = Product.__table__
+    star_column = products.c[f'rating_{rating}_count']
+    connection.execute(
+        products.update()
+        .where(products.c.id == product_id)
+        .values({
+            products.c.rating_sum: products.c.rating_sum + sign * rating,
+            products.c.rating_count: products.c.rating_count + sign,
+            star_column: star_column + sign
+        })
+    )
+
+    # Los agregados cambiaron en la base; refrescarlos si el producto está en la sesión
+    session = object_session(review)
+    if session is None:
+        return
+    product = session.identity_map.get(inspect(Product).identity_key_from_primary_key((product_id,)))
+    if product is not None:
+        session.expire(product, ['rating_sum', 'rating_count'] + [f'rating_{star}_count' for star in range(1, 6)])
+
+@event.listens_for(ProductReview, 'after_insert')
+def review_inserted(mapper, connection, target):
+    if target.is_approved:
+        _apply_rating(connection, target, target.product_id, target.rating, 1)
+
+@event.listens_for(ProductReview, 'after_update')
+def review_updated(mapper, connection, target):
+    old = (committed_value(target, 'product_id'), committed_value(target, 'rating'), committed_value(target, 'is_approved'))
+    new = (target.product_id, target.rating, target.is_approved)
+    if old == new:
+        return
+
+    if old[2]:
+        _apply_rating(connection, target, old[0], old[1], -1)
+    if new[2]:
+        _apply_rating(connection, target, new[0], new[1], 1)
+
+@event.listens_for(ProductReview, 'after_delete')
+def review_deleted(mapper, connection, target):
+    if committed_value(target, 'is_approved'):
+        _apply_rating(connection, target, committed_value(target, 'product_id'), committed_value(target, 'rating'), -1)
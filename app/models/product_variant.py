@@ -12,6 +12,8 @@ class ProductVariant(BaseModel):
     compare_price = db.Column(db.Numeric(10, 2))
     cost_price = db.Column(db.Numeric(10, 2))
     stock_quantity = db.Column(db.Integer, default=0)
+    # Unidades retenidas por reservas de carritos (ver utils_reservations)
+    reserved_quantity = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     weight = db.Column(db.Numeric(8, 3))
     is_active = db.Column(db.Boolean, default=True)
     attributes = db.Column(JSONB) 
@@ -9,14 +9,17 @@ class RevokedToken(db.Model):
     
     __tablename__ = "revoked_tokens"
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    jti = db.Column(db.String(120), nullable=False)
-    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    jti = db.Column(db.String(120), nullable=False, unique=True, index=True)
+    # Vencimiento del token revocado: pasada esta fecha la fila se puede purgar
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), index=True)
 
     @classmethod
-    def add(cls, jti):
-        revoked_token = cls(jti=jti)
+    def add(cls, jti, expires_at):
+        revoked_token = cls(jti=jti, expires_at=expires_at)
         db.session.add(revoked_token)
         db.session.commit()
         
-    def __init__(self, jti):
-        self.jti = jti
\ No newline at end of file
+    def __init__(self, jti, expires_at):
+        self.jti = jti
+        self.expires_at = expires_at
@@ -0,0 +1,28 @@
+from app import db
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+import uuid
+
+class StockReservation(db.Model):
+
+    """Temporary hold of stock for one cart line (see utils_reservations).
+    
+    The units are also counted in reserved_quantity of the product (or variant),
+    so the stock available to other carts is stock_quantity - reserved_quantity."""
+    
+    __tablename__ = "stock_reservations"
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # Sin clave foránea: borrar un carrito no debe borrar sus reservas sin descontarlas
+    # de reserved_quantity; las reservas huérfanas vencen y las libera el barrido
+    cart_id = db.Column(UUID(as_uuid=True), nullable=False)
+    product_id = db.Column(UUID(as_uuid=True), db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    variant_id = db.Column(UUID(as_uuid=True), db.ForeignKey('product_variants.id', ondelete='CASCADE'))
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+    # Una reserva por línea del carrito; el barrido recorre las vencidas por expires_at
+    __table_args__ = (
+        db.Index('uq_stock_reservations_line', 'cart_id', 'product_id', 'variant_id', unique=True, postgresql_nulls_not_distinct=True),
+        db.Index('idx_stock_reservations_expires_at', 'expires_at'),
+    )
@@ -1,6 +1,6 @@
 from app import db
 from .basemodel import BaseModel
-from werkzeug.security import generate_password_hash, check_password_hash
+from ..utils.utils_passwords import password_hasher
 from sqlalchemy.exc import OperationalError, InterfaceError, DBAPIError
 
 class User(BaseModel):
@@ -15,12 +15,14 @@ class User(BaseModel):
     date_of_birth = db.Column(db.Date)
     is_active = db.Column(db.Boolean, default=True)
     is_verified = db.Column(db.Boolean, default=False)
+    # Marcada cuando la cuenta espera su borrado asíncrono (ver utils_users.request_user_erasure)
+    deletion_requested_at = db.Column(db.DateTime(timezone=True))
 
-    addresses = db.relationship('Address', backref='user', cascade='all, delete-orphan')
-    carts = db.relationship('Cart', backref='user', cascade='all, delete-orphan')
-    orders = db.relationship('Order', backref='user')
-    reviews = db.relationship('ProductReview', backref='user', cascade='all, delete-orphan')
-    wishlist = db.relationship('Wishlist', backref='user', cascade='all, delete-orphan')
+    addresses = db.relationship('Address', backref='user', cascade='all, delete-orphan', passive_deletes=True)
+    carts = db.relationship('Cart', backref='user', cascade='all, delete-orphan', passive_deletes=True)
+    orders = db.relationship('Order', backref='user', passive_deletes=True)
+    reviews = db.relationship('ProductReview', backref='user', cascade='all, delete-orphan', passive_deletes=True)
+    wishlist = db.relationship('Wishlist', backref='user', cascade='all, delete-orphan', passive_deletes=True)
         
     def __init__(self, email, password, first_name, last_name, phone=None, date_of_birth=None):
         super().__init__()
@@ -32,10 +34,18 @@ class User(BaseModel):
         self.date_of_birth = date_of_birth
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def rehash_password_if_needed(self, password):
+        """Re-hash an already verified password when the configured hash parameters changed.
+        Returns: True if password_hash was updated (the caller must save)"""
+        if not password_hasher.needs_rehash(self.password_hash):
+            return False
+        self.set_password(password)
+        return True
     
     @classmethod
     def filter_by_email(cls, email):
@@ -43,7 +53,7 @@ class User(BaseModel):
     
     @classmethod
     def find_by_id(cls, user_id):
-        return cls.query.get(user_id)
+        return db.session.get(cls, user_id)
     
     @classmethod
     def find_by_username(cls, username):
@@ -5,7 +5,7 @@ from .basemodel import BaseModel
 class Wishlist(BaseModel):
     __tablename__ = 'wishlists'
     
-    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     product_id = db.Column(UUID(as_uuid=True), db.ForeignKey('products.id'), nullable=False)
     
     # Relaciones
@@ -0,0 +1,202 @@
+import hashlib
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from app import db
+from ..models import RevokedToken
+
+# Margen al leer filas nuevas: cubre transacciones que confirman después de su created_at
+SYNC_OVERLAP = timedelta(seconds=60)
+
+BLOCKLIST_SCHEMA_SQL = [
+    "ALTER TABLE revoked_tokens ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITH TIME ZONE",
+    # Filas previas sin vencimiento: se asume la vida máxima de un token
+    "UPDATE revoked_tokens SET expires_at = created_at + make_interval(secs => :lifetime) WHERE expires_at IS NULL",
+    "DELETE FROM revoked_tokens a USING revoked_tokens b WHERE a.jti = b.jti AND a.ctid > b.ctid",
+    "ALTER TABLE revoked_tokens ALTER COLUMN expires_at SET NOT NULL",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_revoked_tokens_jti ON revoked_tokens(jti)",
+    "CREATE INDEX IF NOT EXISTS ix_revoked_tokens_expires_at ON revoked_tokens(expires_at)",
+    "CREATE INDEX IF NOT EXISTS ix_revoked_tokens_created_at ON revoked_tokens(created_at)",
+]
+
+class BloomFilter:
+    """Compact set with no false negatives: a miss means the key was never added"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Doble hashing: k posiciones a partir de dos hashes de 64 bits
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        added = False
+        for position in self._positions(key):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+def token_expiration(jwt_payload):
+    """Expiry of a decoded token; tokens without 'exp' live as long as a refresh token"""
+    if jwt_payload.get('exp') is not None:
+        return datetime.fromtimestamp(jwt_payload['exp'], tz=timezone.utc)
+    lifetime = current_app.config.get('JWT_REFRESH_TOKEN_EXPIRES') or timedelta(days=30)
+    return datetime.now(timezone.utc) + lifetime
+
+def purge_expired_tokens(batch_size=1000):
+    """Delete revoked tokens that already expired, in batches.
+    Returns: number of deleted rows"""
+    statement = text("""
+        DELETE FROM revoked_tokens WHERE id IN (
+            SELECT id FROM revoked_tokens WHERE expires_at < now() LIMIT :batch_size
+        )
+    """)
+    deleted = 0
+    while True:
+        result = db.session.execute(statement, {'batch_size': batch_size})
+        db.session.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+def install_blocklist_schema():
+    """Add expires_at and the jti/expiry indexes to an existing revoked_tokens table"""
+    lifetime = current_app.config.get('JWT_REFRESH_TOKEN_EXPIRES') or timedelta(days=30)
+    for statement in BLOCKLIST_SCHEMA_SQL:
+        db.session.execute(text(statement), {'lifetime': lifetime.total_seconds()})
+    db.session.commit()
+
+class TokenBlocklist:
+    """In-process view of revoked_tokens.
+
+    A Bloom filter holding every unexpired revoked jti answers the common case
+    (token not revoked) without touching the database. Possible hits are
+    confirmed against the unique jti index and remembered in a small LRU.
+    The filter is refreshed incrementally from rows created since the last
+    sync, and rebuilt after each background purge of expired rows."""
+
+    def __init__(self):
+        self._filter = None
+        self._cursor = None
+        self._synced_at = 0
+        self._purged_at = time.monotonic()
+        self._purging = False
+        self._rebuild = False
+        self._confirmed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, since=None):
+        query = db.session.query(RevokedToken.jti, RevokedToken.created_at).filter(
+            RevokedToken.expires_at > db.func.now()
+        )
+        if since is not None:
+            query = query.filter(RevokedToken.created_at >= since - SYNC_OVERLAP)
+        return query.all()
+
+    def _build_filter(self):
+        config = current_app.config
+        rows = self._load()
+        capacity = max(config.get('BLOCKLIST_BLOOM_CAPACITY', 100000), 2 * len(rows))
+        bloom = BloomFilter(capacity, config.get('BLOCKLIST_BLOOM_ERROR_RATE', 0.001))
+        for jti, _ in rows:
+            bloom.add(jti)
+        self._filter = bloom
+        self._cursor = max((created_at for _, created_at in rows), default=None)
+        self._rebuild = False
+
+    def _sync(self):
+        config = current_app.config
+        if self._filter is not None and not self._rebuild and \
+                time.monotonic() - self._synced_at < config.get('BLOCKLIST_SYNC_INTERVAL', 2):
+            return
+
+        with self._lock:
+            if self._filter is None or self._rebuild:
+                self._build_filter()
+            elif time.monotonic() - self._synced_at >= config.get('BLOCKLIST_SYNC_INTERVAL', 2):
+                rows = self._load(since=self._cursor)
+                for jti, created_at in rows:
+                    self._filter.add(jti)
+                    self._cursor = created_at if self._cursor is None else max(self._cursor, created_at)
+                # Filtro saturado: reconstruir con más capacidad para mantener la tasa de error
+                if self._filter.count > self._filter.capacity:
+                    self._build_filter()
+            self._synced_at = time.monotonic()
+
+            if not self._purging and time.monotonic() - self._purged_at >= config.get('BLOCKLIST_PURGE_INTERVAL', 3600):
+                self._purging = True
+                app = current_app._get_current_object()
+                threading.Thread(target=self._purge, args=(app,), daemon=True).start()
+
+    def _purge(self, app):
+        try:
+            with app.app_context():
+                try:
+                    deleted = purge_expired_tokens()
+                finally:
+                    db.session.remove()
+            app.logger.info('Purged %s expired revoked tokens', deleted)
+        except Exception:
+            app.logger.exception('Revoked token purge failed')
+        with self._lock:
+            self._purged_at = time.monotonic()
+            self._purging = False
+            self._rebuild = True
+
+    def _remember(self, jti):
+        self._confirmed[jti] = True
+        self._confirmed.move_to_end(jti)
+        while len(self._confirmed) > current_app.config.get('BLOCKLIST_CONFIRMED_CACHE_SIZE', 10000):
+            self._confirmed.popitem(last=False)
+
+    def is_revoked(self, jti):
+        self._sync()
+        if jti not in self._filter:
+            return False
+
+        with self._lock:
+            if jti in self._confirmed:
+                self._confirmed.move_to_end(jti)
+                return True
+
+        # Posible positivo (o falso positivo del filtro): confirmar con el índice único
+        revoked = db.session.query(RevokedToken.id).filter_by(jti=jti).first() is not None
+        if revoked:
+            with self._lock:
+                self._remember(jti)
+        return revoked
+
+    def revoke(self, jti, expires_at):
+        """Persist a revocation (idempotent) and make it visible to this process at once"""
+        db.session.execute(
+            insert(RevokedToken.__table__).values(
+                id=uuid.uuid4(), jti=jti, expires_at=expires_at
+            ).on_conflict_do_nothing(index_elements=['jti'])
+        )
+        db.session.commit()
+
+        self._sync()
+        with self._lock:
+            self._filter.add(jti)
+            self._remember(jti)
+
+token_blocklist = TokenBlocklist()
@@ -0,0 +1,279 @@
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from ..models import Category, Product, ProductImage, ProductReview, ProductVariant, product_categories
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Modelos y tablas cuyo cambio invalida las respuestas del catálogo
+CATALOG_MODELS = (Product, ProductVariant, ProductImage, Category, ProductReview)
+CATALOG_TABLES = {model.__tablename__ for model in CATALOG_MODELS} | {product_categories.name}
+
+def get_redis_client(url):
+    """Create a redis client, failing clearly when the package is missing"""
+    if redis is None:
+        raise RuntimeError("The 'redis' package is required for shared cache backends")
+    return redis.Redis.from_url(url)
+
+class MemoryCacheBackend:
+    """In-process LRU cache with per-entry TTL and size-based eviction"""
+
+    def __init__(self, max_entries=2048, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._process_token = uuid.uuid4().hex[:8]
+        self._generation = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, size, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+
+            # Expulsar las entradas menos usadas hasta respetar ambos límites
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def generation(self):
+        # El token de proceso evita que dos workers emitan el mismo validador para contenidos distintos
+        return f'{self._process_token}.{self._generation}'
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._generation += 1
+
+    def stats(self):
+        return {
+            'backend': 'memory',
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+class RedisCacheBackend:
+    """Cache shared by every worker; invalidation bumps a shared generation"""
+
+    def __init__(self, url, prefix='catalog'):
+        self.client = get_redis_client(url)
+        self.prefix = prefix
+
+    def _key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def get(self, key):
+        return self.client.get(self._key(key))
+
+    def set(self, key, value, ttl):
+        self.client.set(self._key(key), value, ex=ttl)
+
+    def generation(self):
+        return (self.client.get(self._key('generation')) or b'0').decode()
+
+    def invalidate(self):
+        # Las entradas de generaciones anteriores dejan de leerse y expiran por TTL
+        self.client.incr(self._key('generation'))
+
+    def stats(self):
+        info = self.client.info('stats')
+        return {
+            'backend': 'redis',
+            'evictions': info.get('evicted_keys', 0),
+            'expirations': info.get('expired_keys', 0)
+        }
+
+class ResponseCache:
+    """Caches anonymous GET responses of the public catalog endpoints"""
+
+    def __init__(self):
+        self.backend = None
+        self.ttl = 300
+        self.window = 300
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._listeners = []
+        # Contadores compartidos por los hilos del worker
+        self._lock = threading.Lock()
+        # Generación propia para los validadores cuando no hay backend
+        self._process_token = uuid.uuid4().hex[:8]
+        self._generation = 0
+
+    def init_app(self, app):
+        backend = app.config.get('CATALOG_CACHE_BACKEND', 'memory')
+        self.ttl = app.config.get('CATALOG_CACHE_TTL', 300)
+        # Sin cache los validadores rotan con el max-age HTTP en vez del TTL
+        self.window = self.ttl if self.ttl > 0 else max(app.config.get('CATALOG_HTTP_MAX_AGE', 60), 1)
+
+        if self.ttl <= 0: # TTL 0: sin cache
+            self.backend = None
+        elif backend == 'memory':
+            self.backend = MemoryCacheBackend(
+                max_entries=app.config.get('CATALOG_CACHE_MAX_ENTRIES', 2048),
+                max_bytes=app.config.get('CATALOG_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+            )
+        elif backend == 'redis':
+            self.backend = RedisCacheBackend(app.config['CATALOG_CACHE_URL'])
+        else:
+            self.backend = None
+
+        app.extensions['catalog_cache'] = self
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def version(self):
+        """Token that changes every time the catalog is invalidated, with or
+        without a cache backend (ETags depend on it).
+        It also rolls over every window (the TTL, or the HTTP max-age when the
+        cache is off), so validators issued by a worker that missed an
+        invalidation cannot outlive it."""
+        if self.enabled:
+            generation = self.backend.generation()
+        else:
+            generation = f'{self._process_token}.{self._generation}'
+        return f'{generation}.{int(time.time() // self.window)}'
+
+    def make_key(self):
+        """Build the cache key from the path and the normalized query args.
+        Present but empty args are kept: `?cursor=` selects another mode than no cursor"""
+        args = sorted(
+            (key, value.strip())
+            for key, values in request.args.lists()
+            for value in values
+        )
+        query = '&'.join(f'{key}={value}' for key, value in args)
+        return f'{self.version()}:{request.path}?{query}'
+
+    def on_invalidate(self, callback):
+        """Register a callback run after every catalog invalidation"""
+        self._listeners.append(callback)
+        return callback
+
+    def invalidate(self):
+        with self._lock:
+            self.invalidations += 1
+            if not self.enabled:
+                self._generation += 1
+        if self.enabled:
+            self.backend.invalidate()
+        for callback in self._listeners:
+            callback()
+
+    def stats(self):
+        data = {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'ttl': self.ttl
+        }
+        if self.enabled:
+            data.update(self.backend.stats())
+        return data
+
+    def cached(self, view):
+        """Decorator serving a view from the cache for anonymous GET requests"""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.enabled or request.method != 'GET' or 'Authorization' in request.headers:
+                return view(*args, **kwargs)
+
+            key = self.make_key()
+            payload = self.backend.get(key)
+            if payload is not None:
+                with self._lock:
+                    self.hits += 1
+                entry = json.loads(payload)
+                response = current_app.response_class(
+                    entry['body'], status=entry['status'], headers=entry['headers']
+                )
+                response.headers['X-Cache'] = 'HIT'
+                # Responder 304 si el cliente ya tiene el ETag cacheado
+                return response.make_conditional(request)
+
+            with self._lock:
+                self.misses += 1
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                payload = json.dumps({
+                    'status': response.status_code,
+                    'headers': [(name, value) for name, value in response.headers if name != 'Content-Length'],
+                    'body': response.get_data(as_text=True)
+                })
+                self.backend.set(key, payload.encode(), self.ttl)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+
+        return wrapper
+
+catalog_cache = ResponseCache()
+
+def mark_catalog_changed(session):
+    """Flag a catalog change made with raw SQL so the cache is invalidated on commit"""
+    session.info['catalog_changed'] = True
+
+## Invalidación a partir de los eventos de la sesión ##
+@event.listens_for(Session, 'after_flush')
+def track_catalog_changes(session, flush_context):
+    for instance in session.new | session.dirty | session.deleted:
+        if isinstance(instance, CATALOG_MODELS):
+            session.info['catalog_changed'] = True
+            return
+
+@event.listens_for(Session, 'do_orm_execute')
+def track_catalog_statements(orm_execute_state):
+    # INSERT/UPDATE/DELETE masivos (incluida la tabla product_categories)
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None and table.name in CATALOG_TABLES:
+            orm_execute_state.session.info['catalog_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_catalog_on_commit(session):
+    if session.info.pop('catalog_changed', False):
+        catalog_cache.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def discard_catalog_changes(session):
+    session.info.pop('catalog_changed', None)
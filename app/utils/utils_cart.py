@@ -0,0 +1,667 @@
+import time
+import uuid
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import UUID
+from app import db
+from ..models import Cart, CartItem, Product, ProductVariant
+from .utils_reservations import InsufficientStock, move_cart_holds, release_cart_holds, stock_holds
+
+CART_SCHEMA_SQL = [
+    "ALTER TABLE carts ADD COLUMN IF NOT EXISTS subtotal NUMERIC(12, 2) NOT NULL DEFAULT 0",
+    "ALTER TABLE carts ADD COLUMN IF NOT EXISTS total_items INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE carts ADD COLUMN IF NOT EXISTS items_count INTEGER NOT NULL DEFAULT 0",
+    # Líneas duplicadas previas a la clave única: se suman en la más antigua
+    """
+    WITH ranked AS (
+        SELECT id,
+               row_number() OVER line AS position,
+               sum(quantity) OVER (PARTITION BY cart_id, product_id, variant_id) AS quantity
+        FROM cart_items
+        WINDOW line AS (PARTITION BY cart_id, product_id, variant_id ORDER BY created_at, id)
+    ), merged AS (
+        UPDATE cart_items SET quantity = ranked.quantity
+        FROM ranked
+        WHERE cart_items.id = ranked.id AND ranked.position = 1 AND cart_items.quantity <> ranked.quantity
+    )
+    DELETE FROM cart_items USING ranked WHERE cart_items.id = ranked.id AND ranked.position > 1
+    """,
+    # Requiere PostgreSQL 15+ (NULLS NOT DISTINCT: una sola línea sin variante por producto)
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_items_line ON cart_items(cart_id, product_id, variant_id) NULLS NOT DISTINCT",
+    "CREATE INDEX IF NOT EXISTS idx_carts_user_id ON carts(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_carts_session_id ON carts(session_id)",
+    "CREATE INDEX IF NOT EXISTS idx_carts_updated_at ON carts(updated_at)",
+]
+
+# Stock que la línea puede ocupar en el carrito {cart}: el libre de reservas de otros carritos
+# (de la variante si tiene, si no del producto; sólo activos) más lo que el carrito ya retiene
+_LINE_STOCK_SQL = """
+    SELECT CASE WHEN {variant} IS NULL THEN p.stock_quantity - p.reserved_quantity
+                ELSE v.stock_quantity - v.reserved_quantity END
+           + coalesce((SELECT h.quantity FROM stock_reservations h
+                       WHERE h.cart_id = {cart} AND h.product_id = {product}
+                         AND h.variant_id IS NOT DISTINCT FROM {variant}), 0)
+    FROM products p
+    LEFT JOIN product_variants v ON v.id = {variant} AND v.product_id = p.id AND v.is_active
+    WHERE p.id = {product} AND p.is_active
+"""
+
+# Fusiona las líneas de un carrito en otro con una sola sentencia, limitando cada
+# cantidad al stock disponible; las líneas sin stock o de productos inactivos se descartan.
+# Se ejecuta después de mover las reservas del carrito origen al destino (move_cart_holds)
+MERGE_CART_ITEMS_SQL = f"""
+    INSERT INTO cart_items (id, cart_id, product_id, variant_id, quantity, unit_price, created_at, updated_at)
+    SELECT gen_random_uuid(), :target_cart_id, source.product_id, source.variant_id,
+           LEAST(source.quantity, stock.available), source.unit_price, now(), now()
+    FROM cart_items source
+    CROSS JOIN LATERAL ({_LINE_STOCK_SQL.format(
+        variant='source.variant_id', product='source.product_id', cart='CAST(:target_cart_id AS uuid)'
+    )}) AS stock(available)
+    WHERE source.cart_id = :source_cart_id AND stock.available > 0
+    ON CONFLICT (cart_id, product_id, variant_id) DO UPDATE SET
+        quantity = GREATEST(cart_items.quantity, LEAST(
+            cart_items.quantity + EXCLUDED.quantity,
+            ({_LINE_STOCK_SQL.format(variant='EXCLUDED.variant_id', product='EXCLUDED.product_id', cart='EXCLUDED.cart_id')})
+        )),
+        updated_at = now()
+"""
+
+# Mutaciones atómicas del carrito: cada una es una sola sentencia que modifica la línea
+# (con el tope de stock en SQL) y aplica el delta a los totales del carrito
+_CART_TOTALS_RETURNING = "RETURNING carts.subtotal, carts.total_items, carts.items_count"
+
+ADD_CART_ITEM_SQL = f"""
+    WITH line AS (
+        SELECT p.name AS product_name,
+               CASE WHEN v.id IS NULL THEN p.price ELSE coalesce(v.price, p.price) END AS unit_price,
+               CASE WHEN v.id IS NULL THEN p.stock_quantity ELSE v.stock_quantity END AS stock
+        FROM products p
+        LEFT JOIN product_variants v ON v.id = CAST(:variant_id AS uuid) AND v.product_id = p.id AND v.is_active
+        WHERE p.id = CAST(:product_id AS uuid) AND p.is_active
+          AND (CAST(:variant_id AS uuid) IS NULL OR v.id IS NOT NULL)
+    ), added AS (
+        INSERT INTO cart_items (id, cart_id, product_id, variant_id, quantity, unit_price, created_at, updated_at)
+        SELECT gen_random_uuid(), CAST(:cart_id AS uuid), CAST(:product_id AS uuid), CAST(:variant_id AS uuid),
+               CAST(:quantity AS integer), line.unit_price, now(), now()
+        FROM line
+        WHERE line.stock >= CAST(:quantity AS integer)
+        ON CONFLICT (cart_id, product_id, variant_id) DO UPDATE SET
+            quantity = cart_items.quantity + EXCLUDED.quantity,
+            updated_at = now()
+        WHERE cart_items.quantity + EXCLUDED.quantity <= (SELECT stock FROM line)
+        RETURNING cart_items.id, cart_items.quantity, cart_items.unit_price, cart_items.xmax = 0 AS inserted
+    ), totals AS (
+        UPDATE carts SET
+            subtotal = carts.subtotal + added.unit_price * CAST(:quantity AS integer),
+            total_items = carts.total_items + CAST(:quantity AS integer),
+            items_count = carts.items_count + CASE WHEN added.inserted THEN 1 ELSE 0 END,
+            updated_at = now()
+        FROM added
+        WHERE carts.id = CAST(:cart_id AS uuid)
+        {_CART_TOTALS_RETURNING}
+    )
+    SELECT line.product_name, line.stock,
+           (SELECT quantity FROM cart_items
+            WHERE cart_id = CAST(:cart_id AS uuid) AND product_id = CAST(:product_id AS uuid)
+              AND variant_id IS NOT DISTINCT FROM CAST(:variant_id AS uuid)) AS in_cart,
+           added.id AS item_id, added.quantity, totals.*
+    FROM line LEFT JOIN added ON true LEFT JOIN totals ON true
+"""
+
+# {owner}: carritos del usuario o de la sesión de invitado (ver _owner_filter)
+SET_CART_ITEM_SQL = f"""
+    WITH previous AS (
+        SELECT cart_items.id, cart_items.cart_id, cart_items.quantity
+        FROM cart_items
+        WHERE cart_items.id = CAST(:item_id AS uuid) AND cart_items.cart_id IN ({{owner}})
+        FOR UPDATE
+    ), line AS (
+        SELECT p.name AS product_name,
+               CASE WHEN cart_items.variant_id IS NULL THEN p.stock_quantity ELSE v.stock_quantity END AS stock
+        FROM cart_items
+        JOIN products p ON p.id = cart_items.product_id
+        LEFT JOIN product_variants v ON v.id = cart_items.variant_id
+        WHERE cart_items.id = CAST(:item_id AS uuid) AND cart_items.cart_id IN ({{owner}})
+    ), updated AS (
+        UPDATE cart_items SET quantity = CAST(:quantity AS integer), updated_at = now()
+        FROM previous
+        WHERE cart_items.id = previous.id AND CAST(:quantity AS integer) <= (SELECT stock FROM line)
+        RETURNING cart_items.id, cart_items.cart_id, cart_items.product_id, cart_items.variant_id,
+                  cart_items.unit_price, cart_items.quantity - previous.quantity AS delta
+    ), totals AS (
+        UPDATE carts SET
+            subtotal = carts.subtotal + updated.unit_price * updated.delta,
+            total_items = carts.total_items + updated.delta,
+            updated_at = now()
+        FROM updated
+        WHERE carts.id = updated.cart_id
+        {_CART_TOTALS_RETURNING}
+    )
+    SELECT line.product_name, line.stock, updated.id AS item_id, updated.cart_id,
+           updated.product_id, updated.variant_id, updated.delta, totals.*
+    FROM line LEFT JOIN updated ON true LEFT JOIN totals ON true
+"""
+
+REMOVE_CART_ITEM_SQL = f"""
+    WITH removed AS (
+        DELETE FROM cart_items
+        WHERE cart_items.id = CAST(:item_id AS uuid) AND cart_items.cart_id IN ({{owner}})
+        RETURNING cart_items.cart_id, cart_items.product_id, cart_items.variant_id,
+                  cart_items.quantity, cart_items.unit_price
+    ), totals AS (
+        UPDATE carts SET
+            subtotal = carts.subtotal - removed.unit_price * removed.quantity,
+            total_items = carts.total_items - removed.quantity,
+            items_count = carts.items_count - 1,
+            updated_at = now()
+        FROM removed
+        WHERE carts.id = removed.cart_id
+        {_CART_TOTALS_RETURNING}
+    )
+    SELECT products.name AS product_name, removed.cart_id, removed.product_id, removed.variant_id,
+           removed.quantity, totals.*
+    FROM removed JOIN products ON products.id = removed.product_id CROSS JOIN totals
+"""
+
+CLEAR_CART_SQL = f"""
+    WITH removed AS (
+        DELETE FROM cart_items WHERE cart_items.cart_id = CAST(:cart_id AS uuid)
+        RETURNING cart_items.quantity, cart_items.unit_price
+    ), summary AS (
+        SELECT count(*) AS lines, coalesce(sum(quantity), 0) AS quantity,
+               coalesce(sum(unit_price * quantity), 0) AS amount
+        FROM removed
+    ), totals AS (
+        UPDATE carts SET
+            subtotal = carts.subtotal - summary.amount,
+            total_items = carts.total_items - summary.quantity,
+            items_count = carts.items_count - summary.lines,
+            updated_at = now()
+        FROM summary
+        WHERE carts.id = CAST(:cart_id AS uuid)
+        {_CART_TOTALS_RETURNING}
+    )
+    SELECT summary.lines, totals.* FROM summary CROSS JOIN totals
+"""
+
+def cart_item_view(row):
+    """Item of the cart view: the line plus its product/variant, the current
+    price and the availability (row: cart line joined to its product and variant)"""
+    product_price = float(row.product_price)
+    item_data = {
+        'id': str(row.item_id),
+        'product_id': str(row.product_id),
+        'variant_id': str(row.variant_id) if row.variant_id else None,
+        'product_name': row.product_name,
+        'quantity': row.quantity,
+        'unit_price': float(row.unit_price),
+        'total_price': float(row.unit_price * row.quantity),
+        'product': {
+            'id': str(row.product_id),
+            'name': row.product_name,
+            'slug': row.product_slug,
+            'price': product_price,
+            'stock_quantity': row.product_stock,
+            'is_active': row.product_active
+        },
+        'current_price': product_price
+    }
+    available_stock = row.product_stock
+
+    if row.variant_id:
+        if row.variant_found:
+            variant_price = float(row.variant_price) if row.variant_price else product_price
+            item_data['variant'] = {
+                'id': str(row.variant_id),
+                'name': row.variant_name,
+                'price': variant_price,
+                'stock_quantity': row.variant_stock,
+                'attributes': row.variant_attributes
+            }
+            item_data['current_price'] = variant_price
+            available_stock = row.variant_stock
+        else:
+            # La variante ya no existe
+            item_data['variant'] = None
+            available_stock = 0
+
+    available_stock = available_stock or 0
+    item_data['is_available'] = available_stock >= row.quantity
+    item_data['available_stock'] = available_stock
+    return item_data
+
+def load_cart_view(user_id=None, session_id=None):
+    """Load a cart with its items, products and variants in a single statement.
+
+    Only the columns the cart view needs are selected; availability and the
+    current price are computed in the same pass over the rows and the totals
+    come from the cart row itself.
+    Returns: (cart, items) or None when the user/session has no cart"""
+    if user_id:
+        owner = Cart.user_id == user_id
+    elif session_id:
+        owner = Cart.session_id == session_id
+    else:
+        return None
+
+    # Items de productos inactivos no se muestran (el carrito se devuelve igual aunque quede vacío)
+    items = db.join(CartItem, Product, db.and_(Product.id == CartItem.product_id, Product.is_active == True))
+    rows = db.session.query(
+        Cart.id, Cart.updated_at, Cart.subtotal, Cart.total_items, Cart.items_count,
+        CartItem.id.label('item_id'), CartItem.product_id, CartItem.variant_id,
+        CartItem.quantity, CartItem.unit_price,
+        Product.name.label('product_name'), Product.slug.label('product_slug'),
+        Product.price.label('product_price'), Product.stock_quantity.label('product_stock'),
+        Product.is_active.label('product_active'),
+        ProductVariant.id.label('variant_found'), ProductVariant.name.label('variant_name'),
+        ProductVariant.price.label('variant_price'), ProductVariant.stock_quantity.label('variant_stock'),
+        ProductVariant.attributes.label('variant_attributes')
+    ).select_from(Cart).outerjoin(
+        items, CartItem.cart_id == Cart.id
+    ).outerjoin(
+        ProductVariant, ProductVariant.id == CartItem.variant_id
+    ).filter(owner).order_by(Cart.created_at, CartItem.created_at).all()
+
+    if not rows:
+        return None
+
+    first = rows[0]
+    cart = {
+        'id': first.id,
+        'updated_at': first.updated_at,
+        'totals': {
+            'subtotal': float(first.subtotal or 0),
+            'total_items': first.total_items or 0,
+            'items_count': first.items_count or 0
+        }
+    }
+
+    items_data = []
+    for row in rows:
+        if row.id != first.id:
+            break  # Más de un carrito para el mismo dueño: se usa el primero, como get_or_create_cart
+        if row.item_id is None:
+            continue
+
+        items_data.append(cart_item_view(row))
+
+    return cart, items_data
+
+## Operaciones por lotes ##
+CART_OPERATIONS = ('add', 'set', 'remove')
+MAX_ITEM_QUANTITY = 10  # Mismo límite que /add y /cart/update
+
+class CartOperationError(ValueError):
+    """An operation of a batch cannot be applied; nothing was written"""
+
+    def __init__(self, message, index=None, status=400, **details):
+        super().__init__(message)
+        self.index = index
+        self.status = status
+        self.details = details
+
+    def to_dict(self):
+        return {'error': str(self), 'operation': self.index, **self.details}
+
+def _parse_uuid(value, field, index):
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        raise CartOperationError(f"Invalid {field}", index)
+
+def parse_cart_operations(operations, max_operations):
+    """Validate the shape of a batch: a list of {'op': 'add'|'set'|'remove', ...}
+    addressing a line by item_id or by product_id (+ variant_id).
+    Returns: list of normalized operations"""
+    if not isinstance(operations, list) or not operations:
+        raise CartOperationError("operations must be a non-empty list")
+    if len(operations) > max_operations:
+        raise CartOperationError(f"Maximum operations per batch: {max_operations}")
+
+    parsed = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATIONS:
+            raise CartOperationError(f"op must be one of: {', '.join(CART_OPERATIONS)}", index)
+
+        op = operation['op']
+        if op == 'add' and 'product_id' not in operation:
+            raise CartOperationError("product_id is required", index)
+        if 'item_id' not in operation and 'product_id' not in operation:
+            raise CartOperationError("item_id or product_id is required", index)
+
+        quantity = operation.get('quantity', 1 if op == 'add' else None)
+        if op == 'add' and (not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0):
+            raise CartOperationError("Quantity must be an integer and greater than 0", index)
+        if op == 'set' and (not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 0):
+            raise CartOperationError("Quantity must be an integer and greater than or equal to 0", index)
+        if op != 'remove' and quantity > MAX_ITEM_QUANTITY:
+            raise CartOperationError(f"Maximum quantity allowed: {MAX_ITEM_QUANTITY}", index)
+
+        parsed.append({
+            'op': op,
+            'item_id': _parse_uuid(operation['item_id'], 'item_id', index) if operation.get('item_id') else None,
+            'product_id': _parse_uuid(operation['product_id'], 'product_id', index) if operation.get('product_id') else None,
+            'variant_id': _parse_uuid(operation['variant_id'], 'variant_id', index) if operation.get('variant_id') else None,
+            'quantity': 0 if op == 'remove' else quantity
+        })
+    return parsed
+
+def load_line_catalog(keys):
+    """Price, stock and product name of every (product_id, variant_id) line, with one query.
+    Returns: {(product_id, variant_id): (unit_price, stock, product_name)} for active products/variants"""
+    product_ids = {product_id for product_id, _ in keys}
+    variant_ids = {variant_id for _, variant_id in keys if variant_id}
+    rows = db.session.query(
+        Product.id, Product.price, Product.stock_quantity, Product.name,
+        ProductVariant.id, ProductVariant.price, ProductVariant.stock_quantity
+    ).outerjoin(ProductVariant, db.and_(
+        ProductVariant.product_id == Product.id,
+        ProductVariant.id.in_(variant_ids),
+        ProductVariant.is_active == True
+    )).filter(Product.id.in_(product_ids), Product.is_active == True).all()
+
+    catalog = {}
+    for product_id, product_price, product_stock, product_name, variant_id, variant_price, variant_stock in rows:
+        catalog[(product_id, None)] = (product_price, product_stock or 0, product_name)
+        if variant_id:
+            catalog[(product_id, variant_id)] = (variant_price or product_price, variant_stock or 0, product_name)
+    return catalog
+
+def refresh_cart_totals(cart_id):
+    """Recompute the stored totals of one cart from its items (after set-based writes
+    that bypass the CartItem events).
+    Returns: the new totals, as Cart.totals()"""
+    carts = Cart.__table__
+    items = CartItem.__table__
+    row = db.session.execute(
+        carts.update().where(carts.c.id == cart_id).values(
+            subtotal=db.select(db.func.coalesce(db.func.sum(items.c.unit_price * items.c.quantity), 0))
+                .where(items.c.cart_id == cart_id).scalar_subquery(),
+            total_items=db.select(db.func.coalesce(db.func.sum(items.c.quantity), 0))
+                .where(items.c.cart_id == cart_id).scalar_subquery(),
+            items_count=db.select(db.func.count(items.c.id))
+                .where(items.c.cart_id == cart_id).scalar_subquery(),
+            updated_at=db.func.now()
+        ).returning(carts.c.subtotal, carts.c.total_items, carts.c.items_count)
+    ).first()
+    return cart_totals(row)
+
+def merge_carts(source_cart_id, target_cart_id):
+    """Move every line of the source cart into the target cart (summing duplicates,
+    capped at the stock free for the target cart) and delete the source cart, in
+    a constant number of statements. The source cart holds move to the target
+    cart first, and the merged units they do not cover are held afterwards.
+    The caller commits.
+    Returns: (merged lines, target cart totals)"""
+    move_cart_holds(source_cart_id, target_cart_id)
+    merged = db.session.execute(
+        text(MERGE_CART_ITEMS_SQL), {'source_cart_id': source_cart_id, 'target_cart_id': target_cart_id}
+    ).rowcount
+    stock_holds.hold_cart_lines(target_cart_id)
+    # Sus items se eliminan por ON DELETE CASCADE
+    Cart.query.filter_by(id=source_cart_id).delete(synchronize_session='fetch')
+    return merged, refresh_cart_totals(target_cart_id)
+
+def cart_totals(row):
+    """Cart totals returned by a mutation statement, as Cart.totals()"""
+    return {'subtotal': float(row.subtotal), 'total_items': row.total_items, 'items_count': row.items_count}
+
+def _owner_filter(user_id=None, session_id=None):
+    """Subquery selecting the carts of the user (or guest session) and its parameters"""
+    if user_id:
+        return "SELECT id FROM carts WHERE user_id = CAST(:owner AS uuid)", {'owner': str(user_id)}
+    return "SELECT id FROM carts WHERE session_id = :owner AND user_id IS NULL", {'owner': session_id}
+
+def add_cart_item(cart_id, product_id, variant_id, quantity):
+    """Add `quantity` units of a product/variant to the cart with one upsert.
+    The stock ceiling is checked in SQL against the quantity already in the
+    cart, so concurrent adds never lose updates nor exceed the stock.
+    The added units are then held for the cart (InsufficientStock when other
+    carts hold them). The caller commits, or rolls back on failure.
+    Returns: None when the product/variant is not available, else a row with
+    product_name, stock, in_cart and, when applied, item_id, quantity and totals"""
+    result = db.session.execute(text(ADD_CART_ITEM_SQL), {
+        'cart_id': str(cart_id), 'product_id': str(product_id),
+        'variant_id': str(variant_id) if variant_id else None, 'quantity': quantity
+    }).first()
+    if result is not None and result.item_id is not None:
+        stock_holds.reserve(cart_id, {(product_id, variant_id): quantity})
+    return result
+
+def set_cart_item_quantity(item_id, quantity, user_id=None, session_id=None):
+    """Set the quantity of a line of the caller's cart (quantity > 0) in one
+    statement, locking the line so the totals delta uses its latest value.
+    The hold of the line moves by the same delta (InsufficientStock when the
+    extra units are held by other carts).
+    Returns: None when the item is not in the caller's cart, else a row with
+    product_name, stock and, when applied, item_id and totals"""
+    owner, parameters = _owner_filter(user_id, session_id)
+    result = db.session.execute(
+        text(SET_CART_ITEM_SQL.format(owner=owner)),
+        {'item_id': str(item_id), 'quantity': quantity, **parameters}
+    ).first()
+    if result is not None and result.item_id is not None:
+        stock_holds.reserve(result.cart_id, {(result.product_id, result.variant_id): result.delta})
+    return result
+
+def remove_cart_item(item_id, user_id=None, session_id=None):
+    """Delete a line of the caller's cart and subtract it from the totals in one
+    statement, then release its hold.
+    Returns: None when the item is not in the caller's cart, else (product_name, totals...)"""
+    owner, parameters = _owner_filter(user_id, session_id)
+    result = db.session.execute(
+        text(REMOVE_CART_ITEM_SQL.format(owner=owner)), {'item_id': str(item_id), **parameters}
+    ).first()
+    if result is not None:
+        stock_holds.reserve(result.cart_id, {(result.product_id, result.variant_id): -result.quantity})
+    return result
+
+def clear_cart_items(cart_id):
+    """Delete every line of a cart and subtract them from the totals in one statement
+    (lines added concurrently after the delete keep their share of the totals)
+    and release the cart holds.
+    Returns: (lines, totals...)"""
+    result = db.session.execute(text(CLEAR_CART_SQL), {'cart_id': str(cart_id)}).first()
+    stock_holds.release(cart_id)
+    return result
+
+def hold_cart_changes(cart_id, lines, quantities):
+    """Move the holds of a cart by the change of every line of a folded batch.
+    Raises CartOperationError when a line cannot be held (the caller rolls back)"""
+    deltas = {key: quantity - lines[key]['quantity'] if key in lines else quantity for key, quantity in quantities.items()}
+    try:
+        stock_holds.reserve(cart_id, deltas)
+    except InsufficientStock as e:
+        raise CartOperationError(
+            "Not enough stock available", available_stock=e.available,
+            product_id=str(e.product_id), variant_id=str(e.variant_id) if e.variant_id else None
+        )
+
+def fold_cart_operations(lines, operations):
+    """Apply a parsed batch, in order, to the current lines of a cart in memory,
+    reading every referenced product/variant with one query.
+    lines: {(product_id, variant_id): {'id': item_id, 'quantity': n}}
+    Raises CartOperationError when an operation cannot be applied.
+    Returns: (final quantities by line, catalog of the lines with quantity)"""
+    by_id = {line['id']: key for key, line in lines.items()}
+
+    # Resolver cada operación a su línea (producto, variante)
+    keys = []
+    for index, operation in enumerate(operations):
+        if operation['item_id']:
+            key = by_id.get(operation['item_id'])
+            if key is None:
+                raise CartOperationError("Item not found in cart", index, status=404)
+        else:
+            key = (operation['product_id'], operation['variant_id'])
+        keys.append(key)
+
+    catalog = load_line_catalog({key for key, operation in zip(keys, operations) if operation['quantity']})
+
+    quantities = {key: line['quantity'] for key, line in lines.items()}
+    for index, (key, operation) in enumerate(zip(keys, operations)):
+        if operation['op'] == 'remove':
+            if not quantities.get(key):
+                raise CartOperationError("Item not found in cart", index, status=404)
+            quantities[key] = 0
+            continue
+
+        if operation['quantity'] and key not in catalog:
+            message = "Variant not found or does not belong to the product" if key[1] else "Product not found"
+            raise CartOperationError(message, index, status=404)
+        if operation['op'] == 'add':
+            quantities[key] = quantities.get(key, 0) + operation['quantity']
+        else:
+            quantities[key] = operation['quantity']
+
+        if quantities[key] and catalog[key][1] < quantities[key]:
+            raise CartOperationError(
+                "Not enough stock available", index,
+                available_stock=catalog[key][1], requested=quantities[key]
+            )
+
+    return quantities, catalog
+
+def apply_cart_operations(cart_id, operations):
+    """Apply a parsed batch to a cart inside the current transaction.
+
+    The cart row is locked, its items are read with one query and folded
+    with the operations (fold_cart_operations), and the result is written
+    with at most one DELETE, one UPDATE and one INSERT plus the totals refresh,
+    after moving the stock holds (hold_cart_changes). Raises CartOperationError
+    when an operation cannot be applied; the caller rolls back. The caller commits.
+    Returns: {'added': n, 'updated': n, 'removed': n}"""
+    items = CartItem.__table__
+
+    # Bloquear el carrito: dos lotes concurrentes sobre el mismo carrito se serializan
+    db.session.query(Cart.id).filter(Cart.id == cart_id).with_for_update().first()
+
+    lines = {
+        (product_id, variant_id): {'id': item_id, 'quantity': quantity}
+        for item_id, product_id, variant_id, quantity in db.session.query(
+            CartItem.id, CartItem.product_id, CartItem.variant_id, CartItem.quantity
+        ).filter(CartItem.cart_id == cart_id).all()
+    }
+    quantities, catalog = fold_cart_operations(lines, operations)
+    hold_cart_changes(cart_id, lines, quantities)
+
+    removed = [lines[key]['id'] for key, quantity in quantities.items() if key in lines and not quantity]
+    updated = [
+        {'item_id': lines[key]['id'], 'new_quantity': quantity}
+        for key, quantity in quantities.items()
+        if key in lines and quantity and quantity != lines[key]['quantity']
+    ]
+    added = [
+        {
+            'id': uuid.uuid4(), 'cart_id': cart_id, 'product_id': key[0], 'variant_id': key[1],
+            'quantity': quantity, 'unit_price': catalog[key][0]
+        }
+        for key, quantity in quantities.items() if key not in lines and quantity
+    ]
+
+    if removed:
+        db.session.execute(items.delete().where(items.c.id.in_(removed)))
+    if updated:
+        changes = db.values(
+            db.column('item_id', UUID(as_uuid=True)), db.column('new_quantity', db.Integer), name='changes'
+        ).data([(change['item_id'], change['new_quantity']) for change in updated])
+        db.session.execute(
+            items.update().where(items.c.id == changes.c.item_id)
+            .values(quantity=changes.c.new_quantity, updated_at=db.func.now())
+        )
+    if added:
+        db.session.execute(items.insert().values(added))
+    if removed or updated or added:
+        refresh_cart_totals(cart_id)
+
+    return {'added': len(added), 'updated': len(updated), 'removed': len(removed)}
+
+# Un lote de carritos de invitado inactivos; SKIP LOCKED salta los que otra transacción está usando
+ABANDONED_GUEST_CARTS_SQL = """
+    SELECT id FROM carts
+    WHERE user_id IS NULL AND updated_at < now() - make_interval(secs => :max_age)
+    ORDER BY updated_at
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+"""
+
+# Sus items se eliminan por ON DELETE CASCADE
+REAP_GUEST_CARTS_SQL = """
+    WITH removed AS (
+        DELETE FROM carts WHERE id = ANY(CAST(:cart_ids AS uuid[]))
+        RETURNING carts.items_count
+    )
+    SELECT count(*) AS carts, coalesce(sum(items_count), 0) AS items FROM removed
+"""
+
+def reap_abandoned_carts(max_age, batch_size=1000):
+    """Delete guest carts not modified for `max_age` seconds, oldest first,
+    committing after every batch so no lock is held for long. The stock held
+    by a batch is released in the transaction that deletes it.
+    Returns: {'carts': n, 'items': n, 'batches': n, 'seconds': elapsed}"""
+    started = time.monotonic()
+    reaped = {'carts': 0, 'items': 0, 'batches': 0}
+    while True:
+        cart_ids = [str(cart_id) for cart_id in db.session.execute(
+            text(ABANDONED_GUEST_CARTS_SQL), {'max_age': max_age, 'batch_size': batch_size}
+        ).scalars()]
+        if cart_ids:
+            release_cart_holds(cart_ids)
+            row = db.session.execute(text(REAP_GUEST_CARTS_SQL), {'cart_ids': cart_ids}).first()
+            reaped['carts'] += row.carts
+            reaped['items'] += row.items
+        db.session.commit()
+        reaped['batches'] += 1
+        if len(cart_ids) < batch_size:
+            break
+    reaped['seconds'] = round(time.monotonic() - started, 3)
+    return reaped
+
+def _computed_totals():
+    """Totals of every cart recomputed from its items (subquery)"""
+    return db.session.query(
+        CartItem.cart_id.label('cart_id'),
+        db.func.sum(CartItem.unit_price * CartItem.quantity).label('subtotal'),
+        db.func.sum(CartItem.quantity).label('total_items'),
+        db.func.count(CartItem.id).label('items_count')
+    ).group_by(CartItem.cart_id).subquery()
+
+def verify_cart_totals(repair=False):
+    """Compare the stored cart totals with the ones computed from the items.
+    With repair=True, rewrite only the drifting rows and commit.
+    Returns: number of carts whose totals drifted"""
+    carts = Cart.__table__
+    computed = _computed_totals()
+    columns = ['subtotal', 'total_items', 'items_count']
+
+    drifted = db.session.query(db.func.count(carts.c.id)).select_from(carts).outerjoin(
+        computed, computed.c.cart_id == carts.c.id
+    ).filter(db.or_(*[
+        carts.c[column].is_distinct_from(db.func.coalesce(computed.c[column], 0)) for column in columns
+    ])).scalar()
+
+    if repair and drifted:
+        # Carritos con totales pero sin items
+        db.session.execute(
+            carts.update()
+            .where(~carts.c.id.in_(db.select(computed.c.cart_id)))
+            .where(db.or_(*[carts.c[column] != 0 for column in columns]))
+            .values({column: 0 for column in columns})
+        )
+        # Carritos cuyos totales no coinciden con los items
+        db.session.execute(
+            carts.update()
+            .where(carts.c.id == computed.c.cart_id)
+            .where(db.or_(*[carts.c[column].is_distinct_from(computed.c[column]) for column in columns]))
+            .values({column: computed.c[column] for column in columns})
+        )
+        db.session.commit()
+
+    return drifted
+
+def install_carts_schema():
+    """Add the totals columns and the unique line key to existing cart tables,
+    merging duplicated lines, and fill the totals"""
+    for statement in CART_SCHEMA_SQL:
+        db.session.execute(text(statement))
+    db.session.commit()
+    return verify_cart_totals(repair=True)
@@ -0,0 +1,160 @@
+import threading
+import time
+from flask import current_app
+from sqlalchemy import column, values
+from sqlalchemy.dialects.postgresql import UUID
+from app import db
+from ..models import Category, Product, product_categories
+from .utils_cache import catalog_cache
+
+def in_categories(category_ids):
+    """Predicate matching products that belong to any of the given categories
+    (a single IN over product_categories, without duplicating rows)"""
+    return Product.id.in_(
+        db.select(product_categories.c.product_id).where(
+            product_categories.c.category_id.in_(category_ids)
+        )
+    )
+
+class CategoryTree:
+    """Immutable snapshot of the category hierarchy with precomputed
+    descendant sets and product counts per node"""
+
+    def __init__(self, categories):
+        self.nodes = {
+            category.id: {
+                'category': category.to_dict(),
+                'parent_id': category.parent_id,
+                'is_active': category.is_active,
+                'sort_order': category.sort_order or 0,
+                'children': [],
+                'product_count': 0,
+                'total_product_count': 0
+            }
+            for category in categories
+        }
+        self.slugs = {node['category']['slug']: category_id for category_id, node in self.nodes.items()}
+        self.roots = []
+
+        for category_id, node in self.nodes.items():
+            parent = self.nodes.get(node['parent_id'])
+            if parent is not None:
+                parent['children'].append(category_id)
+            else:
+                self.roots.append(category_id)
+
+        def sort_key(category_id):
+            node = self.nodes[category_id]
+            return (node['sort_order'], node['category']['name'])
+
+        self.roots.sort(key=sort_key)
+        for node in self.nodes.values():
+            node['children'].sort(key=sort_key)
+
+        self.descendants = {category_id: self._collect(category_id) for category_id in self.nodes}
+
+    def _collect(self, category_id):
+        """Category plus all of its descendants (cycle-safe)"""
+        found = set()
+        pending = [category_id]
+        while pending:
+            current = pending.pop()
+            if current in found:
+                continue
+            found.add(current)
+            pending.extend(self.nodes[current]['children'])
+        return frozenset(found)
+
+    def find_by_slug(self, slug):
+        category_id = self.slugs.get(slug)
+        return self.nodes[category_id] if category_id is not None else None
+
+    def descendant_ids(self, category_id, active_only=True):
+        """Ids of a category and its descendants, to filter with one IN predicate"""
+        if category_id not in self.descendants:
+            return [category_id]
+        return [
+            descendant for descendant in self.descendants[category_id]
+            if not active_only or self.nodes[descendant]['is_active'] or descendant == category_id
+        ]
+
+    def to_list(self, active_only=True):
+        """Nested representation of the tree for the API"""
+        def serialize(category_id):
+            node = self.nodes[category_id]
+            return dict(
+                node['category'],
+                product_count=node['product_count'],
+                total_product_count=node['total_product_count'],
+                children=[
+                    serialize(child) for child in node['children']
+                    if not active_only or self.nodes[child]['is_active']
+                ]
+            )
+
+        return [
+            serialize(category_id) for category_id in self.roots
+            if not active_only or self.nodes[category_id]['is_active']
+        ]
+
+def build_category_tree():
+    """Load every category and the product counts of the whole tree (two queries)"""
+    tree = CategoryTree(Category.query.all())
+
+    # Pares (ancestro, descendiente) para contar productos distintos por subárbol en una sola consulta
+    pairs = [(ancestor, descendant) for ancestor, members in tree.descendants.items() for descendant in members]
+    if not pairs:
+        return tree
+
+    hierarchy = values(
+        column('ancestor_id', UUID(as_uuid=True)),
+        column('category_id', UUID(as_uuid=True)),
+        name='hierarchy'
+    ).data(pairs)
+
+    counts = db.session.query(
+        hierarchy.c.ancestor_id,
+        db.func.count(db.distinct(product_categories.c.product_id)).filter(
+            hierarchy.c.ancestor_id == hierarchy.c.category_id
+        ),
+        db.func.count(db.distinct(product_categories.c.product_id))
+    ).select_from(hierarchy).join(
+        product_categories, product_categories.c.category_id == hierarchy.c.category_id
+    ).join(
+        Product, Product.id == product_categories.c.product_id
+    ).filter(Product.is_active == True).group_by(hierarchy.c.ancestor_id).all()
+
+    for category_id, direct, total in counts:
+        tree.nodes[category_id]['product_count'] = direct
+        tree.nodes[category_id]['total_product_count'] = total
+
+    return tree
+
+class CategoryTreeCache:
+    """Process-wide category tree, rebuilt lazily after catalog changes or
+    once CATEGORY_TREE_TTL seconds have passed"""
+
+    def __init__(self):
+        self._tree = None
+        self._built_at = 0
+        self._stale = False
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._stale = True
+
+    def get(self):
+        ttl = current_app.config.get('CATEGORY_TREE_TTL', 300)
+        tree = self._tree
+        if tree is not None and not self._stale and time.monotonic() - self._built_at <= ttl:
+            return tree
+
+        with self._lock:
+            if self._tree is None or self._stale or time.monotonic() - self._built_at > ttl:
+                self._stale = False
+                self._tree = build_category_tree()
+                self._built_at = time.monotonic()
+            return self._tree
+
+category_tree = CategoryTreeCache()
+catalog_cache.on_invalidate(category_tree.invalidate)
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import threading
+from datetime import datetime, timezone
+from flask import current_app, has_app_context
+from sqlalchemy import Delete, Update, event, inspect
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app import db
+from ..models import Category, Product, ProductDocument, ProductImage, ProductReview, ProductVariant, product_categories
+from .utils_cache import CATALOG_TABLES
+from .utils_products import serialize_products
+
+# Modelos hijos cuyo cambio reconstruye el documento del producto al que pertenecen
+CHILD_MODELS = (ProductVariant, ProductImage, ProductReview)
+
+def document_etag(document):
+    return hashlib.sha1(json.dumps(document, sort_keys=True).encode()).hexdigest()
+
+def build_product_documents(product_ids, session=None):
+    """Rebuild the detail documents of the given products inside the current
+    transaction of `session` (db.session by default); inactive or deleted
+    products lose their document. updated_at only moves when the content
+    actually changes.
+    Returns: number of stored documents"""
+    ids = list(set(product_ids))
+    if not ids:
+        return 0
+
+    session = session or db.session
+    products = session.query(Product).filter(Product.id.in_(ids), Product.is_active == True).all()
+    documents = serialize_products(products, include_variants=True, include_images=True, session=session)
+    table = ProductDocument.__table__
+
+    # Quitar los documentos de productos inactivos o borrados, y los que conservan un slug
+    # que ahora pertenece a otro producto (dos productos que intercambian su slug)
+    active = [(product.slug, product.id) for product in products]
+    removed = table.c.product_id.in_(ids)
+    if active:
+        removed = db.or_(
+            db.and_(removed, table.c.product_id.not_in([product_id for _, product_id in active])),
+            db.and_(
+                table.c.slug.in_([slug for slug, _ in active]),
+                db.tuple_(table.c.slug, table.c.product_id).not_in(active)
+            )
+        )
+    session.execute(table.delete().where(removed))
+
+    if not products:
+        return 0
+
+    # Upsert por product_id: dos reconstrucciones concurrentes (o una perezosa en un GET)
+    # no chocan con la clave única
+    now = datetime.now(timezone.utc)
+    statement = insert(table).values([
+        {
+            'product_id': product.id,
+            'slug': product.slug,
+            'document': document,
+            'etag': document_etag(document),
+            'updated_at': now
+        }
+        for product, document in zip(products, documents)
+    ])
+    session.execute(statement.on_conflict_do_update(
+        index_elements=['product_id'],
+        set_={
+            'slug': statement.excluded.slug,
+            'document': statement.excluded.document,
+            'etag': statement.excluded.etag,
+            # updated_at sólo avanza cuando el contenido cambia
+            'updated_at': db.case(
+                (table.c.etag == statement.excluded.etag, table.c.updated_at),
+                else_=statement.excluded.updated_at
+            )
+        }
+    ))
+    return len(products)
+
+def rebuild_all_product_documents(batch_size=500):
+    """Rebuild every document in id-ordered batches, committing after each one.
+    Returns: number of stored documents"""
+    table = ProductDocument.__table__
+    db.session.execute(table.delete().where(
+        table.c.product_id.in_(db.select(Product.id).where(Product.is_active == False))
+    ))
+    db.session.commit()
+
+    stored = 0
+    last_id = None
+    while True:
+        query = db.session.query(Product.id).filter(Product.is_active == True)
+        if last_id is not None:
+            query = query.filter(Product.id > last_id)
+        ids = [row[0] for row in query.order_by(Product.id).limit(batch_size)]
+        if not ids:
+            return stored
+        stored += build_product_documents(ids)
+        db.session.commit()
+        db.session.expunge_all()
+        last_id = ids[-1]
+
+def get_product_document(product_id=None, slug=None):
+    """Fetch the detail document of an active product with one indexed lookup,
+    building it on first access.
+    Returns: ProductDocument or None if the product does not exist"""
+    def lookup():
+        query = ProductDocument.query
+        if product_id is not None:
+            return query.filter(ProductDocument.product_id == product_id).first()
+        return query.filter(ProductDocument.slug == slug).first()
+
+    document = lookup()
+    if document is not None:
+        return document
+
+    # Documento todavía no generado (producto nuevo o invalidado por un cambio masivo)
+    query = db.session.query(Product.id).filter(Product.is_active == True)
+    if product_id is not None:
+        query = query.filter(Product.id == product_id)
+    else:
+        query = query.filter(Product.slug == slug)
+    product = query.first()
+    if product is None:
+        return None
+
+    # En su propia transacción: un GET no confirma lo que haya pendiente en db.session
+    build_documents_apart(db.session.get_bind(), {product.id})
+    return lookup()
+
+def build_documents_apart(bind, product_ids, category_ids=()):
+    """Rebuild the documents of these products, and of the products in these
+    categories, in a short transaction of their own session.
+    Returns: number of stored documents"""
+    with Session(bind=bind) as session:
+        product_ids = set(product_ids)
+        if category_ids:
+            product_ids |= _category_product_ids(session, category_ids)
+        stored = build_product_documents(product_ids, session)
+        session.commit()
+        return stored
+
+## Reconstrucción a partir de los eventos de la sesión, después del commit ##
+def queue_document_rebuild(session, product_ids):
+    """Rebuild these products' documents after commit (for changes made with raw SQL)"""
+    session.info.setdefault('documents_products', set()).update(product_ids)
+
+def _related_product_ids(instance):
+    history = inspect(instance).attrs.product_id.history
+    return {value for value in (*history.sum(), instance.product_id) if value is not None}
+
+def _category_product_ids(session, category_ids):
+    return set(session.execute(
+        db.select(product_categories.c.product_id).where(product_categories.c.category_id.in_(category_ids))
+    ).scalars())
+
+@event.listens_for(Session, 'before_flush')
+def track_deleted_categories(session, flush_context, instances):
+    # Después del flush la categoría ya no tiene productos asociados: leerlos antes
+    category_ids = [instance.id for instance in session.deleted if isinstance(instance, Category)]
+    if category_ids:
+        session.info.setdefault('documents_products', set()).update(_category_product_ids(session, category_ids))
+
+@event.listens_for(Session, 'after_flush')
+def track_document_changes(session, flush_context):
+    for instance in session.new | session.dirty | session.deleted:
+        if isinstance(instance, Product):
+            session.info.setdefault('documents_products', set()).add(instance.id)
+        elif isinstance(instance, CHILD_MODELS):
+            session.info.setdefault('documents_products', set()).update(_related_product_ids(instance))
+        elif isinstance(instance, Category) and instance not in session.deleted:
+            session.info.setdefault('documents_categories', set()).add(instance.id)
+
+def _statement_product_ids(session, statement):
+    """Products touched by a bulk statement on a catalog table, read with the
+    statement's own criteria before it runs.
+    Returns: set of product ids, or None when they cannot be known"""
+    table = statement.table
+    if not isinstance(statement, (Update, Delete)):
+        # Productos nuevos todavía no tienen documento; otras inserciones masivas no dicen a quién afectan
+        return set() if table.name == Product.__tablename__ else None
+    if statement.whereclause is None:
+        return None
+    if table.name == Product.__tablename__:
+        column = table.c.id
+    elif 'product_id' in table.c:
+        column = table.c.product_id
+    elif table.name == Category.__tablename__:
+        return _category_product_ids(session, db.select(table.c.id).where(statement.whereclause))
+    else:
+        return None
+    return set(session.execute(db.select(column).where(statement.whereclause)).scalars())
+
+@event.listens_for(Session, 'do_orm_execute')
+def track_document_statements(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        statement = orm_execute_state.statement
+        table = getattr(statement, 'table', None)
+        if table is None or table.name not in CATALOG_TABLES:
+            return
+        session = orm_execute_state.session
+        product_ids = _statement_product_ids(session, statement)
+        if product_ids is None:
+            # Sin forma de saber qué productos tocó: reconstrucción por lotes tras el commit
+            session.info['documents_reset'] = True
+        else:
+            session.info.setdefault('documents_products', set()).update(product_ids)
+
+_rebuild_lock = threading.Lock()
+_rebuild_state = {'running': False, 'pending': False}
+
+def _rebuild_all(app):
+    while True:
+        try:
+            with app.app_context():
+                try:
+                    stored = rebuild_all_product_documents()
+                finally:
+                    db.session.remove()
+            app.logger.info('Rebuilt %s product documents after a bulk catalog change', stored)
+        except Exception:
+            app.logger.exception('Product document rebuild failed')
+        # Otro cambio masivo durante la reconstrucción: pudo tocar lotes ya regenerados
+        with _rebuild_lock:
+            if not _rebuild_state['pending']:
+                _rebuild_state['running'] = False
+                return
+            _rebuild_state['pending'] = False
+
+@event.listens_for(Session, 'after_commit')
+def rebuild_documents_after_commit(session):
+    # Fuera de la transacción que cambió el catálogo: sus bloqueos (p. ej. el stock de un
+    # checkout) ya están liberados mientras se serializan los productos
+    product_ids = session.info.pop('documents_products', set())
+    category_ids = session.info.pop('documents_categories', set())
+    reset = session.info.pop('documents_reset', False)
+    if not has_app_context():
+        return
+
+    # Con una reconstrucción completa pendiente no vale la pena reconstruir una parte ahora
+    if not reset and (product_ids or category_ids):
+        try:
+            build_documents_apart(session.get_bind(), product_ids, category_ids)
+        except Exception:
+            current_app.logger.exception('Product document rebuild failed, rebuilding every document')
+            reset = True
+    if not reset:
+        return
+
+    # Los documentos actuales se siguen sirviendo mientras se regeneran por lotes
+    with _rebuild_lock:
+        if _rebuild_state['running']:
+            _rebuild_state['pending'] = True
+            return
+        _rebuild_state['running'] = True
+    threading.Thread(target=_rebuild_all, args=(current_app._get_current_object(),), daemon=True).start()
+
+@event.listens_for(Session, 'after_rollback')
+def discard_document_changes(session):
+    for key in ('documents_products', 'documents_categories', 'documents_reset'):
+        session.info.pop(key, None)
@@ -0,0 +1,105 @@
+import uuid
+from decimal import Decimal
+from flask import current_app
+from sqlalchemy import case, literal, union_all
+from app import db
+from ..models import Product, product_categories
+from .utils_categories import category_tree
+
+FACETS = ('category', 'price', 'stock', 'featured')
+
+class InvalidFacet(ValueError):
+    """Raised when an unknown facet is requested"""
+
+def parse_facets(value):
+    """Parse '?facets=category,price' into a tuple of known facet names"""
+    requested = [name.strip() for name in (value or '').split(',') if name.strip()]
+    unknown = [name for name in requested if name not in FACETS]
+    if unknown:
+        raise InvalidFacet(f"Unknown facets: {', '.join(unknown)}. Allowed: {', '.join(FACETS)}")
+    return tuple(name for name in FACETS if name in requested)
+
+def get_price_boundaries():
+    """Ascending price bucket boundaries from PRODUCT_FACET_PRICE_BUCKETS"""
+    boundaries = current_app.config.get('PRODUCT_FACET_PRICE_BUCKETS', '0,25,50,100,250,500')
+    if isinstance(boundaries, str):
+        boundaries = boundaries.split(',')
+    return sorted({Decimal(str(boundary).strip()) for boundary in boundaries if str(boundary).strip()})
+
+def compute_facets(query, facets):
+    """Count the requested facets over the filtered product query in a single
+    round trip: the filtered set is a CTE and every facet is one branch of a
+    UNION ALL returning (facet, value, count) rows."""
+    if not facets:
+        return {}
+
+    filtered = query.order_by(None).with_entities(
+        Product.id, Product.price, Product.stock_quantity, Product.is_featured
+    ).cte('filtered')
+    boundaries = get_price_boundaries()
+
+    branches = []
+    if 'category' in facets:
+        branches.append(
+            db.select(
+                literal('category'),
+                db.cast(product_categories.c.category_id, db.String),
+                db.func.count()
+            ).select_from(filtered).join(
+                product_categories, product_categories.c.product_id == filtered.c.id
+            ).group_by(product_categories.c.category_id)
+        )
+    if 'price' in facets and boundaries:
+        # Índice del bucket: -1 por debajo del primer límite, el último queda abierto
+        bucket = case(
+            *[(filtered.c.price >= boundary, str(index)) for index, boundary in reversed(list(enumerate(boundaries)))],
+            else_='-1'
+        )
+        branches.append(
+            db.select(literal('price'), bucket, db.func.count()).select_from(filtered).group_by(bucket)
+        )
+    if 'stock' in facets:
+        stock = case((filtered.c.stock_quantity > 0, 'in_stock'), else_='out_of_stock')
+        branches.append(
+            db.select(literal('stock'), stock, db.func.count()).select_from(filtered).group_by(stock)
+        )
+    if 'featured' in facets:
+        featured = case((filtered.c.is_featured == True, 'featured'), else_='not_featured')
+        branches.append(
+            db.select(literal('featured'), featured, db.func.count()).select_from(filtered).group_by(featured)
+        )
+
+    counts = {facet: {} for facet in facets}
+    if branches:
+        for facet, value, count in db.session.execute(union_all(*branches)):
+            counts[facet][value] = count
+
+    result = {}
+    if 'category' in facets:
+        tree = category_tree.get()
+        result['category'] = []
+        for category_id, count in counts['category'].items():
+            node = tree.nodes.get(uuid.UUID(category_id))
+            if node is not None and node['is_active']:
+                result['category'].append(dict(node['category'], count=count))
+        result['category'].sort(key=lambda item: (-item['count'], item['name']))
+    if 'price' in facets:
+        result['price'] = [
+            {
+                'min': float(boundary),
+                'max': float(boundaries[index + 1]) if index + 1 < len(boundaries) else None,
+                'count': counts['price'].get(str(index), 0)
+            }
+            for index, boundary in enumerate(boundaries)
+        ]
+    if 'stock' in facets:
+        result['stock'] = {
+            'in_stock': counts['stock'].get('in_stock', 0),
+            'out_of_stock': counts['stock'].get('out_of_stock', 0)
+        }
+    if 'featured' in facets:
+        result['featured'] = {
+            'featured': counts['featured'].get('featured', 0),
+            'not_featured': counts['featured'].get('not_featured', 0)
+        }
+    return result
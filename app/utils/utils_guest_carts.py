@@ -0,0 +1,386 @@
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from app import db
+from ..models import Cart, Product, ProductVariant
+from .utils_cart import cart_item_view, fold_cart_operations, hold_cart_changes, load_line_catalog, refresh_cart_totals
+from .utils_reservations import stock_holds
+from .utils_cache import get_redis_client
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Espacio de nombres de los ids de carritos de invitado: el id se deriva de la sesión,
+# es estable sin guardar nada y se conserva al persistir el carrito en PostgreSQL
+GUEST_CART_NAMESPACE = uuid.UUID('8f1c2b0e-5a7d-4c1e-9b3a-6d2f0e4a7c15')
+
+# Inserta las líneas del documento (jsonb) ignorando productos/variantes que ya no existen
+PERSIST_GUEST_ITEMS_SQL = """
+    INSERT INTO cart_items (id, cart_id, product_id, variant_id, quantity, unit_price, created_at, updated_at)
+    SELECT line.id, CAST(:cart_id AS uuid), line.product_id, line.variant_id, line.quantity,
+           line.unit_price, line.created_at, now()
+    FROM jsonb_to_recordset(CAST(:lines AS jsonb)) AS line(
+        id uuid, product_id uuid, variant_id uuid, quantity integer, unit_price numeric, created_at timestamptz
+    )
+    JOIN products ON products.id = line.product_id
+    WHERE line.variant_id IS NULL OR EXISTS (SELECT 1 FROM product_variants WHERE product_variants.id = line.variant_id)
+    ON CONFLICT DO NOTHING
+"""
+
+class MemoryGuestCartBackend:
+    """Per-process guest carts with TTL eviction (development and tests)"""
+
+    def __init__(self, sweep_interval=60):
+        self.sweep_interval = sweep_interval
+        self._carts = {}  # session_id -> (expires_at, payload)
+        self._swept_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        expired = [key for key, (expires_at, _) in self._carts.items() if expires_at <= now]
+        for key in expired:
+            del self._carts[key]
+        self._swept_at = now
+
+    def _read(self, key, now):
+        entry = self._carts.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        return json.loads(entry[1])
+
+    def get(self, key):
+        with self._lock:
+            return self._read(key, time.monotonic())
+
+    def update(self, key, mutate, ttl):
+        """Run mutate(document) -> (result, new document) atomically for one cart"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._swept_at >= self.sweep_interval:
+                self._sweep(now)
+            result, document = mutate(self._read(key, now))
+            if document is None:
+                self._carts.pop(key, None)
+            else:
+                self._carts[key] = (now + ttl, json.dumps(document))
+            return result
+
+    def delete(self, key):
+        with self._lock:
+            self._carts.pop(key, None)
+
+class RedisGuestCartBackend:
+    """Guest carts shared by every worker; redis expires them by TTL"""
+
+    def __init__(self, url, prefix='guest_cart'):
+        self.client = get_redis_client(url)
+        self.prefix = prefix
+
+    def _key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def get(self, key):
+        payload = self.client.get(self._key(key))
+        return json.loads(payload) if payload else None
+
+    def update(self, key, mutate, ttl):
+        """Optimistic read-modify-write (WATCH/MULTI); mutate is retried on conflict"""
+        key = self._key(key)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    payload = pipe.get(key)
+                    result, document = mutate(json.loads(payload) if payload else None)
+                    pipe.multi()
+                    if document is None:
+                        pipe.delete(key)
+                    else:
+                        pipe.set(key, json.dumps(document), ex=ttl)
+                    pipe.execute()
+                    return result
+                except redis.WatchError:
+                    continue
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+def _totals(document):
+    lines = document['items'] if document else []
+    return {
+        'subtotal': float(sum(Decimal(line['unit_price']) * line['quantity'] for line in lines)),
+        'total_items': sum(line['quantity'] for line in lines),
+        'items_count': len(lines)
+    }
+
+def _key(line):
+    return uuid.UUID(line['product_id']), uuid.UUID(line['variant_id']) if line['variant_id'] else None
+
+def _find(document, item_id):
+    for line in document['items'] if document else []:
+        if line['id'] == str(item_id):
+            return line
+    return None
+
+def _touch(document):
+    document['updated_at'] = datetime.now(timezone.utc).isoformat()
+    return document
+
+def _new_line(key, quantity, unit_price, product_name):
+    return {
+        'id': str(uuid.uuid4()),
+        'product_id': str(key[0]),
+        'variant_id': str(key[1]) if key[1] else None,
+        'product_name': product_name,
+        'quantity': quantity,
+        'unit_price': str(unit_price),
+        'created_at': datetime.now(timezone.utc).isoformat()
+    }
+
+class GuestCartStore:
+    """Keeps anonymous carts out of PostgreSQL.
+
+    With GUEST_CART_BACKEND = 'memory' or 'redis', guest carts live in the
+    store as a JSON document per cart_session_id that expires GUEST_CART_TTL
+    seconds after its last change. Reading an empty cart writes nothing. A
+    cart only becomes a Cart row when it is persisted (merge at login or
+    checkout). 'database' (default) keeps the previous behaviour.
+
+    Mutations return the same shapes as the SQL helpers of utils_cart, so the
+    cart endpoints keep their API whatever the storage."""
+
+    def __init__(self):
+        self.backend = None
+        self.ttl = 7 * 24 * 3600
+
+    def init_app(self, app):
+        backend = app.config.get('GUEST_CART_BACKEND', 'database')
+        self.ttl = app.config.get('GUEST_CART_TTL', 7 * 24 * 3600)
+        if backend == 'memory':
+            self.backend = MemoryGuestCartBackend(app.config.get('GUEST_CART_SWEEP_INTERVAL', 60))
+        elif backend == 'redis':
+            self.backend = RedisGuestCartBackend(app.config['GUEST_CART_URL'])
+        else:
+            self.backend = None
+        app.extensions['guest_carts'] = self
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def cart_id(self, session_id):
+        return uuid.uuid5(GUEST_CART_NAMESPACE, session_id)
+
+    def get(self, session_id):
+        return self.backend.get(session_id)
+
+    def _update(self, session_id, mutate):
+        return self.backend.update(session_id, mutate, self.ttl)
+
+    def view(self, session_id):
+        """Same result as load_cart_view, reading products and variants with one query"""
+        document = self.get(session_id)
+        lines = document['items'] if document else []
+        cart = {
+            'id': self.cart_id(session_id),
+            'updated_at': datetime.fromisoformat(document['updated_at']) if document else datetime.now(timezone.utc),
+            'totals': _totals(document)
+        }
+        if not lines:
+            return cart, []
+
+        products = {}
+        variants = {}
+        product_ids = {line['product_id'] for line in lines}
+        variant_ids = {line['variant_id'] for line in lines if line['variant_id']}
+        rows = db.session.query(
+            Product.id, Product.name, Product.slug, Product.price, Product.stock_quantity, Product.is_active,
+            ProductVariant.id, ProductVariant.name, ProductVariant.price,
+            ProductVariant.stock_quantity, ProductVariant.attributes
+        ).outerjoin(ProductVariant, db.and_(
+            ProductVariant.product_id == Product.id, ProductVariant.id.in_(variant_ids)
+        )).filter(Product.id.in_(product_ids), Product.is_active == True).all()
+        for row in rows:
+            products[str(row[0])] = row[1:6]
+            if row[6]:
+                variants[str(row[6])] = row[6:]
+
+        items_data = []
+        for line in lines:
+            product = products.get(line['product_id'])
+            if product is None:
+                continue  # Producto inactivo: no se muestra, como en load_cart_view
+            variant = variants.get(line['variant_id']) if line['variant_id'] else None
+            items_data.append(cart_item_view(SimpleNamespace(
+                item_id=line['id'], product_id=line['product_id'], variant_id=line['variant_id'],
+                quantity=line['quantity'], unit_price=Decimal(line['unit_price']),
+                product_name=product[0], product_slug=product[1], product_price=product[2],
+                product_stock=product[3], product_active=product[4],
+                variant_found=variant[0] if variant else None,
+                variant_name=variant[1] if variant else None,
+                variant_price=variant[2] if variant else None,
+                variant_stock=variant[3] if variant else None,
+                variant_attributes=variant[4] if variant else None
+            )))
+        return cart, items_data
+
+    def add_item(self, session_id, product_id, variant_id, quantity):
+        """Same contract as utils_cart.add_cart_item"""
+        key = (product_id, variant_id)
+        catalog = load_line_catalog({key})
+        if key not in catalog:
+            return None
+        unit_price, stock, product_name = catalog[key]
+        # El documento no es transaccional: la reserva va antes y un fallo se deshace con rollback
+        stock_holds.reserve(self.cart_id(session_id), {key: quantity})
+
+        def mutate(document):
+            document = document or {'items': []}
+            line = next((line for line in document['items'] if _key(line) == key), None)
+            in_cart = line['quantity'] if line else None
+            result = SimpleNamespace(product_name=product_name, stock=stock, in_cart=in_cart, item_id=None)
+            if (in_cart or 0) + quantity > stock:
+                return result, document if document['items'] else None
+            if line is None:
+                line = _new_line(key, quantity, unit_price, product_name)
+                document['items'].append(line)
+            else:
+                line['quantity'] += quantity
+            result.item_id, result.quantity = line['id'], line['quantity']
+            result.__dict__.update(_totals(document))
+            return result, _touch(document)
+
+        return self._update(session_id, mutate)
+
+    def set_item_quantity(self, session_id, item_id, quantity):
+        """Same contract as utils_cart.set_cart_item_quantity"""
+        line = _find(self.get(session_id), item_id)
+        if line is None:
+            return None
+        key = _key(line)
+        catalog = load_line_catalog({key})
+        stock = catalog[key][1] if key in catalog else 0
+        # La reserva va antes (y comprueba el stock libre de reservas de otros carritos) con la
+        # cantidad leída; si mutate reemplaza otra, la diferencia se ajusta después
+        held = quantity - line['quantity'] if quantity <= stock else 0
+        stock_holds.reserve(self.cart_id(session_id), {key: held})
+
+        def mutate(document):
+            line = _find(document, item_id)
+            if line is None:
+                return None, document
+            result = SimpleNamespace(product_name=line['product_name'], stock=stock, item_id=None)
+            if quantity > stock:
+                return result, document
+            result.replaced = line['quantity']
+            line['quantity'] = quantity
+            result.item_id = line['id']
+            result.__dict__.update(_totals(document))
+            return result, _touch(document)
+
+        result = self._update(session_id, mutate)
+        if result is not None and result.item_id is not None and quantity - result.replaced != held:
+            stock_holds.reserve(self.cart_id(session_id), {key: quantity - result.replaced - held}, strict=False)
+        return result
+
+    def remove_item(self, session_id, item_id):
+        """Same contract as utils_cart.remove_cart_item"""
+        def mutate(document):
+            line = _find(document, item_id)
+            if line is None:
+                return None, document
+            document['items'].remove(line)
+            return SimpleNamespace(
+                product_name=line['product_name'], key=_key(line), quantity=line['quantity'], **_totals(document)
+            ), _touch(document)
+
+        result = self._update(session_id, mutate)
+        if result is not None:
+            stock_holds.reserve(self.cart_id(session_id), {result.key: -result.quantity})
+        return result
+
+    def clear(self, session_id):
+        """Same contract as utils_cart.clear_cart_items"""
+        def mutate(document):
+            lines = len(document['items']) if document else 0
+            return SimpleNamespace(lines=lines, **_totals(None)), None
+
+        result = self._update(session_id, mutate)
+        stock_holds.release(self.cart_id(session_id))
+        return result
+
+    def apply_operations(self, session_id, operations):
+        """Same contract as utils_cart.apply_cart_operations (CartOperationError leaves the cart untouched)"""
+        def lines_of(document):
+            return {_key(line): {'id': uuid.UUID(line['id']), 'quantity': line['quantity']} for line in (document or {'items': []})['items']}
+
+        if stock_holds.enabled:
+            # Reservar antes de escribir el documento, con el lote aplicado a su estado actual
+            lines = lines_of(self.get(session_id))
+            quantities, _ = fold_cart_operations(lines, operations)
+            hold_cart_changes(self.cart_id(session_id), lines, quantities)
+
+        def mutate(document):
+            document = document or {'items': []}
+            lines = lines_of(document)
+            quantities, catalog = fold_cart_operations(lines, operations)
+
+            applied = {'added': 0, 'updated': 0, 'removed': 0}
+            kept = []
+            for line in document['items']:
+                quantity = quantities[_key(line)]
+                if not quantity:
+                    applied['removed'] += 1
+                    continue
+                if quantity != line['quantity']:
+                    line['quantity'] = quantity
+                    applied['updated'] += 1
+                kept.append(line)
+            for key, quantity in quantities.items():
+                if key not in lines and quantity:
+                    unit_price, _, product_name = catalog[key]
+                    kept.append(_new_line(key, quantity, unit_price, product_name))
+                    applied['added'] += 1
+            document['items'] = kept
+            return applied, _touch(document)
+
+        return self._update(session_id, mutate)
+
+    def count(self, session_id):
+        return _totals(self.get(session_id))
+
+    def persist(self, session_id):
+        """Write the guest cart to PostgreSQL as a Cart row (id = cart_id(session_id))
+        with its items, for a merge or a checkout. The caller commits and then
+        calls discard().
+        Returns: the cart id, or None when the guest cart is empty"""
+        document = self.get(session_id)
+        if not document or not document['items']:
+            return None
+
+        cart_id = self.cart_id(session_id)
+        db.session.execute(
+            insert(Cart.__table__).values(id=cart_id, session_id=session_id).on_conflict_do_nothing()
+        )
+        db.session.execute(text(PERSIST_GUEST_ITEMS_SQL), {
+            'cart_id': str(cart_id),
+            'lines': json.dumps([
+                {key: line[key] for key in ('id', 'product_id', 'variant_id', 'quantity', 'unit_price', 'created_at')}
+                for line in document['items']
+            ])
+        })
+        refresh_cart_totals(cart_id)
+        return cart_id
+
+    def discard(self, session_id):
+        self.backend.delete(session_id)
+
+guest_carts = GuestCartStore()
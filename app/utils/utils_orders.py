@@ -0,0 +1,196 @@
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from sqlalchemy import text, update
+from app import db
+from ..models import Address, Cart, Coupon, Order, OrderItem
+from .utils_cache import mark_catalog_changed
+from .utils_cart import clear_cart_items
+from .utils_documents import queue_document_rebuild
+from .utils_reservations import commit_cart_holds
+
+ADDRESS_FIELDS = ['street_address', 'apartment', 'city', 'state', 'postal_code', 'country']
+REQUIRED_ADDRESS_FIELDS = ['street_address', 'city', 'state', 'postal_code', 'country']
+
+CENT = Decimal('0.01')
+
+# Líneas del carrito con el producto y la variante actuales: precio vigente y datos a copiar en la orden
+CHECKOUT_LINES_SQL = """
+    SELECT ci.product_id, ci.variant_id, ci.quantity, p.name AS product_name,
+           coalesce(v.sku, p.sku) AS product_sku, v.attributes AS variant_attributes,
+           CASE WHEN v.id IS NULL THEN p.price ELSE coalesce(v.price, p.price) END AS unit_price,
+           p.is_active AND (ci.variant_id IS NULL OR coalesce(v.is_active, false)) AS available
+    FROM cart_items ci
+    JOIN products p ON p.id = ci.product_id
+    LEFT JOIN product_variants v ON v.id = ci.variant_id
+    WHERE ci.cart_id = CAST(:cart_id AS uuid)
+    ORDER BY ci.created_at, ci.id
+"""
+
+class CheckoutError(ValueError):
+    """The cart cannot be turned into an order; the caller rolls back"""
+
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+    def to_dict(self):
+        return {'error': str(self), **self.details}
+
+def address_snapshot(data):
+    """Validate an inline address (same fields as Address) and keep only its fields.
+    Returns: dict, or None when a required field is missing"""
+    if not isinstance(data, dict) or any(not data.get(field) for field in REQUIRED_ADDRESS_FIELDS):
+        return None
+    return {field: data.get(field) for field in ADDRESS_FIELDS}
+
+def load_user_addresses(user_id, address_ids):
+    """Addresses of the user by id, read with one query.
+    Returns: {address_id: snapshot dict}"""
+    if not address_ids:
+        return {}
+    addresses = Address.query.filter(Address.user_id == user_id, Address.id.in_(address_ids)).all()
+    return {address.id: {field: getattr(address, field) for field in ADDRESS_FIELDS} for address in addresses}
+
+def new_order_number(order_id, now):
+    # Derivado del id de la orden: el trigger set_order_number busca el primer número libre
+    # del día con una consulta por intento, lento y con colisiones bajo checkouts concurrentes
+    return f"ORD-{now:%Y%m%d}-{order_id.hex[:10].upper()}"
+
+def redeem_coupon(code, subtotal):
+    """Validate a coupon and count its use with one conditional UPDATE, so
+    concurrent checkouts never exceed usage_limit.
+    Returns: the Coupon, or None when it does not apply"""
+    now = datetime.now(timezone.utc)
+    return db.session.scalars(
+        update(Coupon)
+        .where(
+            Coupon.code == code,
+            Coupon.is_active == True,
+            db.or_(Coupon.valid_from == None, Coupon.valid_from <= now),
+            db.or_(Coupon.valid_until == None, Coupon.valid_until >= now),
+            db.or_(Coupon.usage_limit == None, db.func.coalesce(Coupon.used_count, 0) < Coupon.usage_limit),
+            db.or_(Coupon.minimum_amount == None, Coupon.minimum_amount <= subtotal)
+        )
+        .values(used_count=db.func.coalesce(Coupon.used_count, 0) + 1)
+        .returning(Coupon)
+    ).first()
+
+def checkout_cart(user_id, shipping_address, billing_address, coupon_code=None, shipping_method=None, customer_notes=None):
+    """Turn the user's cart into an order inside the current transaction.
+
+    Runs a fixed number of statements whatever the cart size: the cart row is
+    locked, its lines are read with their products and variants in one query,
+    the stock of every line is taken with set-based statements that lock the
+    stock rows in id order (commit_cart_holds), the order and all its items are
+    inserted and the cart is cleared. The catalog cache and the documents of the
+    sold products are refreshed at commit. Raises CheckoutError when the cart is
+    empty, a line is no longer sold or out of stock, or the coupon does not
+    apply. The caller commits.
+    Returns: (order, order items as dicts)"""
+    # Bloquear el carrito: dos checkouts del mismo carrito se serializan
+    cart = Cart.query.filter_by(user_id=user_id).with_for_update().first()
+    if cart is None:
+        raise CheckoutError("Cart is empty")
+
+    lines = db.session.execute(text(CHECKOUT_LINES_SQL), {'cart_id': str(cart.id)}).all()
+    if not lines:
+        raise CheckoutError("Cart is empty")
+
+    unavailable = [line for line in lines if not line.available]
+    if unavailable:
+        raise CheckoutError("Some products are no longer available", status=409, items=[
+            {
+                'product_id': str(line.product_id),
+                'variant_id': str(line.variant_id) if line.variant_id else None,
+                'product_name': line.product_name
+            }
+            for line in unavailable
+        ])
+
+    short = commit_cart_holds(cart.id)
+    if short:
+        raise CheckoutError("Not enough stock available", status=409, items=[
+            {
+                'product_id': str(line.product_id),
+                'variant_id': str(line.variant_id) if line.variant_id else None,
+                'requested_quantity': line.quantity,
+                'available_stock': max(line.available or 0, 0)
+            }
+            for line in short
+        ])
+    # El stock se descontó con SQL: los eventos del ORM no invalidan caché ni documentos
+    mark_catalog_changed(db.session)
+    queue_document_rebuild(db.session, {line.product_id for line in lines})
+
+    subtotal = sum((line.unit_price * line.quantity for line in lines), Decimal(0))
+    discount = Decimal(0)
+    coupon = None
+    if coupon_code:
+        coupon = redeem_coupon(coupon_code, subtotal)
+        if coupon is None:
+            raise CheckoutError("Invalid or expired coupon")
+        discount = Decimal(coupon.calculate_discount(subtotal)).quantize(CENT)
+
+    now = datetime.now(timezone.utc)
+    order_id = uuid.uuid4()
+    order = Order(
+        id=order_id,
+        order_number=new_order_number(order_id, now),
+        user_id=user_id,
+        status='pending',
+        payment_status='pending',
+        subtotal=subtotal,
+        tax_amount=Decimal(0),
+        shipping_amount=Decimal(0),
+        discount_amount=discount,
+        total_amount=subtotal - discount,
+        shipping_address=shipping_address,
+        billing_address=billing_address,
+        shipping_method=shipping_method,
+        coupon_id=coupon.id if coupon else None,
+        coupon_code=coupon.code if coupon else None,
+        customer_notes=customer_notes,
+        created_at=now,
+        updated_at=now
+    )
+    db.session.add(order)
+    db.session.flush()
+
+    # Todas las líneas en un solo INSERT, con nombre, SKU y atributos copiados del catálogo
+    items = [
+        {
+            'id': uuid.uuid4(),
+            'order_id': order_id,
+            'product_id': line.product_id,
+            'variant_id': line.variant_id,
+            'product_name': line.product_name,
+            'product_sku': line.product_sku,
+            'variant_attributes': line.variant_attributes,
+            'quantity': line.quantity,
+            'unit_price': line.unit_price,
+            'total_price': line.unit_price * line.quantity,
+            'created_at': now,
+            'updated_at': now
+        }
+        for line in lines
+    ]
+    db.session.execute(OrderItem.__table__.insert().values(items))
+
+    clear_cart_items(cart.id)
+    return order, items
+
+def order_item_view(item):
+    """Order item dict (as inserted by checkout_cart), as OrderItem.to_dict()"""
+    return {
+        'id': str(item['id']),
+        'product_id': str(item['product_id']) if item['product_id'] else None,
+        'variant_id': str(item['variant_id']) if item['variant_id'] else None,
+        'product_name': item['product_name'],
+        'product_sku': item['product_sku'],
+        'variant_attributes': item['variant_attributes'],
+        'quantity': item['quantity'],
+        'unit_price': float(item['unit_price']),
+        'total_price': float(item['total_price'])
+    }
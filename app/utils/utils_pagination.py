@@ -0,0 +1,116 @@
+import base64
+import binascii
+import json
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import and_, or_, tuple_
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor is malformed or belongs to another ordering"""
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return ['dt', value.isoformat()]
+    if isinstance(value, Decimal):
+        return ['dec', str(value)]
+    if isinstance(value, uuid.UUID):
+        return ['uuid', str(value)]
+    return ['raw', value]
+
+def _decode_value(encoded):
+    kind, value = encoded
+    if kind == 'dt':
+        return datetime.fromisoformat(value)
+    if kind == 'dec':
+        return Decimal(value)
+    if kind == 'uuid':
+        return uuid.UUID(value)
+    if kind == 'raw':
+        return value
+    raise InvalidCursor('Unknown cursor value type.')
+
+def encode_cursor(signature, values):
+    """Encode the sort key of the last row into an opaque cursor"""
+    payload = json.dumps({'s': signature, 'k': [_encode_value(value) for value in values]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, signature):
+    """Decode a cursor, checking it was issued for the same ordering"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload['s'] != signature:
+            raise InvalidCursor('Cursor does not match the requested ordering.')
+        return [_decode_value(value) for value in payload['k']]
+    except InvalidCursor:
+        raise
+    except (binascii.Error, ValueError, KeyError, TypeError) as error:
+        raise InvalidCursor('Malformed cursor.') from error
+
+def _after(order_by, values):
+    """Build the predicate selecting rows strictly after the given sort key"""
+    directions = {descending for _, descending in order_by}
+    expressions = [expression for expression, _ in order_by]
+
+    # Misma dirección en todas las columnas: comparación de tuplas (usa el índice compuesto)
+    if len(directions) == 1:
+        if directions.pop():
+            return tuple_(*expressions) < tuple_(*values)
+        return tuple_(*expressions) > tuple_(*values)
+
+    conditions = []
+    for position, (expression, descending) in enumerate(order_by):
+        equal_prefix = [order_by[i][0] == values[i] for i in range(position)]
+        step = expression < values[position] if descending else expression > values[position]
+        conditions.append(and_(*equal_prefix, step))
+    return or_(*conditions)
+
+class KeysetPage:
+    """One page of a keyset (cursor) paginated query"""
+
+    def __init__(self, items, per_page, next_cursor, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def to_dict(self):
+        return {
+            'mode': 'cursor',
+            'per_page': self.per_page,
+            'next_cursor': self.next_cursor,
+            'has_next': self.has_next,
+            'total': self.total
+        }
+
+def keyset_paginate(query, order_by, per_page, cursor=None, signature='', with_total=False):
+    """Paginate a query by seeking past the sort key of the previous page.
+    order_by: list of (expression, descending) pairs ending in a unique column.
+    The cost of a page does not depend on its depth and no COUNT is issued
+    unless with_total is requested."""
+    total = query.order_by(None).count() if with_total else None
+
+    if cursor:
+        values = decode_cursor(cursor, signature)
+        if len(values) != len(order_by):
+            raise InvalidCursor('Cursor does not match the requested ordering.')
+        query = query.filter(_after(order_by, values))
+
+    query = query.order_by(*[
+        expression.desc() if descending else expression.asc() for expression, descending in order_by
+    ]).add_columns(*[
+        expression.label(f'sort_key_{position}') for position, (expression, _) in enumerate(order_by)
+    ])
+
+    rows = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(signature, list(rows[-1][1:]))
+
+    return KeysetPage([row[0] for row in rows], per_page, next_cursor, total)
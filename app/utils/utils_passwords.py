@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import check_password_hash, generate_password_hash
+
+class PasswordHasherBusy(RuntimeError):
+    """Raised when every hashing slot is taken for longer than the queue timeout"""
+
+def _hash_password(password, method):
+    return generate_password_hash(password, method=method)
+
+def _verify_password(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+class PasswordHasher:
+    """Runs password hashing and verification in a bounded process pool so
+    CPU-heavy scrypt/pbkdf2 work never pins the request threads.
+
+    At most PASSWORD_HASH_MAX_PENDING operations run or wait at once; a request
+    that cannot get a slot within PASSWORD_HASH_QUEUE_TIMEOUT seconds fails
+    fast with PasswordHasherBusy (served as 503). PASSWORD_HASH_WORKERS = 0
+    hashes inline in the calling thread, still under the same cap."""
+
+    def __init__(self):
+        self.method = 'scrypt'
+        self.workers = 0
+        self.queue_timeout = 2.0
+        self._slots = threading.BoundedSemaphore(1)
+        self._executor = None
+        self._executor_pid = None
+        self._prefix = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', 'scrypt')
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+        self.queue_timeout = app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', 2.0)
+        max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING') or 2 * max(self.workers, 1)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._prefix = None
+        app.extensions['password_hasher'] = self
+
+    def _get_executor(self):
+        # Un pool por proceso: los workers de gunicorn creados por fork no comparten el del padre
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = create_hashing_pool(self.workers)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHasherBusy("Password hashing capacity exceeded")
+        try:
+            if not self.workers:
+                return function(*args)
+            return self._get_executor().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash_password, password, self.method)
+
+    def hash_many(self, passwords, executor=None, chunksize=16):
+        """Hash a batch of passwords for offline jobs (e.g. bulk imports),
+        spread over `executor` when given; does not take request slots"""
+        if executor is None:
+            return [_hash_password(password, self.method) for password in passwords]
+        return list(executor.map(_hash_password, passwords, [self.method] * len(passwords), chunksize=chunksize))
+
+    def verify(self, password_hash, password):
+        return self._run(_verify_password, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True when the stored hash was made with other parameters than the configured ones"""
+        if self._prefix is None:
+            # Prefijo normalizado por werkzeug (p. ej. 'scrypt:32768:8:1'); se calcula una vez
+            self._prefix = _hash_password('', self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+def create_hashing_pool(workers):
+    """Process pool for batch hashing (spawned, safe from forked DB connections)"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,134 @@
+import hashlib
+from app import db
+from ..models import Category, Product, ProductImage, ProductReview, ProductVariant, product_categories
+
+def load_product_relations(product_ids, include_variants=False, include_images=False, session=None):
+    """Load categories and optionally variants and images for a whole page
+    of products, issuing one query per relation (on db.session by default).
+    Returns: {product_id: {'categories': [...], 'variants': [...], 'images': [...]}}"""
+    relations = {
+        product_id: {'categories': [], 'variants': [], 'images': []}
+        for product_id in product_ids
+    }
+    if not relations:
+        return relations
+
+    ids = list(relations)
+    session = session or db.session
+
+    # Categorías de todos los productos de la página
+    category_rows = session.query(product_categories.c.product_id, Category).join(
+        Category, Category.id == product_categories.c.category_id
+    ).filter(product_categories.c.product_id.in_(ids)).all()
+    for product_id, category in category_rows:
+        relations[product_id]['categories'].append(category)
+
+    if include_variants:
+        variants = session.query(ProductVariant).filter(
+            ProductVariant.product_id.in_(ids),
+            ProductVariant.is_active == True
+        ).order_by(ProductVariant.created_at).all()
+        for variant in variants:
+            relations[variant.product_id]['variants'].append(variant)
+
+    if include_images:
+        images = session.query(ProductImage).filter(
+            ProductImage.product_id.in_(ids)
+        ).order_by(ProductImage.sort_order).all()
+        for image in images:
+            relations[image.product_id]['images'].append(image)
+
+    return relations
+
+def serialize_products(products, include_variants=False, include_images=False, session=None):
+    """Serialize a list of products using batched relation loading"""
+    relations = load_product_relations(
+        [product.id for product in products], include_variants, include_images, session
+    )
+
+    products_list = []
+    for product in products:
+        related = relations[product.id]
+        product_data = product.to_dict()
+
+        if include_variants:
+            product_data['variants'] = [variant.to_dict() for variant in related['variants']]
+
+        if include_images:
+            product_data['images'] = [image.to_dict() for image in related['images']]
+
+        product_data['categories'] = [cat.to_dict() for cat in related['categories']]
+        products_list.append(product_data)
+
+    return products_list
+
+def recompute_rating_aggregates():
+    """Rebuild the denormalized rating columns of every product from its
+    approved reviews. Only rows whose stored values drift are rewritten.
+    Returns: number of repaired products"""
+    products = Product.__table__
+    rating = ProductReview.rating
+
+    stats = db.session.query(
+        ProductReview.product_id.label('product_id'),
+        db.func.sum(rating).label('rating_sum'),
+        db.func.count(ProductReview.id).label('rating_count'),
+        *[db.func.count(ProductReview.id).filter(rating == star).label(f'rating_{star}_count')
+          for star in range(1, 6)]
+    ).filter(ProductReview.is_approved == True, rating.between(1, 5)).group_by(ProductReview.product_id).subquery()
+
+    columns = ['rating_sum', 'rating_count'] + [f'rating_{star}_count' for star in range(1, 6)]
+
+    # Productos con agregados pero sin reseñas aprobadas
+    reset = db.session.execute(
+        products.update()
+        .where(products.c.rating_count != 0)
+        .where(~products.c.id.in_(db.select(stats.c.product_id)))
+        .values({column: 0 for column in columns})
+    )
+
+    # Productos cuyos agregados no coinciden con las reseñas
+    repaired = db.session.execute(
+        products.update()
+        .where(products.c.id == stats.c.product_id)
+        .where(db.or_(*[products.c[column].is_distinct_from(stats.c[column]) for column in columns]))
+        .values({column: stats.c[column] for column in columns})
+    )
+
+    db.session.commit()
+    return reset.rowcount + repaired.rowcount
+
+def product_version(product_id=None, slug=None):
+    """Fetch the validators of an active product (by id or slug) with a single
+    query over the product, its variants, images and categories.
+    Returns: (product_id, etag, last_modified) or None if not found"""
+    def related(column, *criteria, select_from=None):
+        subquery = db.select(column).where(*criteria)
+        if select_from is not None:
+            subquery = subquery.select_from(select_from)
+        return subquery.correlate(Product).scalar_subquery()
+
+    category_join = product_categories.join(Category, Category.id == product_categories.c.category_id)
+    query = db.session.query(
+        Product.id,
+        Product.updated_at,
+        related(db.func.max(ProductVariant.updated_at), ProductVariant.product_id == Product.id),
+        related(db.func.count(ProductVariant.id), ProductVariant.product_id == Product.id),
+        related(db.func.max(ProductImage.updated_at), ProductImage.product_id == Product.id),
+        related(db.func.count(ProductImage.id), ProductImage.product_id == Product.id),
+        related(db.func.max(Category.updated_at), product_categories.c.product_id == Product.id, select_from=category_join),
+        related(db.func.count(Category.id), product_categories.c.product_id == Product.id, select_from=category_join)
+    ).filter(Product.is_active == True)
+
+    if product_id is not None:
+        query = query.filter(Product.id == product_id)
+    else:
+        query = query.filter(Product.slug == slug)
+
+    row = query.first()
+    if row is None:
+        return None
+
+    timestamps = [value for value in (row[1], row[2], row[4], row[6]) if value is not None]
+    etag = hashlib.sha1('|'.join(str(value) for value in row).encode()).hexdigest()
+    return row[0], etag, max(timestamps) if timestamps else None
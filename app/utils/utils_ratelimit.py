@@ -0,0 +1,157 @@
+import math
+import threading
+import time
+import uuid
+from array import array
+from functools import wraps
+from flask import jsonify, request
+from .utils_cache import get_redis_client
+
+# Comprueba todas las ventanas y sólo registra el intento si ninguna está llena
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local member = ARGV[2]
+local retry_after = 0
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[2 + i * 2 - 1])
+    local window = tonumber(ARGV[2 + i * 2])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    if redis.call('ZCARD', key) >= limit then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        retry_after = math.max(retry_after, tonumber(oldest[2]) + window - now)
+    end
+end
+if retry_after > 0 then
+    return tostring(retry_after)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, member)
+    redis.call('EXPIRE', key, math.ceil(tonumber(ARGV[2 + i * 2])))
+end
+return '0'
+"""
+
+def parse_limit(value):
+    """Parse a '<count>/<seconds>' limit such as '5/300'.
+    Returns: (count, seconds) or None when the limit is disabled"""
+    if not value:
+        return None
+    count, seconds = str(value).split('/')
+    return int(count), float(seconds)
+
+class MemoryRateLimitBackend:
+    """Per-process sliding windows. Each key keeps a ring buffer with the
+    timestamps of its last `limit` accepted attempts: the attempt is allowed
+    when the oldest slot fell out of the window. Idle keys are swept periodically."""
+
+    def __init__(self, sweep_interval=60):
+        self.sweep_interval = sweep_interval
+        self._windows = {}  # key -> [ring, next_slot, window, last_seen]
+        self._swept_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        expired = [key for key, (_, _, window, last_seen) in self._windows.items() if last_seen <= now - window]
+        for key in expired:
+            del self._windows[key]
+        self._swept_at = now
+
+    def hit(self, rules):
+        """Register an attempt against every (key, limit, window) rule.
+        Returns: seconds to wait, or 0 if the attempt is allowed"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._swept_at >= self.sweep_interval:
+                self._sweep(now)
+
+            retry_after = 0
+            for key, limit, window in rules:
+                state = self._windows.get(key)
+                if state is None or len(state[0]) != limit:
+                    state = self._windows[key] = [array('d', [-math.inf] * limit), 0, window, now]
+                ring, slot = state[0], state[1]
+                if ring[slot] > now - window:
+                    retry_after = max(retry_after, ring[slot] + window - now)
+            if retry_after:
+                return retry_after
+
+            for key, limit, window in rules:
+                state = self._windows[key]
+                state[0][state[1]] = now
+                state[1] = (state[1] + 1) % limit
+                state[2] = window
+                state[3] = now
+            return 0
+
+class RedisRateLimitBackend:
+    """Sliding windows shared by every worker, stored as redis sorted sets"""
+
+    def __init__(self, url, prefix='ratelimit'):
+        self.client = get_redis_client(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(SLIDING_WINDOW_SCRIPT)
+
+    def hit(self, rules):
+        arguments = [time.time(), uuid.uuid4().hex]
+        for _, limit, window in rules:
+            arguments.extend([limit, window])
+        retry_after = self._script(keys=[f'{self.prefix}:{key}' for key, _, _ in rules], args=arguments)
+        return float(retry_after)
+
+class RateLimiter:
+    """Throttles endpoints per client IP and per submitted email"""
+
+    def __init__(self):
+        self.backend = None
+        self.limits = {}
+
+    def init_app(self, app):
+        backend = app.config.get('RATE_LIMIT_BACKEND', 'memory')
+        if backend == 'memory':
+            self.backend = MemoryRateLimitBackend(app.config.get('RATE_LIMIT_SWEEP_INTERVAL', 60))
+        elif backend == 'redis':
+            self.backend = RedisRateLimitBackend(app.config['RATE_LIMIT_URL'])
+        else:
+            self.backend = None
+
+        self.limits = {
+            ('login', 'ip'): parse_limit(app.config.get('RATE_LIMIT_LOGIN_IP')),
+            ('login', 'email'): parse_limit(app.config.get('RATE_LIMIT_LOGIN_EMAIL')),
+            ('register', 'ip'): parse_limit(app.config.get('RATE_LIMIT_REGISTER_IP')),
+            ('register', 'email'): parse_limit(app.config.get('RATE_LIMIT_REGISTER_EMAIL')),
+        }
+        app.extensions['rate_limiter'] = self
+
+    def _scope_value(self, scope):
+        if scope == 'ip':
+            return request.remote_addr or 'unknown'
+        data = request.get_json(silent=True) or {}
+        email = data.get('email')
+        return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+    def limit(self, name, scopes=('ip', 'email')):
+        """Decorator rejecting the request with 429 before the view runs
+        (no database query nor password hash) once any window is full"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.backend is None:
+                    return view(*args, **kwargs)
+
+                rules = []
+                for scope in scopes:
+                    limit = self.limits.get((name, scope))
+                    value = self._scope_value(scope) if limit else None
+                    if value is not None:
+                        rules.append((f'{name}:{scope}:{value}', *limit))
+
+                retry_after = self.backend.hit(rules) if rules else 0
+                if retry_after:
+                    response = jsonify({"msg": "Too many requests, please try again later"})
+                    response.headers['Retry-After'] = str(math.ceil(retry_after))
+                    return response, 429
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,375 @@
+import threading
+import time
+from flask import current_app
+from sqlalchemy import text
+from app import db
+
+# Clave del advisory lock del barrido: un solo proceso libera reservas vencidas a la vez
+SWEEP_LOCK_KEY = 724301
+
+STOCK_SCHEMA_SQL = [
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS reserved_quantity INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE product_variants ADD COLUMN IF NOT EXISTS reserved_quantity INTEGER NOT NULL DEFAULT 0",
+    """
+    CREATE TABLE IF NOT EXISTS stock_reservations (
+        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        cart_id UUID NOT NULL,
+        product_id UUID NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+        variant_id UUID REFERENCES product_variants(id) ON DELETE CASCADE,
+        quantity INTEGER NOT NULL,
+        expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Requiere PostgreSQL 15+ (NULLS NOT DISTINCT: una sola reserva sin variante por producto)
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_stock_reservations_line ON stock_reservations(cart_id, product_id, variant_id) NULLS NOT DISTINCT",
+    "CREATE INDEX IF NOT EXISTS idx_stock_reservations_expires_at ON stock_reservations(expires_at)",
+    # Mover reserved_quantity no cambia updated_at (ETag de productos y documentos del catálogo)
+    "DROP TRIGGER IF EXISTS update_products_updated_at ON products",
+    """
+    CREATE TRIGGER update_products_updated_at BEFORE UPDATE ON products FOR EACH ROW
+        WHEN ((to_jsonb(OLD) - 'reserved_quantity') IS DISTINCT FROM (to_jsonb(NEW) - 'reserved_quantity'))
+        EXECUTE PROCEDURE update_updated_at_column()
+    """,
+    "DROP TRIGGER IF EXISTS update_product_variants_updated_at ON product_variants",
+    """
+    CREATE TRIGGER update_product_variants_updated_at BEFORE UPDATE ON product_variants FOR EACH ROW
+        WHEN ((to_jsonb(OLD) - 'reserved_quantity') IS DISTINCT FROM (to_jsonb(NEW) - 'reserved_quantity'))
+        EXECUTE PROCEDURE update_updated_at_column()
+    """,
+]
+
+# Ajusta la reserva de una línea en una sola sentencia. {table}: products o product_variants.
+# El UPDATE condicional es la reserva: Postgres reevalúa el WHERE sobre la última versión
+# de la fila, así que dos reservas concurrentes nunca pasan de stock_quantity
+HOLD_STOCK_SQL = """
+    WITH previous AS (
+        SELECT quantity FROM stock_reservations
+        WHERE cart_id = CAST(:cart_id AS uuid) AND product_id = CAST(:product_id AS uuid)
+          AND variant_id IS NOT DISTINCT FROM CAST(:variant_id AS uuid)
+        FOR UPDATE
+    ), change AS (
+        -- Una liberación nunca descuenta más de lo que la línea tiene retenido
+        SELECT CASE WHEN CAST(:delta AS integer) < 0
+                    THEN -LEAST(-CAST(:delta AS integer), coalesce((SELECT quantity FROM previous), 0))
+                    ELSE CAST(:delta AS integer) END AS delta
+    ), reserved AS (
+        UPDATE {table} SET reserved_quantity = {table}.reserved_quantity + change.delta
+        FROM change
+        WHERE {table}.id = CAST(:stock_id AS uuid) AND change.delta <> 0
+          AND (change.delta < 0 OR {table}.stock_quantity - {table}.reserved_quantity >= change.delta)
+        RETURNING change.delta
+    ), held AS (
+        INSERT INTO stock_reservations (id, cart_id, product_id, variant_id, quantity, expires_at, created_at)
+        SELECT gen_random_uuid(), CAST(:cart_id AS uuid), CAST(:product_id AS uuid), CAST(:variant_id AS uuid),
+               reserved.delta, now() + make_interval(secs => :ttl), now()
+        FROM reserved
+        WHERE coalesce((SELECT quantity FROM previous), 0) + reserved.delta > 0
+        ON CONFLICT (cart_id, product_id, variant_id) DO UPDATE SET
+            quantity = stock_reservations.quantity + EXCLUDED.quantity,
+            expires_at = EXCLUDED.expires_at
+    ), emptied AS (
+        -- Una línea que ya no retiene unidades no deja una reserva en cero
+        DELETE FROM stock_reservations
+        USING reserved
+        WHERE cart_id = CAST(:cart_id AS uuid) AND product_id = CAST(:product_id AS uuid)
+          AND variant_id IS NOT DISTINCT FROM CAST(:variant_id AS uuid)
+          AND stock_reservations.quantity + reserved.delta <= 0
+    )
+    SELECT EXISTS (SELECT 1 FROM reserved) AS held,
+           (SELECT stock_quantity - reserved_quantity FROM {table} WHERE id = CAST(:stock_id AS uuid)) AS available
+"""
+
+# Borra reservas y descuenta sus unidades de reserved_quantity en una sola sentencia.
+# {holds}: subconsulta con los ids de las reservas a liberar. Las filas de stock se bloquean
+# antes en orden de id (_LOCK_HELD_STOCK_SQL): el UPDATE ... FROM las toma en cualquier orden
+RELEASE_HOLDS_SQL = """
+    WITH released AS (
+        DELETE FROM stock_reservations WHERE id IN ({holds})
+        RETURNING product_id, variant_id, quantity
+    ), products_released AS (
+        UPDATE products SET reserved_quantity = products.reserved_quantity - freed.quantity
+        FROM (SELECT product_id, sum(quantity) AS quantity FROM released
+              WHERE variant_id IS NULL GROUP BY product_id) AS freed
+        WHERE products.id = freed.product_id
+    ), variants_released AS (
+        UPDATE product_variants SET reserved_quantity = product_variants.reserved_quantity - freed.quantity
+        FROM (SELECT variant_id, sum(quantity) AS quantity FROM released
+              WHERE variant_id IS NOT NULL GROUP BY variant_id) AS freed
+        WHERE product_variants.id = freed.variant_id
+    )
+    SELECT count(*) AS holds, coalesce(sum(quantity), 0) AS units FROM released
+"""
+
+# Reasigna las reservas de un carrito a otro (fusión al iniciar sesión), sumando las de la
+# misma línea; las unidades no cambian de dueño en reserved_quantity
+MOVE_CART_HOLDS_SQL = """
+    WITH moved AS (
+        DELETE FROM stock_reservations WHERE cart_id = CAST(:source_cart_id AS uuid)
+        RETURNING product_id, variant_id, quantity, expires_at
+    )
+    INSERT INTO stock_reservations (id, cart_id, product_id, variant_id, quantity, expires_at, created_at)
+    SELECT gen_random_uuid(), CAST(:target_cart_id AS uuid), product_id, variant_id, quantity, expires_at, now()
+    FROM moved
+    ON CONFLICT (cart_id, product_id, variant_id) DO UPDATE SET
+        quantity = stock_reservations.quantity + EXCLUDED.quantity,
+        expires_at = GREATEST(stock_reservations.expires_at, EXCLUDED.expires_at)
+"""
+
+# Unidades de cada línea del carrito que sus reservas no cubren
+UNHELD_CART_LINES_SQL = """
+    SELECT ci.product_id, ci.variant_id, ci.quantity - coalesce(h.quantity, 0) AS quantity
+    FROM cart_items ci
+    LEFT JOIN stock_reservations h ON h.cart_id = ci.cart_id AND h.product_id = ci.product_id
+         AND h.variant_id IS NOT DISTINCT FROM ci.variant_id
+    WHERE ci.cart_id = CAST(:cart_id AS uuid) AND ci.quantity > coalesce(h.quantity, 0)
+"""
+
+_CART_HOLDS = "SELECT id FROM stock_reservations WHERE cart_id = ANY(CAST(:cart_ids AS uuid[]))"
+
+_LISTED_HOLDS = "SELECT unnest(CAST(:hold_ids AS uuid[]))"
+
+# SKIP LOCKED: las reservas que una transacción está modificando se liberan en otro barrido
+_EXPIRED_HOLDS = """
+    SELECT id FROM stock_reservations WHERE expires_at < now()
+    ORDER BY expires_at LIMIT :batch_size FOR UPDATE SKIP LOCKED
+"""
+
+# Filas de stock de un conjunto de reservas, bloqueadas en orden de id como en el checkout
+_LOCK_HELD_STOCK_SQL = """
+    SELECT id FROM {table} WHERE id IN (
+        SELECT {column} FROM stock_reservations WHERE id IN ({holds}) AND variant_id IS {variant}
+    ) ORDER BY id FOR UPDATE
+"""
+
+# Filas de stock de un carrito (líneas y reservas), bloqueadas siempre en el mismo orden
+_LOCK_CART_STOCK_SQL = """
+    SELECT id FROM {table} WHERE id IN (
+        SELECT {column} FROM cart_items WHERE cart_id = CAST(:cart_id AS uuid) AND variant_id IS {variant}
+        UNION SELECT {column} FROM stock_reservations WHERE cart_id = CAST(:cart_id AS uuid) AND variant_id IS {variant}
+    ) ORDER BY id FOR UPDATE
+"""
+
+# Convierte las líneas del carrito en descuentos de stock; cada UPDATE sólo aplica si
+# quedan unidades libres de otras reservas. Los productos sin control de stock
+# (manage_stock falso) o con backorders pasan sin descontar ni validar.
+# Devuelve las líneas que no alcanzaron
+TAKE_CART_STOCK_SQL = """
+    WITH lines AS (
+        SELECT ci.product_id, ci.variant_id, sum(ci.quantity) AS quantity,
+               bool_and(coalesce(p.manage_stock, true) AND NOT coalesce(p.allow_backorders, false)) AS tracked
+        FROM cart_items ci JOIN products p ON p.id = ci.product_id
+        WHERE ci.cart_id = CAST(:cart_id AS uuid)
+        GROUP BY ci.product_id, ci.variant_id
+    ), products_taken AS (
+        UPDATE products SET stock_quantity = products.stock_quantity - lines.quantity
+        FROM lines
+        WHERE lines.tracked AND lines.variant_id IS NULL AND products.id = lines.product_id
+          AND products.stock_quantity - products.reserved_quantity >= lines.quantity
+        RETURNING products.id
+    ), variants_taken AS (
+        UPDATE product_variants SET stock_quantity = product_variants.stock_quantity - lines.quantity
+        FROM lines
+        WHERE lines.tracked AND lines.variant_id IS NOT NULL AND product_variants.id = lines.variant_id
+          AND product_variants.stock_quantity - product_variants.reserved_quantity >= lines.quantity
+        RETURNING product_variants.id
+    )
+    SELECT lines.product_id, lines.variant_id, lines.quantity,
+           coalesce(v.stock_quantity - v.reserved_quantity, p.stock_quantity - p.reserved_quantity) AS available
+    FROM lines
+    JOIN products p ON p.id = lines.product_id
+    LEFT JOIN product_variants v ON v.id = lines.variant_id
+    WHERE lines.tracked AND CASE WHEN lines.variant_id IS NULL
+               THEN lines.product_id NOT IN (SELECT id FROM products_taken)
+               ELSE lines.variant_id NOT IN (SELECT id FROM variants_taken) END
+"""
+
+class InsufficientStock(Exception):
+    """A hold could not be placed: fewer units are free than requested"""
+
+    def __init__(self, product_id, variant_id, available):
+        super().__init__("Not enough stock available")
+        self.product_id = product_id
+        self.variant_id = variant_id
+        self.available = max(available or 0, 0)
+
+def hold_stock(cart_id, product_id, variant_id, delta, ttl):
+    """Move the hold of one cart line by `delta` units (negative releases) and
+    push its expiry to now + ttl, with one conditional statement.
+    Returns: (applied, units available to other carts before the change)"""
+    table = 'product_variants' if variant_id else 'products'
+    row = db.session.execute(text(HOLD_STOCK_SQL.format(table=table)), {
+        'cart_id': str(cart_id), 'product_id': str(product_id),
+        'variant_id': str(variant_id) if variant_id else None,
+        'stock_id': str(variant_id or product_id), 'delta': delta, 'ttl': ttl
+    }).first()
+    return row.held, row.available
+
+def _release_holds(holds, parameters):
+    # Productos y después variantes, cada uno por id: el mismo orden que commit_cart_holds
+    db.session.execute(text(_LOCK_HELD_STOCK_SQL.format(table='products', column='product_id', variant='NULL', holds=holds)), parameters)
+    db.session.execute(text(_LOCK_HELD_STOCK_SQL.format(table='product_variants', column='variant_id', variant='NOT NULL', holds=holds)), parameters)
+    return db.session.execute(text(RELEASE_HOLDS_SQL.format(holds=holds)), parameters).first()
+
+def release_cart_holds(cart_ids):
+    """Delete every hold of the given carts and give their units back, locking
+    the stock rows in id order first. The caller commits.
+    Returns: (holds, units)"""
+    row = _release_holds(_CART_HOLDS, {'cart_ids': [str(cart_id) for cart_id in cart_ids]})
+    return row.holds, row.units
+
+def move_cart_holds(source_cart_id, target_cart_id):
+    """Give the holds of one cart to another, in one statement (the caller commits)"""
+    db.session.execute(text(MOVE_CART_HOLDS_SQL), {
+        'source_cart_id': str(source_cart_id), 'target_cart_id': str(target_cart_id)
+    })
+
+def sweep_expired_holds(batch_size=1000):
+    """Release expired holds in batches, one transaction per batch.
+    Only one process sweeps at a time (transaction-level advisory lock), and
+    the stock rows of a batch are locked in id order, as checkout does.
+    Returns: {'holds': n, 'units': n}"""
+    swept = {'holds': 0, 'units': 0}
+    while True:
+        if not db.session.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {'key': SWEEP_LOCK_KEY}).scalar():
+            db.session.rollback()
+            return swept
+        hold_ids = db.session.execute(text(_EXPIRED_HOLDS), {'batch_size': batch_size}).scalars().all()
+        if not hold_ids:
+            db.session.commit()
+            return swept
+        row = _release_holds(_LISTED_HOLDS, {'hold_ids': [str(hold_id) for hold_id in hold_ids]})
+        db.session.commit()
+        swept['holds'] += row.holds
+        swept['units'] += row.units
+        if len(hold_ids) < batch_size:
+            return swept
+
+def commit_cart_holds(cart_id):
+    """Turn the lines of a cart into stock decrements inside the current transaction.
+
+    The cart holds are locked first, then the stock rows in id order (products,
+    then variants), so concurrent checkouts and sweeps never deadlock. The holds
+    are released and every line takes its units from the stock left free by
+    other carts' holds; lines of products that don't manage stock or allow
+    backorders go through untouched. The caller commits, or rolls back when a line is short.
+    Returns: list of short lines (product_id, variant_id, quantity, available)"""
+    parameters = {'cart_id': str(cart_id)}
+    db.session.execute(
+        text("SELECT id FROM stock_reservations WHERE cart_id = CAST(:cart_id AS uuid) FOR UPDATE"), parameters
+    )
+    db.session.execute(text(_LOCK_CART_STOCK_SQL.format(table='products', column='product_id', variant='NULL')), parameters)
+    db.session.execute(text(_LOCK_CART_STOCK_SQL.format(table='product_variants', column='variant_id', variant='NOT NULL')), parameters)
+    # Filas de stock ya bloqueadas: se liberan las reservas sin volver a bloquearlas
+    db.session.execute(text(RELEASE_HOLDS_SQL.format(holds=_CART_HOLDS)), {'cart_ids': [str(cart_id)]})
+    return db.session.execute(text(TAKE_CART_STOCK_SQL), parameters).all()
+
+def _held_quantities(table, column, variant):
+    return f"""
+        SELECT {table}.id FROM {table}
+        LEFT JOIN (SELECT {column}, sum(quantity) AS quantity FROM stock_reservations
+                   WHERE variant_id IS {variant} GROUP BY {column}) AS held ON held.{column} = {table}.id
+        WHERE {table}.reserved_quantity <> coalesce(held.quantity, 0)
+    """
+
+def verify_reserved_quantities(repair=False):
+    """Compare reserved_quantity of every product and variant with the sum of its holds.
+    With repair=True the drifted counters are rewritten from the holds.
+    Returns: number of drifted products and variants"""
+    drifted = 0
+    for table, column, variant in (('products', 'product_id', 'NULL'), ('product_variants', 'variant_id', 'NOT NULL')):
+        ids = [row.id for row in db.session.execute(text(_held_quantities(table, column, variant))).all()]
+        drifted += len(ids)
+        if repair and ids:
+            db.session.execute(text(f"""
+                UPDATE {table} SET reserved_quantity = coalesce((
+                    SELECT sum(quantity) FROM stock_reservations
+                    WHERE {column} = {table}.id AND variant_id IS {variant}
+                ), 0)
+                WHERE id = ANY(CAST(:ids AS uuid[]))
+            """), {'ids': [str(id) for id in ids]})
+    db.session.commit()
+    return drifted
+
+def install_stock_schema():
+    """Add reserved_quantity to products/variants and create the stock_reservations table"""
+    for statement in STOCK_SCHEMA_SQL:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+class StockHolds:
+    """Time-limited stock holds for cart lines.
+
+    Adding to a cart reserves the units (available = stock_quantity - reserved_quantity);
+    changing or removing the line moves or releases its hold, and checkout turns
+    the holds into stock decrements (commit_cart_holds). Expired holds are
+    released by a background sweep started lazily from the request path, at
+    most every STOCK_HOLD_SWEEP_INTERVAL seconds. STOCK_HOLD_TTL = 0 disables holds."""
+
+    def __init__(self):
+        self._swept_at = time.monotonic()
+        self._sweeping = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return current_app.config.get('STOCK_HOLD_TTL', 900) > 0
+
+    def reserve(self, cart_id, deltas, strict=True):
+        """Apply {(product_id, variant_id): delta} to the holds of a cart, one
+        statement per line. Lines are taken in a fixed order (products, then
+        variants, by id) so concurrent carts lock stock rows in the same order.
+        Raises InsufficientStock on the first line that cannot be held; the
+        caller rolls back, which also undoes the lines already held.
+        With strict=False those lines are skipped instead."""
+        if not self.enabled:
+            return
+        ttl = current_app.config.get('STOCK_HOLD_TTL', 900)
+        for (product_id, variant_id), delta in sorted(
+            deltas.items(), key=lambda item: (item[0][1] is not None, item[0][1] or item[0][0])
+        ):
+            if not delta:
+                continue
+            held, available = hold_stock(cart_id, product_id, variant_id, delta, ttl)
+            if not held and delta > 0 and strict:
+                raise InsufficientStock(product_id, variant_id, available)
+        self._maybe_sweep()
+
+    def hold_cart_lines(self, cart_id):
+        """Hold the units of every line of a cart that its holds do not cover,
+        where they are still free (lines that cannot be held are left as they are)"""
+        if not self.enabled:
+            return
+        lines = db.session.execute(text(UNHELD_CART_LINES_SQL), {'cart_id': str(cart_id)}).all()
+        self.reserve(cart_id, {(line.product_id, line.variant_id): line.quantity for line in lines}, strict=False)
+
+    def release(self, cart_id):
+        """Give back every unit held by a cart (the caller commits)"""
+        if self.enabled:
+            release_cart_holds([cart_id])
+
+    def _maybe_sweep(self):
+        config = current_app.config
+        with self._lock:
+            if self._sweeping or time.monotonic() - self._swept_at < config.get('STOCK_HOLD_SWEEP_INTERVAL', 60):
+                return
+            self._sweeping = True
+        app = current_app._get_current_object()
+        threading.Thread(target=self._sweep, args=(app,), daemon=True).start()
+
+    def _sweep(self, app):
+        try:
+            with app.app_context():
+                try:
+                    swept = sweep_expired_holds(app.config.get('STOCK_HOLD_SWEEP_BATCH_SIZE', 1000))
+                finally:
+                    db.session.remove()
+            if swept['holds']:
+                app.logger.info('Released %s expired stock holds (%s units)', swept['holds'], swept['units'])
+        except Exception:
+            app.logger.exception('Stock hold sweep failed')
+        with self._lock:
+            self._swept_at = time.monotonic()
+            self._sweeping = False
+
+stock_holds = StockHolds()
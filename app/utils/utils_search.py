@@ -0,0 +1,89 @@
+import re
+from sqlalchemy import case, func, or_, text
+from app import db
+from ..models import Product
+
+# Configuración de texto de PostgreSQL usada tanto al indexar como al buscar
+SEARCH_TEXT_CONFIG = 'spanish'
+
+# Documento ponderado: name > short_description > description; el sku se indexa sin stemming
+SEARCH_DOCUMENT_SQL = (
+    "setweight(to_tsvector('simple', coalesce({row}sku, '')), 'A') || "
+    "setweight(to_tsvector('" + SEARCH_TEXT_CONFIG + "', coalesce({row}name, '')), 'A') || "
+    "setweight(to_tsvector('" + SEARCH_TEXT_CONFIG + "', coalesce({row}short_description, '')), 'B') || "
+    "setweight(to_tsvector('" + SEARCH_TEXT_CONFIG + "', coalesce({row}description, '')), 'C')"
+)
+
+SEARCH_SCHEMA_SQL = [
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector TSVECTOR",
+    """
+    CREATE OR REPLACE FUNCTION products_search_vector_update()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.search_vector := """ + SEARCH_DOCUMENT_SQL.format(row='NEW.') + """;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS products_search_vector_trigger ON products",
+    """
+    CREATE TRIGGER products_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF name, short_description, description, sku ON products
+        FOR EACH ROW EXECUTE PROCEDURE products_search_vector_update()
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_products_search_vector ON products USING gin(search_vector)",
+]
+
+def build_tsquery(term):
+    """Turn free text into a prefix tsquery ('camis roja' -> 'camis:* & roja:*').
+    Returns None when the term has no searchable words."""
+    words = re.findall(r'\w+', term)
+    if not words:
+        return None
+    return func.to_tsquery(SEARCH_TEXT_CONFIG, ' & '.join(f'{word}:*' for word in words))
+
+def search_filter(term):
+    """Predicate matching products by full-text search or exact SKU"""
+    tsquery = build_tsquery(term)
+    if tsquery is None:
+        return Product.sku == term
+    return or_(Product.search_vector.op('@@')(tsquery), Product.sku == term)
+
+def search_rank(term):
+    """Relevance of a product for the term; an exact SKU match ranks first"""
+    sku_match = case((Product.sku == term, 1.0), else_=0.0)
+    tsquery = build_tsquery(term)
+    if tsquery is None:
+        return sku_match
+    return sku_match + func.ts_rank(Product.search_vector, tsquery)
+
+def install_search_schema():
+    """Create (or update) the search column, trigger and GIN index"""
+    for statement in SEARCH_SCHEMA_SQL:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+def backfill_search_vectors(batch_size=1000, force=False):
+    """Fill search_vector in id-ordered batches, committing after each one.
+    force=True recomputes every product (e.g. after changing the weights).
+    Returns: number of updated products"""
+    statement = text(f"""
+        UPDATE products SET search_vector = {SEARCH_DOCUMENT_SQL.format(row='')}
+        WHERE id IN (
+            SELECT id FROM products
+            WHERE id > :last_id {'' if force else 'AND search_vector IS NULL'}
+            ORDER BY id
+            LIMIT :batch_size
+        )
+        RETURNING id
+    """)
+
+    updated = 0
+    last_id = '00000000-0000-0000-0000-000000000000'
+    while True:
+        ids = db.session.execute(statement, {'last_id': last_id, 'batch_size': batch_size}).scalars().all()
+        db.session.commit()
+        if not ids:
+            return updated
+        updated += len(ids)
+        last_id = max(ids)
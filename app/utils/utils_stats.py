@@ -0,0 +1,127 @@
+import threading
+import time
+from datetime import datetime, timezone
+from flask import current_app
+from app import db
+from ..models import Category, Product, product_categories
+from .utils_cache import catalog_cache
+
+def compute_product_stats():
+    """Compute catalog statistics: one aggregate pass over active products
+    (using FILTER clauses) plus one grouped query for the per-category breakdown"""
+    product_id = Product.id
+    stock_value = Product.price * Product.stock_quantity
+    stock_cost = Product.cost_price * Product.stock_quantity
+
+    totals = db.session.query(
+        db.func.count(product_id),
+        db.func.count(product_id).filter(Product.is_featured == True),
+        db.func.count(product_id).filter(Product.stock_quantity == 0),
+        db.func.count(product_id).filter(
+            Product.stock_quantity <= Product.low_stock_threshold,
+            Product.stock_quantity > 0
+        ),
+        db.func.avg(Product.price),
+        db.func.sum(stock_value).filter(Product.stock_quantity > 0),
+        db.func.sum(stock_cost).filter(Product.stock_quantity > 0)
+    ).filter(Product.is_active == True).one()
+
+    total_products, featured, out_of_stock, low_stock, avg_price, total_value, total_cost = totals
+
+    categories = db.session.query(
+        Category.id,
+        Category.slug,
+        Category.name,
+        db.func.count(product_id),
+        db.func.count(product_id).filter(Product.stock_quantity == 0),
+        db.func.avg(Product.price),
+        db.func.sum(stock_value).filter(Product.stock_quantity > 0)
+    ).join(
+        product_categories, product_categories.c.category_id == Category.id
+    ).join(
+        Product, Product.id == product_categories.c.product_id
+    ).filter(Product.is_active == True).group_by(Category.id).order_by(Category.name).all()
+
+    return {
+        'total_products': total_products,
+        'featured_products': featured,
+        'out_of_stock': out_of_stock,
+        'low_stock': low_stock,
+        'average_price': round(float(avg_price), 2) if avg_price else 0,
+        'stock_value': round(float(total_value or 0), 2),
+        'stock_cost': round(float(total_cost or 0), 2),
+        'categories': [
+            {
+                'id': str(category_id),
+                'slug': slug,
+                'name': name,
+                'total_products': count,
+                'out_of_stock': category_out_of_stock,
+                'average_price': round(float(category_avg_price), 2) if category_avg_price else 0,
+                'stock_value': round(float(category_value or 0), 2)
+            }
+            for category_id, slug, name, count, category_out_of_stock, category_avg_price, category_value in categories
+        ],
+        'generated_at': datetime.now(timezone.utc).isoformat()
+    }
+
+class StatsSnapshot:
+    """Keeps the last computed statistics and refreshes them in a background
+    thread when they expire or the catalog changes, so requests never wait
+    on the aggregate queries (except for the very first one)."""
+
+    def __init__(self, compute):
+        self._compute = compute
+        self._data = None
+        self._computed_at = 0
+        self._stale = False
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._stale = True
+
+    def _needs_refresh(self, max_age):
+        return self._stale or time.monotonic() - self._computed_at > max_age
+
+    def _refresh(self, app):
+        try:
+            with app.app_context():
+                try:
+                    data = self._compute()
+                finally:
+                    db.session.remove()
+        except Exception:
+            app.logger.exception('Product stats refresh failed')
+            with self._lock:
+                self._refreshing = False
+                self._stale = True
+            return
+
+        with self._lock:
+            self._data = data
+            self._computed_at = time.monotonic()
+            self._refreshing = False
+
+    def get(self):
+        max_age = current_app.config.get('PRODUCT_STATS_MAX_AGE', 60)
+
+        if self._data is None:
+            # Primera llamada: calcular de forma síncrona
+            with self._lock:
+                if self._data is None:
+                    self._data = self._compute()
+                    self._computed_at = time.monotonic()
+                    self._stale = False
+            return self._data
+
+        with self._lock:
+            if self._needs_refresh(max_age) and not self._refreshing:
+                self._refreshing = True
+                self._stale = False
+                app = current_app._get_current_object()
+                threading.Thread(target=self._refresh, args=(app,), daemon=True).start()
+        return self._data
+
+product_stats = StatsSnapshot(compute_product_stats)
+catalog_cache.on_invalidate(product_stats.invalidate)
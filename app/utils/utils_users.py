@@ -0,0 +1,418 @@
+import csv
+import json
+import threading
+import time
+import uuid
+from datetime import date, datetime, timezone
+from flask import current_app
+from sqlalchemy import event, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from app import db
+from ..models import Address, User
+from .utils_auth import validate_email, validate_password
+from .utils_cache import mark_catalog_changed
+from .utils_documents import queue_document_rebuild
+from .utils_passwords import password_hasher
+from .utils_reservations import release_cart_holds
+
+USER_COLUMNS = [column.key for column in User.__mapper__.column_attrs]
+
+# Prefijos de hashes de werkzeug aceptados como password_hash ya calculado
+HASH_PREFIXES = ('scrypt:', 'pbkdf2:')
+ADDRESS_FIELDS = ('street_address', 'apartment', 'city', 'state', 'postal_code', 'country')
+
+class UserCache:
+    """Short-lived per-process cache of user rows used by the JWT user loader.
+    Entries are dropped when this process commits a change to the user; other
+    processes see the change after at most USER_CACHE_TTL seconds."""
+
+    def __init__(self):
+        self._entries = {}  # user_id -> (expires_at, column values)
+        self._lock = threading.Lock()
+
+    def _attach(self, values):
+        # Reconstruir la fila cacheada como instancia persistente sin consultar la base
+        user = User.__mapper__.class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def get(self, user_id):
+        """Load a user by id, from the cache when possible.
+        Returns: User bound to the current session, or None"""
+        try:
+            user_id = uuid.UUID(str(user_id))
+        except ValueError:
+            return None
+
+        identity_key = User.__mapper__.identity_key_from_primary_key((user_id,))
+        user = db.session.identity_map.get(identity_key)
+        if user is not None:
+            return user
+
+        ttl = current_app.config.get('USER_CACHE_TTL', 30)
+        if ttl:
+            with self._lock:
+                entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                return self._attach(entry[1])
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+
+        if ttl:
+            values = {key: getattr(user, key) for key in USER_COLUMNS}
+            with self._lock:
+                self._entries[user_id] = (time.monotonic() + ttl, values)
+        return user
+
+    def invalidate(self, user_ids=None):
+        """Drop the given users, or every entry when user_ids is None"""
+        with self._lock:
+            if user_ids is None:
+                self._entries.clear()
+                return
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+user_cache = UserCache()
+
+## Invalidación a partir de los eventos de la sesión ##
+@event.listens_for(Session, 'after_flush')
+def track_user_changes(session, flush_context):
+    for instance in session.dirty | session.deleted:
+        if isinstance(instance, User):
+            session.info.setdefault('users_changed', set()).add(instance.id)
+
+@event.listens_for(Session, 'do_orm_execute')
+def track_user_statements(orm_execute_state):
+    # UPDATE/DELETE masivos sobre users: no se sabe qué filas cambiaron
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None and table.name == User.__tablename__:
+            orm_execute_state.session.info['users_reset'] = True
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_users_on_commit(session):
+    if session.info.pop('users_reset', False):
+        session.info.pop('users_changed', None)
+        user_cache.invalidate()
+        return
+    user_ids = session.info.pop('users_changed', None)
+    if user_ids:
+        user_cache.invalidate(user_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_user_changes(session):
+    session.info.pop('users_changed', None)
+    session.info.pop('users_reset', None)
+
+## Importación masiva de clientes ##
+def read_user_records(stream, file_format):
+    """Stream records from a CSV (with header row) or NDJSON file.
+    Yields: (line_number, record dict, or the raw JSON line still to be parsed)"""
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if line.strip():
+            yield line_number, line
+
+def prepare_user_record(record):
+    """Validate and normalize one import record.
+    Accepts either 'password' (validated and hashed) or a werkzeug 'password_hash'.
+    Addresses come from an 'addresses' list (NDJSON) or flat address columns (CSV).
+    Returns: {'user': row, 'password': plain password or None, 'addresses': [rows]}
+    Raises: ValueError with the rejection reason"""
+    email = (record.get('email') or '').strip()
+    email_valid, email_msg = validate_email(email)
+    if not email_valid:
+        raise ValueError(email_msg)
+
+    first_name = (record.get('first_name') or '').strip()
+    last_name = (record.get('last_name') or '').strip()
+    if not first_name or not last_name:
+        raise ValueError("first_name and last_name are required.")
+
+    password = record.get('password') or None
+    password_hash = record.get('password_hash') or None
+    if password_hash:
+        if not password_hash.startswith(HASH_PREFIXES):
+            raise ValueError("Unsupported password_hash format.")
+        password = None
+    else:
+        password_valid, password_msg = validate_password(password)
+        if not password_valid:
+            raise ValueError(password_msg)
+
+    date_of_birth = (record.get('date_of_birth') or '').strip() or None
+    if date_of_birth:
+        try:
+            date_of_birth = date.fromisoformat(date_of_birth)
+        except ValueError:
+            raise ValueError("date_of_birth must be YYYY-MM-DD.")
+
+    user_id = uuid.uuid4()
+    addresses = record.get('addresses')
+    if addresses is None:
+        addresses = [record] if record.get('street_address') else []
+
+    address_rows = []
+    for address in addresses:
+        missing = [field for field in ('street_address', 'city', 'state', 'postal_code') if not address.get(field)]
+        if missing:
+            raise ValueError(f"Address is missing {', '.join(missing)}.")
+        address_rows.append({
+            'id': uuid.uuid4(),
+            'user_id': user_id,
+            **{field: address.get(field) or None for field in ADDRESS_FIELDS},
+            'country': address.get('country') or 'Argentina',
+            'is_default': len(address_rows) == 0,
+            'address_type': address.get('address_type') or 'shipping'
+        })
+
+    return {
+        'user': {
+            'id': user_id,
+            'email': email,
+            'password_hash': password_hash,
+            'first_name': first_name,
+            'last_name': last_name,
+            'phone': (record.get('phone') or '').strip() or None,
+            'date_of_birth': date_of_birth
+        },
+        'password': password,
+        'addresses': address_rows
+    }
+
+def insert_user_batch(batch, executor=None):
+    """Hash and insert a batch of prepared records in one transaction.
+    Emails that already exist are skipped before hashing; concurrent inserts
+    are absorbed by ON CONFLICT (email) DO NOTHING.
+    Returns: (inserted users, inserted addresses)"""
+    users = User.__table__
+    existing = set(db.session.execute(
+        db.select(users.c.email).where(users.c.email.in_([item['user']['email'] for item in batch]))
+    ).scalars())
+
+    # Un email repetido dentro del archivo sólo se importa la primera vez
+    pending = {}
+    for item in batch:
+        email = item['user']['email']
+        if email not in existing and email not in pending:
+            pending[email] = item
+    batch = list(pending.values())
+    if not batch:
+        return 0, 0
+
+    to_hash = [item for item in batch if item['password'] is not None]
+    hashes = password_hasher.hash_many([item['password'] for item in to_hash], executor)
+    for item, password_hash in zip(to_hash, hashes):
+        item['user']['password_hash'] = password_hash
+
+    inserted = set(db.session.execute(
+        insert(users).values([item['user'] for item in batch])
+        .on_conflict_do_nothing(index_elements=['email'])
+        .returning(users.c.id)
+    ).scalars())
+
+    addresses = [address for item in batch if item['user']['id'] in inserted for address in item['addresses']]
+    if addresses:
+        db.session.execute(insert(Address.__table__).values(addresses))
+
+    db.session.commit()
+    return len(inserted), len(addresses)
+
+def import_users(stream, file_format='csv', batch_size=1000, executor=None, max_errors=20):
+    """Import customers from a CSV/NDJSON stream in multi-row batches.
+    Returns: dict with read/inserted/skipped/rejected counters, the first
+    rejection reasons and the elapsed time"""
+    report = {'read': 0, 'inserted': 0, 'addresses': 0, 'skipped': 0, 'rejected': 0, 'errors': []}
+    started = time.perf_counter()
+    batch = []
+
+    def flush():
+        inserted, addresses = insert_user_batch(batch, executor)
+        report['inserted'] += inserted
+        report['addresses'] += addresses
+        report['skipped'] += len(batch) - inserted
+        batch.clear()
+
+    for line_number, record in read_user_records(stream, file_format):
+        report['read'] += 1
+        try:
+            if isinstance(record, str):
+                record = json.loads(record)
+            if not isinstance(record, dict):
+                raise ValueError("Record must be a JSON object.")
+            batch.append(prepare_user_record(record))
+        except ValueError as error:
+            report['rejected'] += 1
+            if len(report['errors']) < max_errors:
+                report['errors'].append((line_number, str(error)))
+            continue
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    report['elapsed'] = time.perf_counter() - started
+    return report
+
+## Borrado de cuentas ##
+# Claves foráneas con su regla ON DELETE (las bases creadas con create_all antiguas no las tienen)
+USER_FOREIGN_KEYS = [
+    ('addresses', 'user_id', 'users', 'CASCADE'),
+    ('carts', 'user_id', 'users', 'CASCADE'),
+    ('cart_items', 'cart_id', 'carts', 'CASCADE'),
+    ('wishlists', 'user_id', 'users', 'CASCADE'),
+    ('product_reviews', 'user_id', 'users', 'CASCADE'),
+    ('orders', 'user_id', 'users', 'SET NULL'),
+]
+
+def install_users_schema():
+    """Add users.deletion_requested_at and recreate the account foreign keys with their ON DELETE rules"""
+    db.session.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS deletion_requested_at TIMESTAMP WITH TIME ZONE"))
+    for table, column, parent, rule in USER_FOREIGN_KEYS:
+        constraint = f'{table}_{column}_fkey'
+        db.session.execute(text(
+            f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {constraint}, "
+            f"ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) REFERENCES {parent}(id) ON DELETE {rule}"
+        ))
+    db.session.commit()
+
+# Reseñas: se borran y se descuentan de los agregados de los productos en una sola sentencia
+DELETE_REVIEWS_SQL = """
+    WITH deleted AS (
+        DELETE FROM product_reviews WHERE id IN (
+            SELECT id FROM product_reviews WHERE user_id = :user_id LIMIT :batch_size
+        )
+        RETURNING product_id, rating, is_approved
+    ), totals AS (
+        SELECT product_id, sum(rating) AS rating_sum, count(*) AS rating_count,
+               """ + ", ".join(f"count(*) FILTER (WHERE rating = {star}) AS rating_{star}_count" for star in range(1, 6)) + """
+        FROM deleted WHERE is_approved AND rating BETWEEN 1 AND 5 GROUP BY product_id
+    ), updated AS (
+        UPDATE products SET
+            """ + ", ".join(
+                f"{column} = products.{column} - totals.{column}"
+                for column in ['rating_sum', 'rating_count'] + [f'rating_{star}_count' for star in range(1, 6)]
+            ) + """
+        FROM totals WHERE products.id = totals.product_id
+        RETURNING products.id
+    )
+    SELECT (SELECT count(*) FROM deleted), (SELECT array_agg(id) FROM updated)
+"""
+
+# Resto de las filas de la cuenta, en orden fijo (hijos antes que padres)
+ERASURE_STEPS = [
+    ('cart_items', """
+        DELETE FROM cart_items WHERE id IN (
+            SELECT cart_items.id FROM cart_items JOIN carts ON carts.id = cart_items.cart_id
+            WHERE carts.user_id = :user_id LIMIT :batch_size
+        )
+    """),
+    ('carts', "DELETE FROM carts WHERE id IN (SELECT id FROM carts WHERE user_id = :user_id LIMIT :batch_size)"),
+    ('wishlists', "DELETE FROM wishlists WHERE id IN (SELECT id FROM wishlists WHERE user_id = :user_id LIMIT :batch_size)"),
+    ('addresses', "DELETE FROM addresses WHERE id IN (SELECT id FROM addresses WHERE user_id = :user_id LIMIT :batch_size)"),
+    # Las órdenes se conservan sin usuario (historial de ventas)
+    ('orders', "UPDATE orders SET user_id = NULL WHERE id IN (SELECT id FROM orders WHERE user_id = :user_id LIMIT :batch_size)"),
+]
+
+def count_user_rows(user_id):
+    """Number of rows an account erasure has to touch (one query)"""
+    return db.session.execute(text("""
+        SELECT (SELECT count(*) FROM product_reviews WHERE user_id = :user_id)
+             + (SELECT count(*) FROM cart_items JOIN carts ON carts.id = cart_items.cart_id WHERE carts.user_id = :user_id)
+             + (SELECT count(*) FROM carts WHERE user_id = :user_id)
+             + (SELECT count(*) FROM wishlists WHERE user_id = :user_id)
+             + (SELECT count(*) FROM addresses WHERE user_id = :user_id)
+             + (SELECT count(*) FROM orders WHERE user_id = :user_id)
+    """), {'user_id': user_id}).scalar()
+
+def erase_user(user_id, batch_size=None):
+    """Delete an account and everything it owns with set-based statements:
+    reviews (adjusting product rating aggregates), cart stock holds, cart items, carts,
+    wishlist, addresses, then detach orders and delete the user.
+    batch_size=None runs everything in one transaction; otherwise every
+    statement is repeated in batches of that size, committing after each.
+    Returns: {table: affected rows}"""
+    params = {'user_id': user_id, 'batch_size': batch_size}
+    affected = {}
+
+    while True:
+        deleted, product_ids = db.session.execute(text(DELETE_REVIEWS_SQL), params).one()
+        if product_ids:
+            mark_catalog_changed(db.session)
+            queue_document_rebuild(db.session, product_ids)
+        affected['product_reviews'] = affected.get('product_reviews', 0) + deleted
+        if batch_size is None or deleted < batch_size:
+            break
+        db.session.commit()
+
+    # El stock retenido por sus carritos se devuelve en la transacción que empieza a borrarlos
+    cart_ids = db.session.execute(text("SELECT id FROM carts WHERE user_id = :user_id"), params).scalars().all()
+    if cart_ids:
+        release_cart_holds(cart_ids)
+
+    for table, statement in ERASURE_STEPS:
+        while True:
+            rowcount = db.session.execute(text(statement), params).rowcount
+            affected[table] = affected.get(table, 0) + rowcount
+            if batch_size is None or rowcount < batch_size:
+                break
+            db.session.commit()
+
+    user = db.session.identity_map.get(User.__mapper__.identity_key_from_primary_key((user_id,)))
+    if user is not None:
+        db.session.expunge(user)
+    affected['users'] = db.session.execute(text("DELETE FROM users WHERE id = :user_id"), params).rowcount
+    db.session.commit()
+    user_cache.invalidate([user_id])
+    return affected
+
+def _erase_in_background(app, user_id):
+    try:
+        with app.app_context():
+            try:
+                affected = erase_user(user_id, batch_size=app.config.get('ACCOUNT_ERASURE_BATCH_SIZE', 1000))
+            finally:
+                db.session.remove()
+        app.logger.info('Account %s erased: %s', user_id, affected)
+    except Exception:
+        app.logger.exception('Account erasure failed for %s (retry with flask users erase-pending)', user_id)
+
+def request_user_erasure(user):
+    """Erase small accounts right away; larger ones (more than
+    ACCOUNT_ERASURE_ASYNC_THRESHOLD rows) are deactivated, marked with
+    deletion_requested_at and erased in batches by a background thread.
+    Returns: True if the erasure was scheduled, False if already done"""
+    if count_user_rows(user.id) <= current_app.config.get('ACCOUNT_ERASURE_ASYNC_THRESHOLD', 5000):
+        erase_user(user.id)
+        return False
+
+    user_id = user.id
+    user.is_active = False
+    user.deletion_requested_at = datetime.now(timezone.utc)
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    threading.Thread(target=_erase_in_background, args=(app, user_id), daemon=True).start()
+    return True
+
+def erase_pending_users(batch_size=1000):
+    """Finish every account erasure that was requested but not completed.
+    Returns: number of erased accounts"""
+    user_ids = db.session.execute(
+        db.select(User.id).where(User.deletion_requested_at.isnot(None))
+    ).scalars().all()
+    for user_id in user_ids:
+        erase_user(user_id, batch_size=batch_size)
+    return len(user_ids)
@@ -12,6 +12,61 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
+    # Hashing de contraseñas en un pool de procesos acotado (0 workers = en el mismo hilo)
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 0)) or None
+    PASSWORD_HASH_QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', 2))
+    # Rate limiting de login/registro: 'memory' (por proceso), 'redis' (compartido) o 'none'
+    # Límites con formato '<intentos>/<segundos>'; vacío desactiva la regla
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_URL = os.environ.get('RATE_LIMIT_URL')
+    RATE_LIMIT_SWEEP_INTERVAL = int(os.environ.get('RATE_LIMIT_SWEEP_INTERVAL', 60))
+    RATE_LIMIT_LOGIN_IP = os.environ.get('RATE_LIMIT_LOGIN_IP', '20/60')
+    RATE_LIMIT_LOGIN_EMAIL = os.environ.get('RATE_LIMIT_LOGIN_EMAIL', '5/300')
+    RATE_LIMIT_REGISTER_IP = os.environ.get('RATE_LIMIT_REGISTER_IP', '5/3600')
+    RATE_LIMIT_REGISTER_EMAIL = os.environ.get('RATE_LIMIT_REGISTER_EMAIL', '3/3600')
+    # TTL (segundos) del cache por proceso de usuarios autenticados; 0 lo desactiva
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+    # Cuentas con más filas que este umbral se borran en segundo plano, por lotes
+    ACCOUNT_ERASURE_ASYNC_THRESHOLD = int(os.environ.get('ACCOUNT_ERASURE_ASYNC_THRESHOLD', 5000))
+    ACCOUNT_ERASURE_BATCH_SIZE = int(os.environ.get('ACCOUNT_ERASURE_BATCH_SIZE', 1000))
+    # Blocklist de tokens revocados: sincronización incremental (s), purga de vencidos (s) y filtro de Bloom
+    BLOCKLIST_SYNC_INTERVAL = int(os.environ.get('BLOCKLIST_SYNC_INTERVAL', 2))
+    BLOCKLIST_PURGE_INTERVAL = int(os.environ.get('BLOCKLIST_PURGE_INTERVAL', 3600))
+    BLOCKLIST_BLOOM_CAPACITY = int(os.environ.get('BLOCKLIST_BLOOM_CAPACITY', 100000))
+    BLOCKLIST_BLOOM_ERROR_RATE = float(os.environ.get('BLOCKLIST_BLOOM_ERROR_RATE', 0.001))
+
+    # Cache de respuestas del catálogo: 'memory' (LRU por proceso), 'redis' (compartido) o 'none'
+    CATALOG_CACHE_BACKEND = os.environ.get('CATALOG_CACHE_BACKEND', 'memory')
+    CATALOG_CACHE_URL = os.environ.get('CATALOG_CACHE_URL')
+    CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', 300))
+    CATALOG_CACHE_MAX_ENTRIES = int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', 2048))
+    CATALOG_CACHE_MAX_BYTES = int(os.environ.get('CATALOG_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    # max-age (segundos) del Cache-Control de las respuestas públicas del catálogo
+    CATALOG_HTTP_MAX_AGE = int(os.environ.get('CATALOG_HTTP_MAX_AGE', 60))
+    # Antigüedad máxima (segundos) del snapshot de /api/products/stats antes de refrescarlo
+    PRODUCT_STATS_MAX_AGE = int(os.environ.get('PRODUCT_STATS_MAX_AGE', 60))
+    # Vida máxima (segundos) del árbol de categorías en memoria; se reconstruye antes si cambia el catálogo
+    CATEGORY_TREE_TTL = int(os.environ.get('CATEGORY_TREE_TTL', 300))
+    # Límites (ascendentes, separados por coma) de los buckets de precio de ?facets=price
+    PRODUCT_FACET_PRICE_BUCKETS = os.environ.get('PRODUCT_FACET_PRICE_BUCKETS', '0,25,50,100,250,500')
+    # Máximo de operaciones aceptadas por POST /api/cart/cart/batch
+    CART_BATCH_MAX_OPERATIONS = int(os.environ.get('CART_BATCH_MAX_OPERATIONS', 100))
+    # Carritos de invitado: 'database' (filas en carts), 'memory' (por proceso, tests) o 'redis' (compartido)
+    GUEST_CART_BACKEND = os.environ.get('GUEST_CART_BACKEND', 'database')
+    GUEST_CART_URL = os.environ.get('GUEST_CART_URL')
+    # Vida (segundos) de un carrito de invitado desde su último cambio
+    GUEST_CART_TTL = int(os.environ.get('GUEST_CART_TTL', 7 * 24 * 3600))
+    # flask carts reap: carritos de invitado en PostgreSQL sin cambios desde hace más de N segundos
+    CART_ABANDONED_MAX_AGE = int(os.environ.get('CART_ABANDONED_MAX_AGE', 30 * 24 * 3600))
+    CART_REAP_BATCH_SIZE = int(os.environ.get('CART_REAP_BATCH_SIZE', 1000))
+
+    # Reservas de stock de los carritos: segundos que se retienen las unidades (0 las desactiva)
+    STOCK_HOLD_TTL = int(os.environ.get('STOCK_HOLD_TTL', 15 * 60))
+    # Barrido en segundo plano de reservas vencidas
+    STOCK_HOLD_SWEEP_INTERVAL = int(os.environ.get('STOCK_HOLD_SWEEP_INTERVAL', 60))
+    STOCK_HOLD_SWEEP_BATCH_SIZE = int(os.environ.get('STOCK_HOLD_SWEEP_BATCH_SIZE', 1000))
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -21,6 +76,10 @@ class ProductionConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    # Base de datos de tests/ (se vacía en cada test); sin ella los tests se saltean
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL')
+    # Los tests escriben con SQL directo y cuentan sentencias: sin caché del catálogo
+    CATALOG_CACHE_TTL = 0
 
 config = {
     'development': DevelopmentConfig,
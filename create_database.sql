@@ -1,5 +1,5 @@
 -- Base de datos para Ecommerce
--- PostgreSQL Schema
+-- PostgreSQL Schema (requiere PostgreSQL 15+: índices únicos NULLS NOT DISTINCT)
 
 -- Extensiones útiles
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
@@ -16,6 +16,7 @@ CREATE TABLE IF NOT EXISTS users (
     date_of_birth DATE,
     is_active BOOLEAN DEFAULT TRUE,
     is_verified BOOLEAN DEFAULT FALSE,
+    deletion_requested_at TIMESTAMP WITH TIME ZONE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
@@ -66,11 +67,21 @@ CREATE TABLE products (
     is_active BOOLEAN DEFAULT TRUE,
     is_featured BOOLEAN DEFAULT FALSE,
     stock_quantity INTEGER DEFAULT 0,
+    reserved_quantity INTEGER NOT NULL DEFAULT 0, -- Retenido por reservas (ver stock_reservations)
     low_stock_threshold INTEGER DEFAULT 5,
     manage_stock BOOLEAN DEFAULT TRUE,
     allow_backorders BOOLEAN DEFAULT FALSE,
     meta_title VARCHAR(255),
     meta_description TEXT,
+    -- Agregados de reseñas aprobadas (ver ProductReview)
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    rating_1_count INTEGER NOT NULL DEFAULT 0,
+    rating_2_count INTEGER NOT NULL DEFAULT 0,
+    rating_3_count INTEGER NOT NULL DEFAULT 0,
+    rating_4_count INTEGER NOT NULL DEFAULT 0,
+    rating_5_count INTEGER NOT NULL DEFAULT 0,
+    search_vector TSVECTOR, -- Mantenido por products_search_vector_trigger
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
@@ -92,6 +103,7 @@ CREATE TABLE product_variants (
     compare_price DECIMAL(10,2),
     cost_price DECIMAL(10,2),
     stock_quantity INTEGER DEFAULT 0,
+    reserved_quantity INTEGER NOT NULL DEFAULT 0, -- Retenido por reservas (ver stock_reservations)
     weight DECIMAL(8,3),
     is_active BOOLEAN DEFAULT TRUE,
     attributes JSONB, -- {color: "red", size: "M"}
@@ -108,7 +120,17 @@ CREATE TABLE product_images (
     alt_text VARCHAR(255),
     sort_order INTEGER DEFAULT 0,
     is_primary BOOLEAN DEFAULT FALSE,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Documentos de detalle precalculados (producto + variantes + imágenes + categorías)
+CREATE TABLE product_documents (
+    product_id UUID PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    slug VARCHAR(255) UNIQUE NOT NULL,
+    document JSONB NOT NULL,
+    etag VARCHAR(40) NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Tabla de carritos de compra
@@ -116,6 +138,9 @@ CREATE TABLE carts (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     user_id UUID REFERENCES users(id) ON DELETE CASCADE,
     session_id VARCHAR(255), -- Para usuarios no logueados
+    subtotal DECIMAL(12,2) NOT NULL DEFAULT 0, -- Totales mantenidos al modificar los items
+    total_items INTEGER NOT NULL DEFAULT 0,
+    items_count INTEGER NOT NULL DEFAULT 0,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     CONSTRAINT cart_owner_check CHECK (
@@ -247,20 +272,53 @@ CREATE TABLE wishlists (
     UNIQUE(user_id, product_id)
 );
 
+-- Tabla de tokens revocados (logout); las filas se purgan cuando vence el token
+CREATE TABLE revoked_tokens (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    jti VARCHAR(120) NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Reservas temporales de stock por línea de carrito; también se cuentan en reserved_quantity.
+-- Sin clave foránea al carrito: las reservas huérfanas vencen y las libera el barrido
+CREATE TABLE stock_reservations (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    cart_id UUID NOT NULL,
+    product_id UUID NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    variant_id UUID REFERENCES product_variants(id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Posibles índices para optimizar consultas
 CREATE INDEX idx_users_email ON users(email);
 CREATE INDEX idx_products_slug ON products(slug);
 CREATE INDEX idx_products_is_active ON products(is_active);
 CREATE INDEX idx_products_is_featured ON products(is_featured);
+CREATE INDEX idx_products_created_at_id ON products(created_at, id);
+CREATE INDEX idx_products_name_id ON products(name, id);
+CREATE INDEX idx_products_price_id ON products(price, id);
+CREATE INDEX idx_products_search_vector ON products USING gin(search_vector);
 CREATE INDEX idx_product_variants_product_id ON product_variants(product_id);
 CREATE INDEX idx_product_images_product_id ON product_images(product_id);
+CREATE INDEX idx_carts_user_id ON carts(user_id);
+CREATE INDEX idx_carts_session_id ON carts(session_id);
+CREATE INDEX idx_carts_updated_at ON carts(updated_at);
 CREATE INDEX idx_cart_items_cart_id ON cart_items(cart_id);
+CREATE UNIQUE INDEX uq_cart_items_line ON cart_items(cart_id, product_id, variant_id) NULLS NOT DISTINCT;
 CREATE INDEX idx_orders_user_id ON orders(user_id);
 CREATE INDEX idx_orders_status ON orders(status);
 CREATE INDEX idx_orders_created_at ON orders(created_at);
 CREATE INDEX idx_order_items_order_id ON order_items(order_id);
 CREATE INDEX idx_payments_order_id ON payments(order_id);
 CREATE INDEX idx_product_reviews_product_id ON product_reviews(product_id);
+CREATE UNIQUE INDEX ix_revoked_tokens_jti ON revoked_tokens(jti);
+CREATE INDEX ix_revoked_tokens_expires_at ON revoked_tokens(expires_at);
+CREATE INDEX ix_revoked_tokens_created_at ON revoked_tokens(created_at);
+CREATE UNIQUE INDEX uq_stock_reservations_line ON stock_reservations(cart_id, product_id, variant_id) NULLS NOT DISTINCT;
+CREATE INDEX idx_stock_reservations_expires_at ON stock_reservations(expires_at);
 
 -- Función para actualizar timestamp automáticamente
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -275,8 +333,15 @@ $$ language 'plpgsql';
 CREATE TRIGGER update_users_updated_at BEFORE UPDATE ON users FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
 CREATE TRIGGER update_addresses_updated_at BEFORE UPDATE ON addresses FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
 CREATE TRIGGER update_categories_updated_at BEFORE UPDATE ON categories FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
-CREATE TRIGGER update_products_updated_at BEFORE UPDATE ON products FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
-CREATE TRIGGER update_product_variants_updated_at BEFORE UPDATE ON product_variants FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
+-- Productos y variantes: mover reserved_quantity (reservas de carritos) no cambia updated_at,
+-- que es la base de los ETag y de los documentos del catálogo
+CREATE TRIGGER update_products_updated_at BEFORE UPDATE ON products FOR EACH ROW
+    WHEN ((to_jsonb(OLD) - 'reserved_quantity') IS DISTINCT FROM (to_jsonb(NEW) - 'reserved_quantity'))
+    EXECUTE PROCEDURE update_updated_at_column();
+CREATE TRIGGER update_product_variants_updated_at BEFORE UPDATE ON product_variants FOR EACH ROW
+    WHEN ((to_jsonb(OLD) - 'reserved_quantity') IS DISTINCT FROM (to_jsonb(NEW) - 'reserved_quantity'))
+    EXECUTE PROCEDURE update_updated_at_column();
+CREATE TRIGGER update_product_images_updated_at BEFORE UPDATE ON product_images FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
 CREATE TRIGGER update_carts_updated_at BEFORE UPDATE ON carts FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
 CREATE TRIGGER update_cart_items_updated_at BEFORE UPDATE ON cart_items FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
 CREATE TRIGGER update_coupons_updated_at BEFORE UPDATE ON coupons FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
@@ -284,6 +349,23 @@ CREATE TRIGGER update_orders_updated_at BEFORE UPDATE ON orders FOR EACH ROW EXE
 CREATE TRIGGER update_payments_updated_at BEFORE UPDATE ON payments FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
 CREATE TRIGGER update_product_reviews_updated_at BEFORE UPDATE ON product_reviews FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
 
+-- Documento de búsqueda ponderado: name/sku (A) > short_description (B) > description (C)
+CREATE OR REPLACE FUNCTION products_search_vector_update()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.sku, '')), 'A') ||
+        setweight(to_tsvector('spanish', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('spanish', coalesce(NEW.short_description, '')), 'B') ||
+        setweight(to_tsvector('spanish', coalesce(NEW.description, '')), 'C');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, short_description, description, sku ON products
+    FOR EACH ROW EXECUTE PROCEDURE products_search_vector_update();
+
 -- Función para generar número de orden único
 CREATE OR REPLACE FUNCTION generate_order_number()
 RETURNS VARCHAR(50) AS $$
@@ -0,0 +1,144 @@
+import os
+import threading
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+
+os.environ.setdefault('SECRET_KEY', 'test-secret-key')
+os.environ.setdefault('JWT_SECRET_KEY', 'test-jwt-secret-key-with-enough-length')
+
+from flask_jwt_extended import create_access_token
+from app import create_app, db
+from app.models import Category, Product, ProductImage, ProductReview, ProductVariant, User
+from app.utils.utils_search import install_search_schema
+
+@pytest.fixture(scope='session')
+def app():
+    """App against TEST_DATABASE_URL (PostgreSQL); the tests are skipped without it"""
+    if not os.environ.get('TEST_DATABASE_URL'):
+        pytest.skip("TEST_DATABASE_URL is not set (PostgreSQL database for the tests)")
+    app = create_app('testing')
+    with app.app_context():
+        try:
+            db.session.execute(text('SELECT 1'))
+        except OperationalError as e:
+            pytest.skip(f"PostgreSQL is not available: {e.orig}")
+        db.drop_all()
+        db.create_all()
+        db.session.commit()
+        install_search_schema()  # El trigger de search_vector no forma parte de los modelos
+    return app
+
+@pytest.fixture(autouse=True)
+def clean_tables(request):
+    """Empty every table before each test that uses the database"""
+    if 'app' not in request.fixturenames:
+        yield
+        return
+    app = request.getfixturevalue('app')
+    with app.app_context():
+        tables = ', '.join(table.name for table in db.metadata.sorted_tables)
+        db.session.execute(text(f'TRUNCATE {tables} CASCADE'))
+        db.session.commit()
+    yield
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def count_statements(app):
+    """Context manager collecting the SQL statements the test's thread sends to
+    the database inside the block (background sweeps are left out)"""
+    with app.app_context():
+        engine = db.engine
+
+    @contextmanager
+    def count_statements():
+        statements = []
+        thread = threading.get_ident()
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if threading.get_ident() == thread:
+                statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    return count_statements
+
+@pytest.fixture
+def fire(app):
+    """fire(requests, send) sends `requests` requests at once, one thread and
+    test client each (send(client) -> response).
+    Returns: the status codes"""
+    def fire(requests, send):
+        statuses = []
+        barrier = threading.Barrier(requests)
+
+        def run():
+            client = app.test_client()
+            barrier.wait()
+            statuses.append(send(client).status_code)
+
+        threads = [threading.Thread(target=run) for _ in range(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return statuses
+
+    return fire
+
+@pytest.fixture
+def user(app):
+    """A registered user and the headers of its access token"""
+    with app.app_context():
+        account = User('shopper@example.com', 'Passw0rd!', 'Test', 'Shopper')
+        db.session.add(account)
+        db.session.commit()
+        return {'id': account.id, 'headers': {'Authorization': f'Bearer {create_access_token(identity=str(account.id))}'}}
+
+@pytest.fixture
+def shoppers(app):
+    """Factory: shoppers(n) registers n users.
+    Returns: the headers of their access tokens"""
+    def shoppers(n):
+        with app.app_context():
+            users = [User(f'buyer{i}@example.com', 'Passw0rd!', 'Test', 'Buyer') for i in range(n)]
+            db.session.add_all(users)
+            db.session.commit()
+            return [{'Authorization': f'Bearer {create_access_token(identity=str(account.id))}'} for account in users]
+    return shoppers
+
+@pytest.fixture
+def make_products(app):
+    """Factory: make_products(n, stock) creates n active products, each with a
+    category, a variant, an image and an approved review.
+    Returns: product ids (str)"""
+    def make_products(n, stock=10):
+        with app.app_context():
+            category = Category(name=f'Category {n}', slug=f'category-{n}')
+            reviewer = User(f'reviewer{n}@example.com', 'Passw0rd!', 'Test', 'Reviewer')
+            db.session.add_all([category, reviewer])
+            products = []
+            for i in range(n):
+                product = Product(
+                    name=f'Product {n}-{i}', slug=f'product-{n}-{i}', sku=f'SKU-{n}-{i}',
+                    price=10 + i, stock_quantity=stock, short_description='test', is_featured=True
+                )
+                product.categories.append(category)
+                product.variants.append(ProductVariant(name='Default', sku=f'VAR-{n}-{i}', price=10 + i, stock_quantity=stock))
+                product.images.append(ProductImage(image_url=f'https://example.com/{n}-{i}.jpg', sort_order=1))
+                products.append(product)
+            db.session.add_all(products)
+            db.session.flush()
+            db.session.add_all(ProductReview(product_id=product.id, user_id=reviewer.id, rating=4, is_approved=True) for product in products)
+            db.session.commit()
+            return [str(product.id) for product in products]
+
+    return make_products
@@ -0,0 +1,29 @@
+def add_lines(client, headers, product_ids, quantity=1):
+    for product_id in product_ids:
+        response = client.post('/api/cart/add', json={'product_id': product_id, 'quantity': quantity}, headers=headers)
+        assert response.status_code == 200
+
+def test_get_cart_statements_do_not_grow_with_lines(client, user, make_products, count_statements):
+    """Lines, products, variants and totals come from a fixed number of statements"""
+    product_ids = make_products(10)
+    counts = {}
+    for lines in (1, 10):
+        client.delete('/api/cart/cart/clear', headers=user['headers'])
+        add_lines(client, user['headers'], product_ids[:lines])
+        with count_statements() as statements:
+            response = client.get('/api/cart/get_cart', headers=user['headers'])
+        assert response.status_code == 200
+        assert len(response.json['items']) == lines
+        counts[lines] = len(statements)
+
+    assert counts[10] == counts[1]
+    assert counts[10] == 1
+
+def test_get_cart_totals_match_lines(client, user, make_products):
+    product_ids = make_products(3)
+    add_lines(client, user['headers'], product_ids, quantity=2)
+
+    cart = client.get('/api/cart/get_cart', headers=user['headers']).json
+    assert cart['totals']['items_count'] == 3
+    assert cart['totals']['total_items'] == 6
+    assert cart['totals']['subtotal'] == sum(item['quantity'] * item['unit_price'] for item in cart['items'])
@@ -0,0 +1,62 @@
+from sqlalchemy import text
+from app import db
+
+def cart_lines(app):
+    with app.app_context():
+        return db.session.execute(text('SELECT product_id, quantity FROM cart_items')).all()
+
+def test_concurrent_adds_do_not_lose_updates(app, client, user, make_products, fire):
+    product_id, = make_products(1, stock=100)
+    client.get('/api/cart/get_cart', headers=user['headers'])  # Crea el carrito
+
+    statuses = fire(12, lambda client: client.post(
+        '/api/cart/add', json={'product_id': product_id, 'quantity': 1}, headers=user['headers']
+    ))
+
+    assert statuses == [200] * 12
+    lines = cart_lines(app)
+    assert len(lines) == 1
+    assert lines[0].quantity == 12
+    assert client.get('/api/cart/get_cart', headers=user['headers']).json['totals']['total_items'] == 12
+
+def test_concurrent_adds_stop_at_stock(app, client, user, make_products, fire):
+    product_id, = make_products(1, stock=5)
+    client.get('/api/cart/get_cart', headers=user['headers'])
+
+    statuses = fire(12, lambda client: client.post(
+        '/api/cart/add', json={'product_id': product_id, 'quantity': 1}, headers=user['headers']
+    ))
+
+    assert sorted(statuses) == [200] * 5 + [400] * 7
+    assert cart_lines(app)[0].quantity == 5
+
+def test_concurrent_updates_and_adds_keep_totals(app, client, user, make_products, fire):
+    """Updates and adds race in the same batch; the result matches some serial order"""
+    product_id, = make_products(1, stock=1000)
+    client.post('/api/cart/add', json={'product_id': product_id, 'quantity': 1}, headers=user['headers'])
+    item_id = client.get('/api/cart/get_cart', headers=user['headers']).json['items'][0]['id']
+
+    update = lambda client: client.put('/api/cart/cart/update', json={'item_id': item_id, 'quantity': 3}, headers=user['headers'])
+    add = lambda client: client.post('/api/cart/add', json={'product_id': product_id, 'quantity': 2}, headers=user['headers'])
+    pending = iter([update, add] * 8)
+    statuses = fire(16, lambda client: next(pending)(client))
+
+    assert statuses == [200] * 16
+    # En cualquier orden serial la última actualización deja 3 y cada alta posterior suma 2
+    assert cart_lines(app)[0].quantity in {3 + 2 * adds for adds in range(9)}
+    result = app.test_cli_runner().invoke(args=['carts', 'verify'])
+    assert '0 carts with drifted totals found' in result.output
+
+def test_add_statements_do_not_grow_with_cart(client, user, make_products, count_statements):
+    """Adding a line is a fixed number of round trips whatever the cart holds"""
+    product_ids = make_products(6)
+    counts = []
+    for product_id in product_ids:
+        with count_statements() as statements:
+            response = client.post('/api/cart/add', json={'product_id': product_id, 'quantity': 1}, headers=user['headers'])
+        assert response.status_code == 200
+        counts.append(len(statements))
+
+    # El primero además crea el carrito
+    assert len(set(counts[1:])) == 1
+    assert counts[-1] <= 3
@@ -0,0 +1,76 @@
+from sqlalchemy import text
+from app import db
+
+SHIPPING_ADDRESS = {'street_address': 'Av. Siempre Viva 742', 'city': 'Springfield', 'state': 'BA', 'postal_code': '1000', 'country': 'AR'}
+
+def sales(app, product_id):
+    with app.app_context():
+        return db.session.execute(text("""
+            SELECT p.stock_quantity, p.reserved_quantity,
+                   (SELECT coalesce(sum(quantity), 0) FROM stock_reservations) AS held,
+                   (SELECT coalesce(sum(quantity), 0) FROM order_items) AS sold
+            FROM products p WHERE p.id = :product_id
+        """), {'product_id': product_id}).one()
+
+def concurrently(fire, headers, send):
+    """One request per shopper, all at once"""
+    pending = iter(headers)
+    return fire(len(headers), lambda client: send(client, next(pending)))
+
+def add_one(product_id):
+    return lambda client, headers: client.post('/api/cart/add', json={'product_id': product_id, 'quantity': 1}, headers=headers)
+
+def checkout(client, headers):
+    return client.post('/api/orders/checkout', json={'shipping_address': SHIPPING_ADDRESS}, headers=headers)
+
+def test_checkout_turns_the_cart_into_an_order(app, client, user, make_products):
+    product_id, = make_products(1, stock=5)
+    client.post('/api/cart/add', json={'product_id': product_id, 'quantity': 2}, headers=user['headers'])
+
+    response = checkout(client, user['headers'])
+
+    assert response.status_code == 201
+    order = response.json['order']
+    assert [(item['product_id'], item['quantity']) for item in order['items']] == [(product_id, 2)]
+    assert client.get('/api/cart/get_cart', headers=user['headers']).json['items'] == []
+    assert tuple(sales(app, product_id)) == (3, 0, 0, 2)
+
+def test_concurrent_checkouts_sell_exactly_the_stock(app, make_products, shoppers, fire):
+    """Holds first, then every shopper checks out at once: the held units are sold, no more"""
+    product_id, = make_products(1, stock=5)
+    headers = shoppers(12)
+    concurrently(fire, headers, add_one(product_id))
+
+    statuses = concurrently(fire, headers, checkout)
+
+    assert sorted(statuses) == [201] * 5 + [400] * 7  # Carrito vacío: su reserva no alcanzó
+    assert tuple(sales(app, product_id)) == (0, 0, 0, 5)
+
+def test_concurrent_checkouts_without_holds_do_not_oversell(app, make_products, shoppers, fire, monkeypatch):
+    """With holds disabled every cart takes the last units and checkout is the only guard"""
+    monkeypatch.setitem(app.config, 'STOCK_HOLD_TTL', 0)
+    product_id, = make_products(1, stock=5)
+    headers = shoppers(12)
+    assert concurrently(fire, headers, add_one(product_id)) == [200] * 12
+
+    statuses = concurrently(fire, headers, checkout)
+
+    assert sorted(statuses) == [201] * 5 + [409] * 7
+    state = sales(app, product_id)
+    assert (state.stock_quantity, state.sold) == (0, 5)
+
+def test_checkout_skips_untracked_and_backordered_stock(app, client, user, make_products):
+    untracked, backordered = make_products(2, stock=5)
+    for product_id in (untracked, backordered):
+        client.post('/api/cart/add', json={'product_id': product_id, 'quantity': 3}, headers=user['headers'])
+    with app.app_context():
+        # Sólo queda una unidad, pero ninguno de los dos descuenta stock en el checkout
+        db.session.execute(text("""
+            UPDATE products SET stock_quantity = 1,
+                   manage_stock = (id <> CAST(:untracked AS uuid)),
+                   allow_backorders = (id = CAST(:backordered AS uuid))
+        """), {'untracked': untracked, 'backordered': backordered})
+        db.session.commit()
+
+    assert checkout(client, user['headers']).status_code == 201
+    assert sales(app, untracked).stock_quantity == sales(app, backordered).stock_quantity == 1
@@ -0,0 +1,48 @@
+from sqlalchemy import event, text
+from app import db
+from app.models import Category, ProductDocument
+from app.utils.utils_documents import get_product_document
+
+SHIPPING_ADDRESS = {'street_address': 'Av. Siempre Viva 742', 'city': 'Springfield', 'state': 'BA', 'postal_code': '1000', 'country': 'AR'}
+
+def test_checkout_rebuilds_documents_after_commit(app, client, user, make_products):
+    """The documents are serialized once the checkout released its stock locks"""
+    product_id, = make_products(1, stock=5)
+    assert client.get(f'/api/products/{product_id}').json['stock_quantity'] == 5
+    client.post('/api/cart/add', json={'product_id': product_id, 'quantity': 2}, headers=user['headers'])
+    with app.app_context():
+        engine = db.engine
+
+    log = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        log.append(statement)
+    def commit(conn):
+        log.append('COMMIT')
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'commit', commit)
+    try:
+        response = client.post('/api/orders/checkout', json={'shipping_address': SHIPPING_ADDRESS}, headers=user['headers'])
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        event.remove(engine, 'commit', commit)
+
+    assert response.status_code == 201
+    taken = next(i for i, statement in enumerate(log) if 'UPDATE products SET stock_quantity' in statement)
+    rebuilt = next(i for i, statement in enumerate(log) if 'INSERT INTO product_documents' in statement)
+    assert 'COMMIT' in log[taken:rebuilt]
+    assert client.get(f'/api/products/{product_id}').json['stock_quantity'] == 3
+
+def test_lazy_document_build_leaves_the_session_transaction_alone(app, make_products):
+    product_id, = make_products(1)
+    with app.app_context():
+        db.session.execute(text('DELETE FROM product_documents'))
+        db.session.commit()
+
+        db.session.add(Category(name='Pending', slug='pending'))
+        db.session.flush()
+        document = get_product_document(product_id=product_id)
+        db.session.rollback()
+
+        assert document.document['id'] == product_id
+        assert db.session.query(ProductDocument).count() == 1
+        assert db.session.query(Category).filter_by(slug='pending').count() == 0
@@ -0,0 +1,57 @@
+import pytest
+from app import db
+from app.models import Product
+
+LISTINGS = [
+    '/api/products/all?category_slug=category-20&include_variants=1&include_images=1',
+    '/api/products/featured?include_variants=1',
+    '/api/products/category/category-20?include_variants=1&include_images=1',
+    '/api/products/search?q=product',
+]
+
+@pytest.mark.parametrize('listing', LISTINGS)
+def test_listing_statements_do_not_grow_with_page_size(client, make_products, count_statements, listing):
+    """Variants, images, categories and ratings are loaded per page, not per product"""
+    make_products(20)
+    counts = {}
+    for per_page in (2, 20):
+        url = f'{listing}&per_page={per_page}'
+        assert client.get(url).status_code == 200  # Documentos y árbol de categorías ya construidos
+        with count_statements() as statements:
+            response = client.get(url)
+        assert response.status_code == 200
+        assert len(response.json['products']) == per_page
+        counts[per_page] = len(statements)
+
+    assert counts[20] == counts[2]
+    assert counts[20] <= 5
+
+def test_listing_includes_hydrated_relations(client, make_products):
+    make_products(3)
+    products = client.get('/api/products/all?category_slug=category-3&include_variants=1&include_images=1').json['products']
+
+    assert len(products) == 3
+    for product in products:
+        assert len(product['variants']) == 1
+        assert len(product['images']) == 1
+        assert [category['slug'] for category in product['categories']] == ['category-3']
+        assert product['average_rating'] == 4
+        assert product['review_count'] == 1
+
+def test_listing_answers_304_until_the_catalog_changes(app, client, make_products, count_statements):
+    """The page validator works with the cache off (CATALOG_CACHE_TTL = 0 in testing)"""
+    product_id, = make_products(1)
+    etag = client.get('/api/products/all').headers['ETag']
+
+    with count_statements() as statements:
+        response = client.get('/api/products/all', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert statements == []
+    assert client.get('/api/products/all?page=1', headers={'If-None-Match': etag}).status_code == 200
+
+    with app.app_context():
+        db.session.get(Product, product_id).price = 99
+        db.session.commit()
+    response = client.get('/api/products/all', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
@@ -0,0 +1,52 @@
+from app import db
+from app.models import Product, ProductReview, User
+from app.utils.utils_products import recompute_rating_aggregates
+
+def aggregates(product_id):
+    product = db.session.get(Product, product_id)
+    return product.rating_sum, product.rating_count, [getattr(product, f'rating_{star}_count') for star in range(1, 6)]
+
+def test_approved_reviews_maintain_aggregates(app, make_products):
+    product_id, = make_products(1)  # Con una reseña aprobada de 4 estrellas
+    with app.app_context():
+        reviewer = User('critic@example.com', 'Passw0rd!', 'Test', 'Critic')
+        db.session.add(reviewer)
+        db.session.flush()
+        review = ProductReview(product_id=product_id, user_id=reviewer.id, rating=2)
+        db.session.add(review)
+        db.session.commit()
+        assert aggregates(product_id) == (4, 1, [0, 0, 0, 1, 0])  # Pendiente de aprobación
+
+        review.is_approved = True
+        db.session.commit()
+        assert aggregates(product_id) == (6, 2, [0, 1, 0, 1, 0])
+
+        review.rating = 5
+        db.session.commit()
+        assert aggregates(product_id) == (9, 2, [0, 0, 0, 1, 1])
+
+        db.session.delete(review)
+        db.session.commit()
+        assert aggregates(product_id) == (4, 1, [0, 0, 0, 1, 0])
+        assert recompute_rating_aggregates() == 0
+
+def test_out_of_range_ratings_are_left_out(app, make_products):
+    """create_all has no CHECK on rating: an invalid value must not break the flush"""
+    product_id, = make_products(1)
+    with app.app_context():
+        reviewer = User('critic@example.com', 'Passw0rd!', 'Test', 'Critic')
+        db.session.add(reviewer)
+        db.session.flush()
+        review = ProductReview(product_id=product_id, user_id=reviewer.id, rating=7, is_approved=True)
+        db.session.add(review)
+        db.session.commit()
+        assert aggregates(product_id) == (4, 1, [0, 0, 0, 1, 0])
+
+        review.rating = 3
+        db.session.commit()
+        assert aggregates(product_id) == (7, 2, [0, 0, 1, 1, 0])
+
+        review.rating = 0
+        db.session.commit()
+        assert aggregates(product_id) == (4, 1, [0, 0, 0, 1, 0])
+        assert recompute_rating_aggregates() == 0
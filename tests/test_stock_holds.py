@@ -0,0 +1,159 @@
+import threading
+import time
+from sqlalchemy import text
+from app import db
+from app.utils.utils_cart import reap_abandoned_carts
+from app.utils.utils_reservations import commit_cart_holds, sweep_expired_holds, verify_reserved_quantities
+from app.utils.utils_users import erase_user
+
+def stock_state(app, product_id):
+    with app.app_context():
+        return db.session.execute(text("""
+            SELECT p.stock_quantity, p.reserved_quantity,
+                   (SELECT count(*) FROM stock_reservations) AS holds,
+                   (SELECT coalesce(sum(quantity), 0) FROM stock_reservations) AS held
+            FROM products p WHERE p.id = :product_id
+        """), {'product_id': product_id}).one()
+
+def add(client, headers, product_id, quantity=1):
+    return client.post('/api/cart/add', json={'product_id': product_id, 'quantity': quantity}, headers=headers)
+
+def test_concurrent_holds_never_exceed_stock(app, make_products, shoppers, fire):
+    product_id, = make_products(1, stock=5)
+    pending = iter(shoppers(20))
+
+    statuses = fire(20, lambda client: add(client, next(pending), product_id))
+
+    assert sorted(statuses) == [200] * 5 + [400] * 15
+    state = stock_state(app, product_id)
+    assert (state.stock_quantity, state.reserved_quantity, state.held) == (5, 5, 5)
+
+def test_released_line_leaves_no_hold(app, client, user, make_products):
+    product_id, = make_products(1, stock=5)
+    add(client, user['headers'], product_id, quantity=2)
+    item_id = client.get('/api/cart/get_cart', headers=user['headers']).json['items'][0]['id']
+
+    assert client.delete(f'/api/cart/cart/remove/{item_id}', headers=user['headers']).status_code == 200
+
+    state = stock_state(app, product_id)
+    assert (state.reserved_quantity, state.holds) == (0, 0)
+
+def test_reaped_guest_carts_release_their_holds(app, client, make_products):
+    product_id, = make_products(1, stock=5)
+    assert add(client, {}, product_id, quantity=3).status_code == 200
+    with app.app_context():
+        db.session.execute(text("UPDATE carts SET updated_at = now() - interval '2 days'"))
+        db.session.commit()
+        reaped = reap_abandoned_carts(max_age=24 * 3600)
+
+    assert reaped['carts'] == 1
+    state = stock_state(app, product_id)
+    assert (state.reserved_quantity, state.holds) == (0, 0)
+
+def test_erased_user_releases_cart_holds(app, client, user, make_products):
+    product_id, = make_products(1, stock=5)
+    assert add(client, user['headers'], product_id, quantity=3).status_code == 200
+    with app.app_context():
+        erase_user(user['id'])
+
+    state = stock_state(app, product_id)
+    assert (state.reserved_quantity, state.holds) == (0, 0)
+
+def test_sweep_and_checkouts_do_not_deadlock(app, make_products, shoppers):
+    """Carts holding two products checkout while the sweep releases the expired
+    holds of half of them; both lock the stock rows in id order"""
+    product_ids = make_products(2, stock=100)
+    headers = shoppers(16)
+    client = app.test_client()
+    for shopper in headers:
+        for product_id in reversed(product_ids):
+            assert add(client, shopper, product_id).status_code == 200
+    with app.app_context():
+        cart_ids = db.session.execute(text("SELECT id FROM carts ORDER BY id")).scalars().all()
+        db.session.execute(text("""
+            UPDATE stock_reservations SET expires_at = now() - interval '1 minute'
+            WHERE cart_id = ANY(CAST(:cart_ids AS uuid[]))
+        """), {'cart_ids': [str(cart_id) for cart_id in cart_ids[::2]]})
+        db.session.commit()
+
+    errors, taken = [], []
+    barrier = threading.Barrier(len(cart_ids) + 4)
+
+    def run(task):
+        with app.app_context():
+            barrier.wait()
+            try:
+                task()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    def checkout(cart_id):
+        short = commit_cart_holds(cart_id)
+        if short:
+            db.session.rollback()
+        else:
+            db.session.commit()
+            taken.append(cart_id)
+
+    tasks = [lambda cart_id=cart_id: checkout(cart_id) for cart_id in cart_ids]
+    tasks += [lambda: sweep_expired_holds(batch_size=2)] * 4
+    threads = [threading.Thread(target=run, args=(task,)) for task in tasks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(taken) == len(cart_ids)  # 200 unidades libres: ningún checkout queda corto
+    for product_id in product_ids:
+        state = stock_state(app, product_id)
+        assert (state.stock_quantity, state.reserved_quantity, state.holds) == (100 - len(cart_ids), 0, 0)
+    with app.app_context():
+        assert verify_reserved_quantities() == 0
+
+def test_sweep_locks_stock_rows_in_id_order(app, make_products):
+    """A checkout holding the lower product id and then asking for the higher one
+    must not deadlock with a sweep releasing holds on both"""
+    low, high = sorted(make_products(2, stock=10))
+    with app.app_context():
+        # La fila de menor id queda al final del heap: un UPDATE ... FROM la tomaría última
+        db.session.execute(text("UPDATE products SET reserved_quantity = 1 WHERE id = :id"), {'id': high})
+        db.session.execute(text("UPDATE products SET reserved_quantity = 1 WHERE id = :id"), {'id': low})
+        for product_id in (low, high):
+            db.session.execute(text("""
+                INSERT INTO stock_reservations (id, cart_id, product_id, quantity, expires_at)
+                VALUES (gen_random_uuid(), gen_random_uuid(), :product_id, 1, now() - interval '1 minute')
+            """), {'product_id': product_id})
+        db.session.commit()
+        engine = db.engine
+
+    errors = []
+
+    def sweep():
+        with app.app_context():
+            try:
+                sweep_expired_holds()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    lock = "SELECT id FROM products WHERE id = :id FOR UPDATE"
+    with engine.connect() as checkout:
+        transaction = checkout.begin()
+        checkout.execute(text(lock), {'id': low})
+        sweeper = threading.Thread(target=sweep)
+        sweeper.start()
+        time.sleep(0.5)  # El barrido queda esperando una fila que tiene el checkout
+        try:
+            checkout.execute(text(lock), {'id': high})
+            transaction.commit()
+        except Exception as e:
+            errors.append(e)
+            transaction.rollback()
+        sweeper.join()
+
+    assert errors == []
+    assert stock_state(app, low).reserved_quantity == stock_state(app, high).reserved_quantity == 0